@@ -0,0 +1,204 @@
+"""Running multi-annotator aggregates kept next to the annotation log.
+
+The annotation log writer calls ``apply_transition`` whenever one annotator's
+state for one image changes, inside the same transaction as the change itself.
+Per-image rows hold the human rating histogram and the number of agreeing
+annotator pairs; a single global row holds the pooled totals. Reading the
+dashboard numbers is therefore a primary-key lookup no matter how many
+annotations exist.
+
+An annotation's human rating is the AI rating for a thumbs-up and the
+annotator's own rating for a thumbs-down; a thumbs-down without a rating yet
+counts toward agreement but not toward the rating histogram.
+"""
+import sqlite3
+from typing import Dict, Any, Optional, Tuple
+
+RATING_LEVELS = 5
+RATING_COLUMNS = [f"r{level}" for level in range(1, RATING_LEVELS + 1)]
+
+AGGREGATE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS image_aggregates (
+    eval_id INTEGER PRIMARY KEY,
+    ai_rating INTEGER,
+    annotations INTEGER NOT NULL DEFAULT 0,
+    agreements INTEGER NOT NULL DEFAULT 0,
+    {', '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in RATING_COLUMNS)},
+    agreeing_pairs INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS global_aggregates (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    annotations INTEGER NOT NULL DEFAULT 0,
+    agreements INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    annotators INTEGER NOT NULL DEFAULT 0,
+    {', '.join(f'{column} INTEGER NOT NULL DEFAULT 0' for column in RATING_COLUMNS)},
+    agreeing_pairs INTEGER NOT NULL DEFAULT 0,
+    total_pairs INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS annotator_totals (
+    annotator TEXT PRIMARY KEY,
+    annotations INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO global_aggregates (id) VALUES (0);
+"""
+
+# (annotated, agrees, human rating or 0)
+Contribution = Tuple[int, int, int]
+NO_CONTRIBUTION: Contribution = (0, 0, 0)
+
+
+def ensure_schema(conn: sqlite3.Connection) -> bool:
+    """Create the aggregate tables; returns True when they did not exist yet."""
+    existed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_aggregates'"
+    ).fetchone() is not None
+    conn.executescript(AGGREGATE_SCHEMA)
+    return not existed
+
+
+def contribution(feedback: Optional[int], rating: Optional[int], ai_rating: Optional[int]) -> Contribution:
+    if feedback is None:
+        return NO_CONTRIBUTION
+    if feedback:
+        return (1, 1, ai_rating or 0)
+    return (1, 0, rating or 0)
+
+
+def _pairs(count: int) -> int:
+    return count * (count - 1) // 2
+
+
+def apply_transition(conn: sqlite3.Connection, annotator: str, eval_id: int, ai_rating: Optional[int],
+                     before: Contribution, after: Contribution):
+    if before == after:
+        return
+    row = conn.execute(
+        f"SELECT annotations, {', '.join(RATING_COLUMNS)} FROM image_aggregates WHERE eval_id = ?",
+        (eval_id,)
+    ).fetchone()
+    if row is None:
+        conn.execute("INSERT INTO image_aggregates (eval_id, ai_rating) VALUES (?, ?)", (eval_id, ai_rating))
+        annotations, counts = 0, [0] * RATING_LEVELS
+    else:
+        annotations, counts = row[0], list(row[1:])
+
+    annotated_delta = after[0] - before[0]
+    agree_delta = after[1] - before[1]
+    rated_before = sum(counts)
+    pairs_before = sum(_pairs(count) for count in counts)
+    rating_deltas = [0] * RATING_LEVELS
+    if before[2]:
+        rating_deltas[before[2] - 1] -= 1
+    if after[2]:
+        rating_deltas[after[2] - 1] += 1
+    counts = [count + delta for count, delta in zip(counts, rating_deltas)]
+    agreeing_pairs_delta = sum(_pairs(count) for count in counts) - pairs_before
+    total_pairs_delta = _pairs(sum(counts)) - _pairs(rated_before)
+    image_delta = (annotations + annotated_delta > 0) - (annotations > 0)
+
+    rating_updates = ', '.join(f"{column} = {column} + ?" for column in RATING_COLUMNS)
+    conn.execute(
+        f"""UPDATE image_aggregates SET annotations = annotations + ?, agreements = agreements + ?,
+            {rating_updates}, agreeing_pairs = agreeing_pairs + ? WHERE eval_id = ?""",
+        (annotated_delta, agree_delta, *rating_deltas, agreeing_pairs_delta, eval_id)
+    )
+
+    annotator_delta = 0
+    if annotated_delta:
+        previous = conn.execute(
+            "SELECT annotations FROM annotator_totals WHERE annotator = ?", (annotator,)
+        ).fetchone()
+        previous = previous[0] if previous else 0
+        conn.execute(
+            """INSERT INTO annotator_totals (annotator, annotations) VALUES (?, ?)
+               ON CONFLICT (annotator) DO UPDATE SET annotations = annotations + excluded.annotations""",
+            (annotator, annotated_delta)
+        )
+        annotator_delta = (previous + annotated_delta > 0) - (previous > 0)
+
+    conn.execute(
+        f"""UPDATE global_aggregates SET annotations = annotations + ?, agreements = agreements + ?,
+            images = images + ?, annotators = annotators + ?, {rating_updates},
+            agreeing_pairs = agreeing_pairs + ?, total_pairs = total_pairs + ? WHERE id = 0""",
+        (annotated_delta, agree_delta, image_delta, annotator_delta, *rating_deltas,
+         agreeing_pairs_delta, total_pairs_delta)
+    )
+
+
+def rebuild(conn: sqlite3.Connection):
+    """Recompute every aggregate from the current annotations table."""
+    conn.execute("DELETE FROM image_aggregates")
+    conn.execute("DELETE FROM annotator_totals")
+    conn.execute("DELETE FROM global_aggregates")
+    conn.execute("INSERT INTO global_aggregates (id) VALUES (0)")
+    rows = conn.execute("SELECT annotator, eval_id, feedback, rating, ai_rating FROM annotations").fetchall()
+    for annotator, eval_id, feedback, rating, ai_rating in rows:
+        apply_transition(conn, annotator, eval_id, ai_rating, NO_CONTRIBUTION, contribution(feedback, rating, ai_rating))
+
+
+def _consensus(counts) -> Tuple[Optional[int], Optional[float]]:
+    """Majority (lowest rating on ties) and median human rating from a histogram."""
+    rated = sum(counts)
+    if rated == 0:
+        return None, None
+    majority = max(range(RATING_LEVELS), key=lambda level: (counts[level], -level)) + 1
+    # Median of the expanded histogram, averaging the two middle values
+    cumulative = 0
+    middle = []
+    for level, count in enumerate(counts, start=1):
+        for target in ((rated - 1) // 2, rated // 2):
+            if cumulative <= target < cumulative + count:
+                middle.append(level)
+        cumulative += count
+    return majority, sum(middle) / len(middle)
+
+
+def image_summary(conn: sqlite3.Connection, eval_id: int) -> Optional[Dict[str, Any]]:
+    row = conn.execute(
+        f"""SELECT ai_rating, annotations, agreements, {', '.join(RATING_COLUMNS)}, agreeing_pairs
+            FROM image_aggregates WHERE eval_id = ?""",
+        (eval_id,)
+    ).fetchone()
+    if row is None or row[1] == 0:
+        return None
+    ai_rating, annotations, agreements = row[:3]
+    counts = list(row[3:3 + RATING_LEVELS])
+    total_pairs = _pairs(sum(counts))
+    majority, median = _consensus(counts)
+    return {
+        'eval_id': eval_id,
+        'ai_rating': ai_rating,
+        'annotations': annotations,
+        'agreement_rate': round(agreements / annotations * 100, 1),
+        'rating_counts': counts,
+        'majority_rating': majority,
+        'median_rating': median,
+        'annotator_agreement': round(row[-1] / total_pairs * 100, 1) if total_pairs else None,
+    }
+
+
+def global_summary(conn: sqlite3.Connection) -> Dict[str, Any]:
+    row = conn.execute(
+        f"""SELECT annotations, agreements, images, annotators, {', '.join(RATING_COLUMNS)},
+            agreeing_pairs, total_pairs FROM global_aggregates WHERE id = 0"""
+    ).fetchone()
+    annotations, agreements, images, annotators = row[:4]
+    counts = row[4:4 + RATING_LEVELS]
+    agreeing_pairs, total_pairs = row[-2:]
+    rated = sum(counts)
+    observed = agreeing_pairs / total_pairs if total_pairs else None
+    # Chance agreement from the pooled rating distribution, as in Fleiss' kappa
+    expected = sum((count / rated) ** 2 for count in counts) if rated else None
+    kappa = None
+    if observed is not None and expected is not None and expected < 1:
+        kappa = round((observed - expected) / (1 - expected), 3)
+    return {
+        'annotations': annotations,
+        'annotators': annotators,
+        'images': images,
+        'agreement_rate': round(agreements / annotations * 100, 1) if annotations else 0.0,
+        'annotator_agreement': round(observed * 100, 1) if observed is not None else None,
+        'fleiss_kappa': kappa,
+        'rating_counts': list(counts),
+    }
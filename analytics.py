@@ -0,0 +1,158 @@
+"""Vectorized agreement analytics between AI ratings and human annotations.
+
+All statistics are computed from three aligned columns: the AI rating, the
+human rating (the AI rating for a thumbs-up, the annotator's own rating for a
+thumbs-down) and whether the annotator agreed. Disagreements that have no
+annotator rating yet count toward the agreement rate but are left out of the
+rating comparisons.
+"""
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from evaluation_store import AGREE
+
+RATING_LEVELS = 5
+PRODUCTION_THRESHOLD = 0.80
+BOOTSTRAP_SAMPLES = 2000
+CONFIDENCE = 0.95
+# Rolling agreement series are sampled down to at most this many points
+TIMELINE_POINTS = 200
+MIN_WINDOW = 10
+
+
+def store_columns(store):
+    """Columnar (ai_rating, human_rating, agrees) arrays for a session's feedback."""
+    positions = store.annotated()
+    agrees = store.feedback[positions] == AGREE
+    ai = store.ai_ratings[positions]
+    human = np.where(agrees, ai, store.ratings[positions]).astype(np.int8)
+    return ai, human, agrees
+
+
+def confusion_matrix(ai: np.ndarray, human: np.ndarray) -> np.ndarray:
+    """5x5 counts with AI ratings as rows and human ratings as columns."""
+    rated = (human >= 1) & (ai >= 1)
+    cells = (ai[rated].astype(np.int64) - 1) * RATING_LEVELS + (human[rated].astype(np.int64) - 1)
+    return np.bincount(cells, minlength=RATING_LEVELS * RATING_LEVELS).reshape(RATING_LEVELS, RATING_LEVELS)
+
+
+def delta_counts(ai: np.ndarray, human: np.ndarray) -> np.ndarray:
+    """Counts of human minus AI rating for -4..+4, over annotations with both ratings."""
+    rated = (human >= 1) & (ai >= 1)
+    deltas = human[rated].astype(np.int64) - ai[rated] + (RATING_LEVELS - 1)
+    return np.bincount(deltas, minlength=2 * RATING_LEVELS - 1)
+
+
+def rolling_agreement(order: np.ndarray, agrees: np.ndarray, points: int = TIMELINE_POINTS,
+                      window: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Agreement rate (%) over the last ``window`` annotations in ``order``, at up to ``points`` of them.
+
+    Returns the ``order`` value of every sampled annotation, the rates and the
+    window used. The window defaults to a twentieth of the annotations.
+    """
+    count = len(agrees)
+    if count == 0:
+        return order[:0], np.zeros(0), 0
+    sort = np.argsort(order, kind='stable')
+    window = min(count, window or max(MIN_WINDOW, count // 20))
+    cumulative = np.concatenate(([0], np.cumsum(agrees[sort], dtype=np.int64)))
+    ends = np.unique(np.linspace(window, count, num=min(points, count - window + 1)).round().astype(np.int64))
+    rates = (cumulative[ends] - cumulative[ends - window]) / window * 100
+    return order[sort][ends - 1], np.round(rates, 1), window
+
+
+def cohen_kappa(confusion: np.ndarray, weights: Optional[str] = None) -> float:
+    """Cohen's kappa, optionally ``'linear'`` or ``'quadratic'`` weighted."""
+    total = confusion.sum()
+    if total == 0:
+        return 0.0
+    expected = np.outer(confusion.sum(axis=1), confusion.sum(axis=0)) / total
+    levels = np.arange(RATING_LEVELS)
+    distance = np.abs(levels[:, None] - levels[None, :]) / (RATING_LEVELS - 1)
+    if weights is None:
+        penalty = (distance > 0).astype(float)
+    elif weights == 'linear':
+        penalty = distance
+    elif weights == 'quadratic':
+        penalty = distance ** 2
+    else:
+        raise ValueError(f"Unknown kappa weighting: {weights}")
+    expected_penalty = (penalty * expected).sum()
+    if expected_penalty == 0:
+        return 1.0
+    return float(1 - (penalty * confusion).sum() / expected_penalty)
+
+
+def bootstrap_agreement(agreement_count: int, total: int, samples: int = BOOTSTRAP_SAMPLES,
+                        confidence: float = CONFIDENCE, seed: int = 0) -> Dict[str, float]:
+    """Percentile bootstrap of the agreement rate and the share of resamples above threshold.
+
+    Resampling n Bernoulli outcomes with replacement gives a Binomial(n, p) count,
+    so the bootstrap distribution is drawn directly instead of materializing
+    ``samples x total`` indices.
+    """
+    if total == 0:
+        return {'ci_low': 0.0, 'ci_high': 0.0, 'prob_meets_threshold': 0.0}
+    rng = np.random.default_rng(seed)
+    rates = rng.binomial(total, agreement_count / total, size=samples) / total
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(rates, [tail, 1 - tail])
+    return {
+        'ci_low': float(low),
+        'ci_high': float(high),
+        'prob_meets_threshold': float((rates >= PRODUCTION_THRESHOLD).mean()),
+    }
+
+
+def per_level_agreement(ai: np.ndarray, human: np.ndarray, agrees: np.ndarray) -> pd.DataFrame:
+    """Agreement rate and mean human rating for each AI rating level."""
+    ai = ai.astype(np.int64)
+    counts = np.bincount(ai, minlength=RATING_LEVELS + 1)[1:]
+    agreed = np.bincount(ai, weights=agrees, minlength=RATING_LEVELS + 1)[1:]
+    rated = human >= 1
+    rated_counts = np.bincount(ai[rated], minlength=RATING_LEVELS + 1)[1:]
+    human_sums = np.bincount(ai[rated], weights=human[rated], minlength=RATING_LEVELS + 1)[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame({
+            'AI Rating': np.arange(1, RATING_LEVELS + 1),
+            'Annotations': counts,
+            'Agreement Rate (%)': np.round(np.where(counts > 0, agreed / counts * 100, np.nan), 1),
+            'Mean Human Rating': np.round(np.where(rated_counts > 0, human_sums / rated_counts, np.nan), 2),
+        })
+
+
+def analyze(ai: np.ndarray, human: np.ndarray, agrees: np.ndarray) -> Dict[str, Any]:
+    feedback_count = int(len(agrees))
+    agreement_count = int(np.count_nonzero(agrees))
+    disagreement_count = feedback_count - agreement_count
+    agreement_rate = (agreement_count / feedback_count * 100) if feedback_count > 0 else 0
+    disagreement_rate = (disagreement_count / feedback_count * 100) if feedback_count > 0 else 0
+
+    confusion = confusion_matrix(ai, human)
+    rated = human >= 1
+    deltas = human[rated].astype(np.int64) - ai[rated]
+    interval = bootstrap_agreement(agreement_count, feedback_count)
+
+    return {
+        'agreement_rate': round(agreement_rate, 1),
+        'disagreement_rate': round(disagreement_rate, 1),
+        'feedback_count': feedback_count,
+        'agreement_count': agreement_count,
+        'disagreement_count': disagreement_count,
+        'confusion_matrix': confusion,
+        'delta_counts': delta_counts(ai, human),
+        'kappa': round(cohen_kappa(confusion), 3),
+        'weighted_kappa': round(cohen_kappa(confusion, 'quadratic'), 3),
+        'mean_bias': round(float(deltas.mean()), 3) if len(deltas) else 0.0,
+        'higher_count': int(np.count_nonzero(deltas > 0)),
+        'lower_count': int(np.count_nonzero(deltas < 0)),
+        'agreement_ci': (round(interval['ci_low'] * 100, 1), round(interval['ci_high'] * 100, 1)),
+        'prob_meets_threshold': round(interval['prob_meets_threshold'], 3),
+        'per_level': per_level_agreement(ai, human, agrees),
+    }
+
+
+def analyze_store(store) -> Dict[str, Any]:
+    return analyze(*store_columns(store))
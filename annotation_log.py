@@ -0,0 +1,443 @@
+"""Durable, append-only log of annotator actions in SQLite (WAL mode).
+
+Every thumbs-up/down, rating change, reset and submission is appended to the
+``events`` table and folded into ``annotations``, which holds the current state
+per (annotator, evaluation) so a session can be resumed with one indexed query.
+Callers only enqueue; a single writer thread drains the queue and commits
+whatever has accumulated in one transaction (group commit), keeping the cost
+of a click to a queue put. The same transaction keeps the multi-annotator
+aggregates in ``aggregation`` and the drill-down rollups in ``rollups`` up to
+date.
+
+Submitted annotations are never deleted. A reset only drops what the annotator
+changed since their last submit, restoring the submitted state of anything
+they re-annotated, and starts a new session: resuming loads only the
+annotations changed since it started.
+
+A batch that fails to commit is retried once and then dropped. ``flush``
+reports a dropped batch, and ``dropped`` counts the lost events of each
+annotator, so callers can report or resend them instead of claiming success.
+If the log cannot be opened, readers get ``AnnotationLogError``; every wait is
+bounded by ``EVALUATOR_ANNOTATION_LOG_TIMEOUT``.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+import aggregation
+import rollups
+import settings
+from evaluation_store import AGREE
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    annotator TEXT NOT NULL,
+    eval_id INTEGER,
+    kind TEXT NOT NULL,
+    value INTEGER,
+    ai_rating INTEGER,
+    position INTEGER,
+    ts REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    annotator TEXT NOT NULL,
+    eval_id INTEGER NOT NULL,
+    feedback INTEGER,
+    rating INTEGER,
+    ai_rating INTEGER,
+    position INTEGER,
+    updated REAL NOT NULL,
+    PRIMARY KEY (annotator, eval_id)
+) WITHOUT ROWID;
+"""
+
+SESSION_SCHEMA = """
+-- When each annotator last submitted, and when their current session started
+CREATE TABLE IF NOT EXISTS sessions (
+    annotator TEXT PRIMARY KEY,
+    started REAL NOT NULL DEFAULT 0,
+    submitted REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+-- Submitted state of annotations changed since their annotator's last submit, restored by a reset
+CREATE TABLE IF NOT EXISTS submitted (
+    annotator TEXT NOT NULL,
+    eval_id INTEGER NOT NULL,
+    feedback INTEGER,
+    rating INTEGER,
+    ai_rating INTEGER,
+    position INTEGER,
+    updated REAL NOT NULL,
+    PRIMARY KEY (annotator, eval_id)
+) WITHOUT ROWID;
+"""
+
+# (annotator, eval_id, kind, value, ai_rating, position, ts, (description, model_version) or None);
+# the last item only feeds the rollup dimensions and is not stored with the event
+Event = Tuple[str, Optional[int], str, Optional[int], Optional[int], Optional[int], float,
+              Optional[Tuple[Optional[str], Optional[str]]]]
+
+
+class AnnotationLogError(Exception):
+    """The log could not be opened, or did not answer in time."""
+
+
+class _Flush:
+    """Queued behind earlier events; set by the writer once they are committed or dropped."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.failed = False
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def ensure_session_schema(conn: sqlite3.Connection) -> bool:
+    """Create the session tables; returns True when they did not exist yet."""
+    existed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'"
+    ).fetchone() is not None
+    conn.executescript(SESSION_SCHEMA)
+    return not existed
+
+
+class AnnotationLog:
+    def __init__(self, path: str, batch_size: int = 512, timeout: float = 30.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.commits = 0
+        self.events_written = 0
+        self.events_dropped = 0
+        # Events dropped after failed commits, by annotator
+        self._dropped: Counter = Counter()
+        # Why the writer could not open the log, if it could not
+        self._error: Optional[BaseException] = None
+        self._queue: "queue.Queue" = queue.Queue()
+        # Separate connection for reads so resume never waits on the writer thread
+        try:
+            self._read_conn: Optional[sqlite3.Connection] = connect(path)
+        except sqlite3.Error as error:
+            logger.exception("Failed to open annotation log %s", path)
+            self._read_conn = None
+            self._error = error
+        self._read_lock = threading.Lock()
+        # Set once the writer has created (and if needed backfilled) the aggregates, or failed to
+        self._ready = threading.Event()
+        self._writer = threading.Thread(target=self._run, name='annotation-log-writer', daemon=True)
+        self._writer.start()
+
+    def _enqueue(self, annotator: str, eval_id: Optional[int], kind: str, value: Optional[int] = None,
+                 ai_rating: Optional[int] = None, position: Optional[int] = None, dimensions=None):
+        self._queue.put((annotator, eval_id, kind, value, ai_rating, position, time.time(), dimensions))
+
+    def record_feedback(self, annotator: str, eval_id: int, agrees: bool, ai_rating: int, position: int,
+                        description: Optional[str] = None, model_version: Optional[str] = None):
+        self._enqueue(annotator, eval_id, 'feedback', int(agrees), ai_rating, position, (description, model_version))
+
+    def record_rating(self, annotator: str, eval_id: int, rating: Optional[int]):
+        self._enqueue(annotator, eval_id, 'rating', rating)
+
+    def record_reset(self, annotator: str):
+        self._enqueue(annotator, None, 'reset')
+
+    def record_submit(self, annotator: str):
+        self._enqueue(annotator, None, 'submit')
+
+    def _wait_ready(self):
+        if not self._ready.wait(self.timeout):
+            raise AnnotationLogError(f"annotation log {self.path} did not open within {self.timeout}s")
+        if self._error is not None:
+            raise AnnotationLogError(f"annotation log {self.path} could not be opened: {self._error}")
+
+    def available(self) -> bool:
+        """Whether the log opened, waiting for it if it is still starting."""
+        try:
+            self._wait_ready()
+        except AnnotationLogError:
+            return False
+        return True
+
+    def _drain(self, timeout: Optional[float] = None) -> _Flush:
+        """Wait until everything enqueued so far is committed or dropped."""
+        self._wait_ready()
+        marker = _Flush()
+        self._queue.put(marker)
+        if not marker.done.wait(self.timeout if timeout is None else timeout):
+            raise AnnotationLogError(f"annotation log {self.path} did not commit within {self.timeout}s")
+        return marker
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything enqueued so far is committed.
+
+        Returns False when the log is unavailable, the wait timed out, or the
+        last batch before the flush was dropped.
+        """
+        try:
+            marker = self._drain(timeout)
+        except AnnotationLogError:
+            logger.exception("Annotation log flush failed")
+            return False
+        return not marker.failed
+
+    def dropped(self, annotator: str) -> int:
+        """How many of ``annotator``'s events could not be written."""
+        return self._dropped[annotator]
+
+    def load_session(self, annotator: str) -> List[Tuple[int, Optional[int], Optional[int], Optional[int], Optional[int]]]:
+        """(eval_id, feedback, rating, ai_rating, position) rows of ``annotator``'s current session."""
+        self._drain()
+        with self._read_lock:
+            return self._read_conn.execute(
+                """SELECT eval_id, feedback, rating, ai_rating, position FROM annotations
+                   WHERE annotator = ? AND updated >= COALESCE((SELECT started FROM sessions WHERE annotator = ?), 0)""",
+                (annotator, annotator)
+            ).fetchall()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = connect(self.path)
+        with conn:
+            if aggregation.ensure_schema(conn):
+                # Logs written before aggregates existed start from their annotations
+                aggregation.rebuild(conn)
+            if rollups.ensure_schema(conn):
+                rollups.rebuild(conn)
+            if ensure_session_schema(conn):
+                # Everything annotated before the last submit counts as submitted
+                conn.execute("INSERT INTO sessions (annotator, submitted) "
+                             "SELECT annotator, MAX(ts) FROM events WHERE kind = 'submit' GROUP BY annotator")
+        return conn
+
+    def _run(self):
+        try:
+            conn = self._open()
+        except BaseException as error:
+            logger.exception("Failed to open annotation log %s", self.path)
+            self._error = error
+            conn = None
+        finally:
+            self._ready.set()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            events = [item for item in batch if not isinstance(item, _Flush)]
+            failed = bool(events) and not self._commit(conn, events)
+            for item in batch:
+                if isinstance(item, _Flush):
+                    item.failed = failed
+                    item.done.set()
+
+    def _commit(self, conn: Optional[sqlite3.Connection], events: List[Event]) -> bool:
+        """Write ``events`` in one transaction, retrying once; False when they were dropped."""
+        for attempt in range(2):
+            if conn is None:
+                break
+            try:
+                with conn:
+                    self._apply(conn, events)
+            except Exception:
+                logger.exception("Failed to write %d annotation events (attempt %d)", len(events), attempt + 1)
+                if attempt == 0:
+                    time.sleep(RETRY_DELAY)
+            else:
+                self.commits += 1
+                self.events_written += len(events)
+                return True
+        self.events_dropped += len(events)
+        self._dropped.update(event[0] for event in events)
+        return False
+
+    def _apply(self, conn: sqlite3.Connection, events: List[Event]):
+        conn.executemany(
+            "INSERT INTO events (annotator, eval_id, kind, value, ai_rating, position, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [event[:7] for event in events]
+        )
+        for annotator, eval_id, kind, value, ai_rating, position, ts, dimensions in events:
+            if kind in ('feedback', 'rating'):
+                before = self._annotation(conn, annotator, eval_id)
+                if before[3] is not None and before[3] <= self._submitted_at(conn, annotator):
+                    # Kept so a reset can bring the submitted state back
+                    conn.execute(
+                        """INSERT OR IGNORE INTO submitted (annotator, eval_id, feedback, rating, ai_rating, position, updated)
+                           SELECT annotator, eval_id, feedback, rating, ai_rating, position, updated
+                           FROM annotations WHERE annotator = ? AND eval_id = ?""",
+                        (annotator, eval_id)
+                    )
+            if kind == 'feedback':
+                if dimensions is not None:
+                    rollups.record_dimensions(conn, eval_id, *dimensions)
+                conn.execute(
+                    """INSERT INTO annotations (annotator, eval_id, feedback, rating, ai_rating, position, updated)
+                       VALUES (?, ?, ?, NULL, ?, ?, ?)
+                       ON CONFLICT (annotator, eval_id) DO UPDATE SET
+                           feedback = excluded.feedback,
+                           rating = CASE WHEN excluded.feedback = 1 THEN NULL ELSE rating END,
+                           updated = excluded.updated""",
+                    (annotator, eval_id, value, ai_rating, position, ts)
+                )
+            elif kind == 'rating':
+                conn.execute(
+                    "UPDATE annotations SET rating = ?, updated = ? WHERE annotator = ? AND eval_id = ?",
+                    (value, ts, annotator, eval_id)
+                )
+            elif kind == 'submit':
+                conn.execute(
+                    """INSERT INTO sessions (annotator, submitted) VALUES (?, ?)
+                       ON CONFLICT (annotator) DO UPDATE SET submitted = excluded.submitted""",
+                    (annotator, ts)
+                )
+                conn.execute("DELETE FROM submitted WHERE annotator = ?", (annotator,))
+            elif kind == 'reset':
+                self._discard_unsubmitted(conn, annotator)
+                conn.execute(
+                    """INSERT INTO sessions (annotator, started) VALUES (?, ?)
+                       ON CONFLICT (annotator) DO UPDATE SET started = excluded.started""",
+                    (annotator, ts)
+                )
+            if kind in ('feedback', 'rating'):
+                after = self._annotation(conn, annotator, eval_id)
+                before_contribution = aggregation.contribution(*before[:3])
+                after_contribution = aggregation.contribution(*after[:3])
+                aggregation.apply_transition(conn, annotator, eval_id, after[2], before_contribution, after_contribution)
+                rollups.apply_transition(conn, eval_id, after[2], before_contribution, before[3],
+                                         after_contribution, after[3])
+
+    def _discard_unsubmitted(self, conn: sqlite3.Connection, annotator: str):
+        """Take back ``annotator``'s changes since their last submit; submitted annotations stay."""
+        rows = conn.execute(
+            "SELECT eval_id, feedback, rating, ai_rating, updated FROM annotations WHERE annotator = ? AND updated > ?",
+            (annotator, self._submitted_at(conn, annotator))
+        ).fetchall()
+        for eval_id, feedback, rating, ai_rating, updated in rows:
+            withdrawn = aggregation.contribution(feedback, rating, ai_rating)
+            saved = conn.execute(
+                "SELECT feedback, rating, ai_rating, updated FROM submitted WHERE annotator = ? AND eval_id = ?",
+                (annotator, eval_id)
+            ).fetchone()
+            if saved is None:
+                conn.execute("DELETE FROM annotations WHERE annotator = ? AND eval_id = ?", (annotator, eval_id))
+                restored, restored_updated = aggregation.NO_CONTRIBUTION, None
+            else:
+                conn.execute(
+                    """INSERT OR REPLACE INTO annotations (annotator, eval_id, feedback, rating, ai_rating, position, updated)
+                       SELECT annotator, eval_id, feedback, rating, ai_rating, position, updated
+                       FROM submitted WHERE annotator = ? AND eval_id = ?""",
+                    (annotator, eval_id)
+                )
+                restored, restored_updated = aggregation.contribution(*saved[:3]), saved[3]
+            aggregation.apply_transition(conn, annotator, eval_id, ai_rating, withdrawn, restored)
+            rollups.apply_transition(conn, eval_id, ai_rating, withdrawn, updated, restored, restored_updated)
+        conn.execute("DELETE FROM submitted WHERE annotator = ?", (annotator,))
+
+    @staticmethod
+    def _submitted_at(conn: sqlite3.Connection, annotator: str) -> float:
+        row = conn.execute("SELECT submitted FROM sessions WHERE annotator = ?", (annotator,)).fetchone()
+        return row[0] if row else 0.0
+
+    @staticmethod
+    def _annotation(conn: sqlite3.Connection, annotator: str, eval_id: int):
+        row = conn.execute(
+            "SELECT feedback, rating, ai_rating, updated FROM annotations WHERE annotator = ? AND eval_id = ?",
+            (annotator, eval_id)
+        ).fetchone()
+        return row or (None, None, None, None)
+
+    def timeline(self, annotator: str, eval_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(last change time, agrees) of the annotations of ``annotator``, oldest first.
+
+        With ``eval_ids``, only annotations of those evaluations are returned,
+        e.g. the ones of the current run, since the log also holds earlier ones.
+        """
+        self._drain()
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                "SELECT eval_id, updated, feedback FROM annotations WHERE annotator = ? AND feedback IS NOT NULL "
+                "ORDER BY updated",
+                (annotator,)
+            ).fetchall()
+        table = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        if eval_ids is not None:
+            table = table[np.isin(table[:, 0].astype(np.int64), eval_ids)]
+        return table[:, 1], table[:, 2] == AGREE
+
+    def team_summary(self) -> Dict[str, Any]:
+        """Pooled results across every annotator, read from the running aggregates."""
+        self._wait_ready()
+        with self._read_lock:
+            return aggregation.global_summary(self._read_conn)
+
+    def image_summary(self, eval_id: int) -> Optional[Dict[str, Any]]:
+        self._wait_ready()
+        with self._read_lock:
+            return aggregation.image_summary(self._read_conn, eval_id)
+
+    def rollup(self, by=('category',), where: Optional[Dict[str, Any]] = None, since: Optional[str] = None,
+               until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Drill-down over the rollups; see ``rollups.query``."""
+        self._wait_ready()
+        with self._read_lock:
+            return rollups.query(self._read_conn, by, where, since, until)
+
+    def backfill_categories(self, evaluations) -> Optional[int]:
+        """Re-derive rollup categories made under an earlier category rule; see ``rollups.backfill_categories``."""
+        self._wait_ready()
+        conn = connect(self.path)
+        try:
+            if rollups.categories_current(conn):
+                return None
+            with conn:
+                # Taken up front, so the writer thread cannot commit between the check and the rebuild
+                conn.execute("BEGIN IMMEDIATE")
+                return rollups.backfill_categories(conn, evaluations)
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': self._queue.qsize(),
+            'commits': self.commits,
+            'events_written': self.events_written,
+            'events_dropped': self.events_dropped,
+        }
+
+
+_log: Optional[AnnotationLog] = None
+_log_lock = threading.Lock()
+
+
+def get_annotation_log() -> Optional[AnnotationLog]:
+    """Process-wide log, or None when ``EVALUATOR_ANNOTATION_LOG`` is empty.
+
+    A log that cannot be opened is still returned; its readers raise
+    ``AnnotationLogError`` and ``available()`` is False.
+    """
+    global _log
+    if not settings.ANNOTATION_LOG_PATH:
+        return None
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = AnnotationLog(os.path.abspath(settings.ANNOTATION_LOG_PATH),
+                                     timeout=settings.ANNOTATION_LOG_TIMEOUT)
+    return _log
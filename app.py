@@ -1,6 +1,34 @@
 import streamlit as st
+import pandas as pd
+import base64
+import sqlite3
 import time
-from typing import Dict, Any
+import uuid
+from typing import Dict, Any, Optional
+
+import settings
+from image_cache import load_thumbnail
+from transcode import get_rendition_index
+from pyramid import get_pyramid
+from manifest import DEMO_RESULTS, open_manifest
+from evaluation_store import EvaluationStore
+from analytics import analyze_store
+from charts import agreement_timeline, category_bars, confusion_heatmap, delta_histogram, run_aggregates
+from annotation_log import AnnotationLogError, get_annotation_log
+from scorer import score_pair, score_shard
+from rater import RaterError, get_rater_client
+from shards import get_shards
+from prefetch import get_prefetcher, upcoming_tasks
+from sampling import StratifiedSampler, category_codes
+from phash import load_duplicate_index
+from preflight import (EvaluationSubset, build_index, install_asset_index, load_asset_index,
+                       manifest_fingerprint, preflight_path, subset)
+from instrumentation import get_metrics, span
+from overlay import LEGEND, load_overlay
+from work_queue import WorkQueue, get_work_queue
+
+# Timed until end_rerun() at the bottom of the script; fragment reruns are timed on their own
+get_metrics().begin_rerun()
 
 # Page config
 st.set_page_config(
@@ -10,7 +38,8 @@ st.set_page_config(
 )
 
 # Custom CSS for styling with image magnification
-st.markdown("""
+with span('css'):
+    st.markdown("""
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -164,15 +193,9 @@ st.markdown("""
         margin-bottom: 1rem;
     }
 </style>
-""", unsafe_allow_html=True)
+    """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'evaluations' not in st.session_state:
-    st.session_state.evaluations = []
-if 'human_feedback' not in st.session_state:
-    st.session_state.human_feedback = {}
-if 'annotator_ratings' not in st.session_state:
-    st.session_state.annotator_ratings = {}
 if 'analysis_results' not in st.session_state:
     st.session_state.analysis_results = None
 if 'show_thank_you' not in st.session_state:
@@ -181,92 +204,253 @@ if 'show_analysis' not in st.session_state:
     st.session_state.show_analysis = False
 if 'current_image_index' not in st.session_state:
     st.session_state.current_image_index = 0
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+# Annotator identity lives in the URL so a browser refresh resumes the same work
+if 'annotator_id' not in st.session_state:
+    annotator_id = st.query_params.get('annotator')
+    if not annotator_id:
+        annotator_id = uuid.uuid4().hex[:12]
+        st.query_params['annotator'] = annotator_id
+    st.session_state.annotator_id = annotator_id
 
-# Demo data - updated with descriptions
-DEMO_RESULTS = [
-    {
-        'id': 1, 
-        'original': 'Before 0.jpg',
-        'processed': 'After 0.png',
-        'rating': 4, 
-        'quality': 'Near Production Ready',
-        'description': 'Professional Portrait'
-    },
-    {
-        'id': 2, 
-        'original': 'Before 01.jpg',
-        'processed': 'After 01.png',
-        'rating': 3, 
-        'quality': 'Moderately Functional',
-        'description': 'Business Attire'
-    },
-    {
-        'id': 3, 
-        'original': 'Before 02.jpg',
-        'processed': 'After 02.png',
-        'rating': 4, 
-        'quality': 'Near Production Ready',
-        'description': 'Product - Smartphone'
-    },
-    {
-        'id': 4, 
-        'original': 'Before 03.jpg',
-        'processed': 'After 03.png',
-        'rating': 5, 
-        'quality': 'Production Ready',
-        'description': 'Steak Dish'
-    },
-    {
-        'id': 5, 
-        'original': 'Before 04.jpg',
-        'processed': 'After 04.png',
-        'rating': 2, 
-        'quality': 'Partially Viable',
-        'description': 'Product - Coffee Cup'
-    }
-]
+@st.cache_resource
+def open_shared_manifest(path: str):
+    # One lazily-paged reader per manifest, shared by every session
+    return open_manifest(path)
+
+@st.cache_resource(show_spinner="Checking image assets...")
+def shared_evaluations(manifest_path: str):
+    # Pairs with missing or unreadable images, as found by preflight.py, are dropped up front
+    if manifest_path:
+        evaluations = open_shared_manifest(manifest_path)
+        index = load_asset_index(preflight_path(manifest_path), evaluations, manifest_fingerprint(evaluations))
+        # Sidecars that Submit aggregates with; built here, once per manifest version, if preflight.py did not
+        evaluations.ids()
+        category_codes(evaluations)
+    else:
+        # The demo set is small enough to check on every server start
+        evaluations = DEMO_RESULTS
+        try:
+            build_index(evaluations, preflight_path())
+            index = load_asset_index(preflight_path(), evaluations)
+        except (OSError, sqlite3.Error):
+            index = None
+    install_asset_index(index)
+    if index is None:
+        return evaluations
+    return subset(evaluations, index.kept_positions())
+
+def load_evaluations():
+    return shared_evaluations(settings.EVALUATION_MANIFEST)
+
+@st.cache_resource
+def shared_duplicates(index_path: str, manifest_path: str):
+    # Near-duplicate clusters only exist for manifests; stale indexes load as None
+    duplicates = load_duplicate_index(index_path, open_shared_manifest(manifest_path))
+    evaluations = shared_evaluations(manifest_path)
+    if duplicates is not None and isinstance(evaluations, EvaluationSubset):
+        duplicates = duplicates.subset(evaluations.positions)
+    return duplicates
+
+@st.cache_resource(show_spinner="Updating annotation rollups...")
+def backfill_rollups(manifest_path: str):
+    # Rollup categories derived under an earlier category rule are re-derived once per server
+    try:
+        get_annotation_log().backfill_categories(shared_evaluations(manifest_path))
+    except (AnnotationLogError, sqlite3.Error):
+        # The drill-down keeps the old categories until the next start
+        pass
+
+def new_store() -> EvaluationStore:
+    duplicates = None
+    if settings.DUPLICATE_INDEX_PATH and settings.EVALUATION_MANIFEST:
+        duplicates = shared_duplicates(settings.DUPLICATE_INDEX_PATH, settings.EVALUATION_MANIFEST)
+    log = get_annotation_log()
+    if log is not None and not log.available():
+        # Annotations still go to the log, which drops them and makes Submit report the failure
+        st.warning("⚠️ The annotation log could not be opened, so annotations cannot be saved or resumed.")
+    elif log is not None:
+        backfill_rollups(settings.EVALUATION_MANIFEST)
+    return EvaluationStore(load_evaluations(), st.session_state.annotator_id, log, duplicates)
 
-# Auto-load demo data on first run
-if not st.session_state.evaluations:
-    st.session_state.evaluations = DEMO_RESULTS
+def following_position(store: EvaluationStore, position: int):
+    """Next position to review in sequential mode, skipping near duplicates."""
+    if store.duplicates is not None:
+        return store.duplicates.next_representative(position + 1)
+    return position + 1 if position + 1 < len(store) else None
+
+@st.cache_resource(show_spinner="Preparing sampling strata...")
+def shared_sampler(source: str, _evaluations) -> StratifiedSampler:
+    # Strata are computed once per evaluation set and shared by every session
+    return StratifiedSampler(_evaluations)
+
+def get_sampler():
+    # The shared work queue decides the order itself
+    if settings.SAMPLING_MODE != 'adaptive' or settings.WORK_QUEUE_PATH:
+        return None
+    return shared_sampler(settings.EVALUATION_MANIFEST or 'demo', st.session_state.store.evaluations)
+
+@st.cache_resource(show_spinner="Syncing the work queue...")
+def shared_work_queue(manifest_path: str, _store: EvaluationStore) -> WorkQueue:
+    # Every server process syncs once; the queue is only rewritten when the evaluation set changed
+    if _store.duplicates is not None:
+        positions = _store.duplicates.representatives.tolist()
+    else:
+        positions = range(len(_store))
+    fingerprint = manifest_fingerprint(open_shared_manifest(manifest_path)) if manifest_path else {'manifest': 'demo'}
+    source = f"{fingerprint}:{len(_store)}:{len(positions)}"
+    queue = get_work_queue()
+    queue.sync(((_store[position]['id'], position) for position in positions), source)
+    return queue
+
+def get_queue():
+    if not settings.WORK_QUEUE_PATH:
+        return None
+    return shared_work_queue(settings.EVALUATION_MANIFEST, st.session_state.store)
+
+def claim_position():
+    """Position of the image leased to this annotator, or None once the queue has nothing for them."""
+    lease = get_queue().claim(st.session_state.annotator_id)
+    st.session_state.queue_drained = lease is None
+    if lease is None:
+        return None
+    st.session_state.lease_expires = lease[2]
+    return lease[1]
+
+def renew_lease():
+    # Renewed once half the lease has run out; a lease lost meanwhile moves an unreviewed image on
+    if st.session_state.get('queue_drained') or time.time() < st.session_state.get('lease_expires', 0) - settings.LEASE_SECONDS / 2:
+        return
+    store = st.session_state.store
+    position = claim_position()
+    current = st.session_state.current_image_index
+    if position is not None and position != current and not store.is_complete(store[current]['id']):
+        st.session_state.current_image_index = position
+        st.rerun()
+
+def first_position() -> Optional[int]:
+    """Where a new session starts; None when the shared queue has no image for this annotator."""
+    if get_queue() is not None:
+        return claim_position()
+    sampler = get_sampler()
+    position = sampler.next_position(st.session_state.store) if sampler is not None else None
+    return position or 0
+
+# Auto-load evaluation data on first run, resuming any saved annotations
+if 'store' not in st.session_state:
+    st.session_state.store = new_store()
+    try:
+        resume_position = st.session_state.store.restore()
+    except AnnotationLogError:
+        resume_position = None
+        # new_store already warned when the log could not be opened at all
+        if st.session_state.store.log.available():
+            st.warning("⚠️ Saved annotations could not be loaded, so this session starts from the beginning.")
+    # With a work queue the annotator resumes at their lease instead
+    if resume_position is not None and get_queue() is None:
+        # Resume on the next image to review, staying on the last one once nothing follows
+        sampler = get_sampler()
+        if sampler is not None:
+            position = sampler.next_position(st.session_state.store)
+        else:
+            position = following_position(st.session_state.store, resume_position)
+        st.session_state.current_image_index = resume_position if position is None else position
+    else:
+        st.session_state.current_image_index = first_position()
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def score_evaluation(eval_id: int, original: str, processed: str) -> Dict[str, Any]:
+    client = get_rater_client()
+    if client is not None:
+        return client.rate_sync(original, processed)
+    shards = get_shards()
+    if shards is not None and shards.contains(eval_id, 'processed'):
+        return score_shard(shards, eval_id)
+    return score_pair(original, processed)
+
+CHARTS = {'confusion': confusion_heatmap, 'delta': delta_histogram, 'timeline': agreement_timeline,
+          'categories': category_bars}
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def dashboard_figure(kind: str, *aggregates):
+    # Keyed by the aggregates, so dashboard reruns reuse the figures
+    return CHARTS[kind](*aggregates)
 
 def get_quality_color(rating: int) -> str:
     colors = {1: '#dc2626', 2: '#ea580c', 3: '#ca8a04', 4: '#2563eb', 5: '#16a34a'}
     return colors.get(rating, '#6b7280')
 
 def submit_responses():
-    feedback_count = len(st.session_state.human_feedback)
-    agreement_count = sum(1 for f in st.session_state.human_feedback.values() if f)
-    disagreement_count = feedback_count - agreement_count
-    
-    agreement_rate = (agreement_count / feedback_count * 100) if feedback_count > 0 else 0
-    disagreement_rate = (disagreement_count / feedback_count * 100) if feedback_count > 0 else 0
-    
-    st.session_state.analysis_results = {
-        'agreement_rate': round(agreement_rate, 1),
-        'disagreement_rate': round(disagreement_rate, 1),
-        'feedback_count': feedback_count,
-        'agreement_count': agreement_count,
-        'disagreement_count': disagreement_count
-    }
+    with span('submit'):
+        log = get_annotation_log()
+        if log is not None:
+            annotator = st.session_state.annotator_id
+            dropped = log.dropped(annotator)
+            if dropped:
+                # Earlier changes never reached the log, but the session still holds them
+                st.session_state.store.resend()
+            # The thank-you page promises the responses are recorded
+            log.record_submit(annotator)
+            if not log.flush() or log.dropped(annotator) > dropped:
+                st.error("⚠️ Your responses could not be saved. Please try submitting again in a moment.")
+                return
+        store = st.session_state.store
+        st.session_state.analysis_results = analyze_store(store)
+        sampler = get_sampler()
+        if sampler is not None:
+            st.session_state.analysis_results['sampling'] = sampler.test(store)
+        # Charts are drawn from these few-KB aggregates, never from the annotations themselves;
+        # the log also holds annotations of earlier evaluation sets, so only this run's are timed
+        try:
+            timeline = log.timeline(st.session_state.annotator_id, store.ids(store.annotated())) if log is not None else None
+        except AnnotationLogError:
+            timeline = None
+        st.session_state.analysis_results.update(run_aggregates(store, timeline))
+        queue = get_queue()
+        if queue is not None:
+            if st.session_state.current_image_index is not None:
+                current = store[st.session_state.current_image_index]['id']
+                if store.is_complete(current):
+                    queue.complete(st.session_state.annotator_id, current)
+            queue.release(st.session_state.annotator_id)
     st.session_state.show_thank_you = True
     st.rerun()
 
 def start_new_evaluation():
-    st.session_state.evaluations = DEMO_RESULTS
-    st.session_state.human_feedback = {}
-    st.session_state.annotator_ratings = {}
+    get_prefetcher().cancel(st.session_state.session_id)
+    queue = get_queue()
+    if queue is not None:
+        queue.release(st.session_state.annotator_id)
+    log = get_annotation_log()
+    if log is not None:
+        log.record_reset(st.session_state.annotator_id)
+    st.session_state.store = new_store()
     st.session_state.analysis_results = None
     st.session_state.show_thank_you = False
     st.session_state.show_analysis = False
-    st.session_state.current_image_index = 0
+    st.session_state.current_image_index = first_position()
     if 'balloons_shown' in st.session_state:
         del st.session_state.balloons_shown
     st.rerun()
 
 def next_image():
-    if st.session_state.current_image_index < len(st.session_state.evaluations) - 1:
-        st.session_state.current_image_index += 1
+    queue = get_queue()
+    sampler = get_sampler()
+    if queue is not None:
+        store = st.session_state.store
+        queue.complete(st.session_state.annotator_id, store[st.session_state.current_image_index]['id'])
+        position = claim_position()
+        if position is not None:
+            st.session_state.current_image_index = position
+    elif sampler is not None:
+        position = sampler.next_position(st.session_state.store)
+        if position is not None:
+            st.session_state.current_image_index = position
+    else:
+        position = following_position(st.session_state.store, st.session_state.current_image_index)
+        if position is not None:
+            st.session_state.current_image_index = position
     st.rerun()
 
 def previous_image():
@@ -274,13 +458,259 @@ def previous_image():
         st.session_state.current_image_index -= 1
     st.rerun()
 
+def queue_empty():
+    """Shown instead of an image when the shared queue has nothing for this annotator."""
+    store = st.session_state.store
+    st.markdown('<h1 class="instructions-title">Hybrid Background Removal Evaluator App</h1>', unsafe_allow_html=True)
+    st.info("🎉 The shared work queue has no image for you right now: every image has its reviews, "
+            "you reviewed it already, or another annotator is reviewing it. Images whose lease expires "
+            "come back to the queue.")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("🔄 Check Again", use_container_width=True):
+            st.session_state.current_image_index = claim_position()
+            st.rerun()
+    with col2:
+        # Annotations resumed from the log can still be submitted
+        can_submit = store.feedback_count > 0 and store.pending_rating_count == 0
+        if st.button("✨Submit", type="primary", disabled=not can_submit, use_container_width=True):
+            submit_responses()
+
+ZOOM_LEVELS = {"Fit": None, "25%": 0.25, "50%": 0.5, "100% (1:1)": 1.0, "200%": 2.0, "400%": 4.0}
+ZOOM_VIEWPORT = (560, 420)
+
+def zoomed_view(path: str, zoom_label: str, center_x: float, center_y: float):
+    pyramid = get_pyramid(path)
+    viewport_width, viewport_height = ZOOM_VIEWPORT
+    zoom = ZOOM_LEVELS[zoom_label]
+    if zoom is None:
+        zoom = min(1.0, viewport_width / pyramid.width, viewport_height / pyramid.height)
+    return pyramid.viewport(zoom, center_x, center_y, viewport_width, viewport_height)
+
+@st.dialog("🔍 Magnified View", width="large")
+def magnified_view(eval_id: int, kind: str):
+    # Original and Processed share one zoom and pan so edges line up at 1:1
+    evaluation = st.session_state.store.get(eval_id)
+    st.markdown("### " + ("Original Image" if kind == 'original' else "Processed Image"))
+    
+    col_zoom, col_x, col_y = st.columns([2, 1, 1])
+    with col_zoom:
+        zoom_label = st.select_slider("Zoom", options=list(ZOOM_LEVELS), value="Fit", key=f"zoom_{eval_id}")
+    with col_x:
+        center_x = st.slider("Pan ↔", 0, 100, 50, key=f"pan_x_{eval_id}", disabled=zoom_label == "Fit") / 100
+    with col_y:
+        center_y = st.slider("Pan ↕", 0, 100, 50, key=f"pan_y_{eval_id}", disabled=zoom_label == "Fit") / 100
+    
+    col_orig, col_proc = st.columns(2)
+    for column, image_kind, caption in (
+        (col_orig, 'original', f"Original Image {eval_id}"),
+        (col_proc, 'processed', f"Processed Image {eval_id} - {evaluation['quality']}"),
+    ):
+        with column:
+            try:
+                st.image(zoomed_view(evaluation[image_kind], zoom_label, center_x, center_y), caption=caption)
+            except OSError:
+                st.error(f"Could not load image: {evaluation[image_kind]}")
+    
+    if st.button("Close", key=f"close_{kind}_{eval_id}"):
+        st.rerun()
+
+@st.fragment
+def magnifier_button(eval_id: int, kind: str):
+    key = f"orig_{eval_id}" if kind == 'original' else f"proc_{eval_id}"
+    if st.button("🔍", key=key, help="Click to magnify image"):
+        magnified_view(eval_id, kind)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def edge_overlay(eval_id: int, original: str, processed: str):
+    return load_overlay(original, processed)
+
+def show_webp(data: bytes):
+    encoded = base64.b64encode(data).decode('ascii')
+    st.markdown(
+        f'<img src="data:image/webp;base64,{encoded}" width="{settings.THUMBNAIL_WIDTH}" style="max-width: 100%;">',
+        unsafe_allow_html=True
+    )
+
+def show_overlay(evaluation: Dict[str, Any]):
+    """The pair's edge-artifact overlay in place of the processed thumbnail, with a legend."""
+    with span('overlay'):
+        data, summary = edge_overlay(evaluation['id'], evaluation['original'], evaluation['processed'])
+    show_webp(data)
+    st.caption(" · ".join(f"{LEGEND[name]} {summary[name]['percent']}%" for name in LEGEND))
+
+def show_thumbnail(evaluation: Dict[str, Any], kind: str):
+    """Send the pre-encoded WebP rendition untouched if there is one.
+
+    ``st.image`` re-encodes anything that is not PNG or JPEG, so renditions go
+    out as a data URL instead. Otherwise the thumbnail comes from the shard
+    mapping, or is resized on the fly from the source file.
+    """
+    path = evaluation[kind]
+    with span('image_load'):
+        data = get_rendition_index().read(path, 'view', composite=kind == 'processed')
+        if data is None:
+            shards = get_shards()
+            pixels = shards.plane(evaluation['id'], kind, 'view') if shards is not None else None
+            st.image(pixels if pixels is not None else load_thumbnail(path), width=settings.THUMBNAIL_WIDTH)
+            return
+        show_webp(data)
+
+def set_annotator_rating(eval_id: int):
+    rating = st.session_state[f"rating_{eval_id}"]
+    if rating is not None:
+        st.session_state.store.set_rating(eval_id, rating)
+
+ROLLUP_DIMENSIONS = {"Category": 'category', "AI Rating": 'ai_rating', "Model Version": 'model_version', "Day": 'day'}
+ROLLUP_COLUMNS = {'annotations': "Annotations", 'agreement_rate': "Agreement %", 'rated': "Rated",
+                  'mean_delta': "Mean Δ (Human − AI)", 'mean_abs_delta': "Mean |Δ|"}
+
+@st.fragment
+def drill_down(log):
+    # Regrouping reruns only this fragment and reads the materialized rollups, never the annotations
+    with get_metrics().rerun('drill_down'):
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            labels = st.multiselect("Group by", list(ROLLUP_DIMENSIONS), default=["Category", "AI Rating"])
+        with col2:
+            versions = [row['model_version'] for row in log.rollup(['model_version'])]
+            version = st.selectbox("Model version", ["All"] + versions)
+        started = time.perf_counter()
+        rows = log.rollup([ROLLUP_DIMENSIONS[label] for label in labels],
+                          None if version == "All" else {'model_version': version})
+        elapsed = time.perf_counter() - started
+        if not rows:
+            st.caption("No annotations yet.")
+            return
+        names = dict({column: label for label, column in ROLLUP_DIMENSIONS.items()}, **ROLLUP_COLUMNS)
+        st.dataframe(pd.DataFrame(rows).rename(columns=names), hide_index=True, use_container_width=True)
+        st.caption(f"{len(rows)} group(s) over all annotators, read from the rollups in {elapsed * 1000:.1f} ms")
+
+@st.fragment
+def annotation_controls(eval_id: int, current_position: int, total_images: int):
+    # Clicks in here rerun only this fragment, so it is timed as a rerun of its own
+    with get_metrics().rerun('controls'):
+        if get_queue() is not None:
+            renew_lease()
+        render_annotation_controls(eval_id, current_position, total_images)
+
+def render_annotation_controls(eval_id: int, current_position: int, total_images: int):
+    # Feedback, rating and navigation rerun together because Next/Submit depend on the feedback
+    store = st.session_state.store
+    feedback = store.feedback_of(eval_id)
+    rating = store.rating_of(eval_id)
+    col_feedback, col_rating = st.columns(2)
+    
+    with col_feedback:
+        st.markdown('<span style="color: #3b82f6; font-weight: bold;">Annotator Feedback</span>', unsafe_allow_html=True)
+        col_up, col_down = st.columns(2)
+        
+        with col_up:
+            thumbs_up_pressed = feedback is True
+            st.button("👍", key=f"up_{eval_id}",
+                      type="primary" if thumbs_up_pressed else "secondary",
+                      help="Agree with AI rating",
+                      on_click=store.set_feedback, args=(eval_id, True))
+        
+        with col_down:
+            thumbs_down_pressed = feedback is False
+            st.button("👎", key=f"down_{eval_id}",
+                      type="primary" if thumbs_down_pressed else "secondary",
+                      help="Disagree with AI rating",
+                      on_click=store.set_feedback, args=(eval_id, False))
+    
+    with col_rating:
+        st.markdown('<span style="color: #3b82f6; font-weight: bold;">Annotator Rating</span>', unsafe_allow_html=True)
+        if feedback is False:
+            st.selectbox(
+                "Rate*", 
+                options=[None, 1, 2, 3, 4, 5],
+                format_func=lambda x: "Rate*" if x is None else str(x),
+                key=f"rating_{eval_id}",
+                index=0 if rating is None else rating,
+                on_change=set_annotator_rating, args=(eval_id,)
+            )
+        elif feedback is True:
+            st.markdown("<span style='color: #059669; font-weight: 500;'>Agreed</span>", unsafe_allow_html=True)
+        else:
+            st.markdown("<span style='color: #6b7280;'>-</span>", unsafe_allow_html=True)
+    
+    # Check if current image has feedback and required rating
+    current_has_feedback = feedback is not None
+    current_feedback_is_negative = feedback is False
+    current_has_rating = rating is not None
+    
+    # Determine if user can proceed
+    can_proceed = store.is_complete(eval_id)
+    # In adaptive mode the go/no-go test reruns after every answer
+    sampler = get_sampler()
+    sampling = sampler.test(store) if sampler is not None else None
+    settled = sampling is not None and sampling['decision'] is not None
+    queue = get_queue()
+    if queue is not None:
+        has_next = not st.session_state.get('queue_drained', False)
+    elif sampler is not None:
+        has_next = store.feedback_count < total_images
+    else:
+        has_next = following_position(store, current_position - 1) is not None
+    
+    if has_next:
+        # Disable Next button if no feedback provided OR thumbs down without rating
+        next_help = ""
+        if not current_has_feedback:
+            next_help = "Please provide feedback (👍 or 👎) before proceeding"
+        elif current_feedback_is_negative and not current_has_rating:
+            next_help = "Please provide your rating before proceeding"
+        else:
+            next_help = "Go to next image"
+        
+        if st.button("Next →", disabled=not can_proceed, help=next_help, type="primary", use_container_width=True):
+            next_image()
+    if not has_next or settled or queue is not None:
+        # Submit button logic - all images need feedback and, for disagreements, a rating;
+        # a settled sampling decision, or a shared queue, only needs the pending ratings
+        if queue is not None:
+            can_submit = store.feedback_count > 0 and store.pending_rating_count == 0
+        else:
+            can_submit = store.all_complete or (settled and store.pending_rating_count == 0)
+        
+        submit_help = "Complete all required ratings before submitting" if not can_submit else "Submit all responses"
+        
+        if st.button("✨Submit", type="primary", disabled=not can_submit, help=submit_help, use_container_width=True):
+            submit_responses()
+    
+    # Show appropriate feedback message
+    if not current_has_feedback:
+        st.info("👆 Please provide your feedback (👍 agree or 👎 disagree) to proceed to the next image.")
+    elif current_feedback_is_negative and not current_has_rating:
+        st.warning("👆 Since you disagreed with the AI rating, please provide your own rating before proceeding.")
+    
+    if store.duplicates is not None:
+        duplicate_count = len(store.duplicates.members(current_position - 1))
+        if duplicate_count:
+            st.caption(f"🔁 Your verdict also applies to {duplicate_count} near-duplicate image pair(s).")
+    
+    if queue is not None and not has_next:
+        st.info("🎉 Every image in the shared queue has the reviews it needs. Submit when you are done.")
+    
+    if settled:
+        direction = "at or above" if sampling['decision'] == 'above' else "below"
+        st.success(f"✅ Decision settled after {sampling['labels']} of {sampling['population']} images: agreement is "
+                   f"{direction} {sampling['threshold']:.0%} (estimate {sampling['estimate']}%, interval "
+                   f"{sampling['ci'][0]}–{sampling['ci'][1]}%). You can submit now.")
+    elif sampling is not None and sampling['labels']:
+        st.caption(f"Adaptive sampling: agreement estimate {sampling['estimate']}% "
+                   f"({sampling['ci'][0]}–{sampling['ci'][1]}%) after {sampling['labels']} reviews, not yet settled.")
+
 # Analysis Results Page
 if st.session_state.show_analysis and st.session_state.analysis_results:
+    page = 'dashboard'
     # Header with consistent styling
     st.markdown('<h1 class="main-header" style="text-align: left;">Evaluation Dashboard</h1>', unsafe_allow_html=True)
     st.markdown('<p class="sub-header" style="text-align: left;">Performance evaluation dashboard</p>', unsafe_allow_html=True)
     
     results = st.session_state.analysis_results
+    store = st.session_state.store
     
         # Executive Summary
     col1, col2, col3 = st.columns([1, 3, 1]) 
@@ -288,42 +718,42 @@ if st.session_state.show_analysis and st.session_state.analysis_results:
     with col1:
       st.markdown("### Executive Summary")
     
-    # Analyze disagreements for enhanced summary
-    disagreements = [(eval_id, feedback) for eval_id, feedback in st.session_state.human_feedback.items() if not feedback]
-    additional_text = ""
-    
-    if disagreements:
-        higher_ratings = sum(1 for eval_id, _ in disagreements 
-                           if st.session_state.annotator_ratings.get(eval_id, 0) > 
-                           next(e['rating'] for e in st.session_state.evaluations if e['id'] == eval_id))
-        lower_ratings = sum(1 for eval_id, _ in disagreements 
-                          if st.session_state.annotator_ratings.get(eval_id, 0) < 
-                          next(e['rating'] for e in st.session_state.evaluations if e['id'] == eval_id))
+    with span('executive_summary'):
+        # Analyze disagreements for enhanced summary
+        additional_text = ""
+    
+        if results['disagreement_count']:
+            higher_ratings = results['higher_count']
+            lower_ratings = results['lower_count']
         
-        if higher_ratings > lower_ratings:
-            additional_text = " Human annotators tend to recommend higher quality ratings than the AI system, suggesting the automated evaluator may be too conservative."
-        elif lower_ratings > higher_ratings:
-            additional_text = " Human annotators tend to recommend lower quality ratings than the AI system, indicating the automated evaluator may be too lenient."
+            if higher_ratings > lower_ratings:
+                additional_text = " Human annotators tend to recommend higher quality ratings than the AI system, suggesting the automated evaluator may be too conservative."
+            elif lower_ratings > higher_ratings:
+                additional_text = " Human annotators tend to recommend lower quality ratings than the AI system, indicating the automated evaluator may be too lenient."
+            else:
+                additional_text = " Human annotator ratings show balanced distribution compared to AI evaluations."
+    
+        # Generate enhanced executive summary
+        alignment = 'strong' if results['agreement_rate'] >= 80 else 'moderate'
+        passes = results['agreement_rate'] >= 80
+        sampling = results.get('sampling')
+        if sampling is not None and sampling['decision'] is not None:
+            # The stratified estimate covers the whole set; the raw rate only covers the oversampled reviews
+            passes = sampling['decision'] == 'above'
+    
+        if passes and results['agreement_rate'] >= 90:
+            summary = f"The AI evaluation system demonstrates exceptional performance with a {results['agreement_rate']}% agreement rate. Human validators strongly align with AI assessments, indicating the automated system is ready for enterprise deployment with minimal human oversight required."
+        elif passes:
+            summary = f"The AI evaluation system shows strong performance with a {results['agreement_rate']}% agreement rate. The system demonstrates reliable quality assessment capabilities suitable for production environments with periodic human validation."
+        elif results['agreement_rate'] >= 60:
+            summary = f"The AI evaluation system delivers moderate performance with a {results['agreement_rate']}% agreement rate. While showing promise, additional calibration and refinement are recommended before full deployment to achieve enterprise-grade consistency."
         else:
-            additional_text = " Human annotator ratings show balanced distribution compared to AI evaluations."
-    
-    # Generate enhanced executive summary
-    alignment = 'strong' if results['agreement_rate'] >= 80 else 'moderate'
-    passes = results['agreement_rate'] >= 80
-    
-    if passes and results['agreement_rate'] >= 90:
-        summary = f"The AI evaluation system demonstrates exceptional performance with a {results['agreement_rate']}% agreement rate. Human validators strongly align with AI assessments, indicating the automated system is ready for enterprise deployment with minimal human oversight required."
-    elif passes:
-        summary = f"The AI evaluation system shows strong performance with a {results['agreement_rate']}% agreement rate. The system demonstrates reliable quality assessment capabilities suitable for production environments with periodic human validation."
-    elif results['agreement_rate'] >= 60:
-        summary = f"The AI evaluation system delivers moderate performance with a {results['agreement_rate']}% agreement rate. While showing promise, additional calibration and refinement are recommended before full deployment to achieve enterprise-grade consistency."
-    else:
-        summary = f"The AI evaluation system shows significant room for improvement with a {results['agreement_rate']}% agreement rate. Substantial recalibration of evaluation criteria and algorithm refinement are necessary before production deployment."
+            summary = f"The AI evaluation system shows significant room for improvement with a {results['agreement_rate']}% agreement rate. Substantial recalibration of evaluation criteria and algorithm refinement are necessary before production deployment."
     
-    # Add threshold context
-    threshold_text = f" The system meets the production readiness threshold with scores exceeding the required 80% standard." if passes else f" The system falls below the production readiness threshold, which requires an agreement rate of at least 80%."
+        # Add threshold context
+        threshold_text = f" The system meets the production readiness threshold with scores exceeding the required 80% standard." if passes else f" The system falls below the production readiness threshold, which requires an agreement rate of at least 80%."
     
-    summary += threshold_text + additional_text + " Human feedback will be integrated into our reinforcement learning pipeline to continuously improve automated evaluation accuracy."
+        summary += threshold_text + additional_text + " Human feedback will be integrated into our reinforcement learning pipeline to continuously improve automated evaluation accuracy."
     
     st.markdown(f"""
     <div style="background: white; padding: 1.5rem; border-radius: 0.5rem; border: 1px solid #e5e7eb; margin-bottom: 1.5rem;">
@@ -337,7 +767,7 @@ if st.session_state.show_analysis and st.session_state.analysis_results:
     with col1:
         st.metric(
             label="Images Evaluated", 
-            value=len(st.session_state.evaluations)
+            value=len(store)
         )
     
     with col2:
@@ -355,6 +785,117 @@ if st.session_state.show_analysis and st.session_state.analysis_results:
             delta=f"{results['disagreement_count']} rejections"
         )
     
+    if sampling is not None:
+        st.markdown("### Adaptive Sampling")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric(label="Estimated Agreement", value=f"{sampling['estimate']}%",
+                      help="Stratified by AI rating and category, weighted by stratum size")
+        with col2:
+            st.metric(label="Sequential Interval", value=f"{sampling['ci'][0]}–{sampling['ci'][1]}%",
+                      delta="settled" if sampling['decision'] else "not settled", delta_color="off")
+        with col3:
+            st.metric(label="Images Reviewed", value=sampling['labels'],
+                      delta=f"of {sampling['population']} ({sampling['strata']} strata)", delta_color="off")
+    
+    # Rating agreement statistics
+    st.markdown("### Rating Agreement Analysis")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric(label="Cohen's Kappa", value=results['kappa'])
+    
+    with col2:
+        st.metric(label="Weighted Kappa", value=results['weighted_kappa'], help="Quadratic weights: near misses count less than large disagreements")
+    
+    with col3:
+        st.metric(label="Mean Rating Bias", value=f"{results['mean_bias']:+}", help="Average of human rating minus AI rating")
+    
+    with col4:
+        ci_low, ci_high = results['agreement_ci']
+        st.metric(
+            label="Agreement 95% CI",
+            value=f"{ci_low}–{ci_high}%",
+            delta=f"{results['prob_meets_threshold']:.0%} chance ≥ 80%",
+            delta_color="off"
+        )
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.plotly_chart(dashboard_figure('confusion', results['confusion_matrix']), use_container_width=True)
+    
+    with col2:
+        st.markdown("**Agreement by AI Rating**")
+        st.dataframe(results['per_level'], hide_index=True, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.plotly_chart(dashboard_figure('delta', results['delta_counts']), use_container_width=True)
+
+    with col2:
+        st.plotly_chart(dashboard_figure('timeline', *results['timeline']), use_container_width=True)
+
+    st.plotly_chart(dashboard_figure('categories', *results['categories']), use_container_width=True)
+
+    # Pooled results across every annotator sharing this server's annotation log
+    log = get_annotation_log()
+    try:
+        team = log.team_summary() if log is not None else None
+    except AnnotationLogError:
+        team = None
+    if team and team['annotators'] > 1:
+        st.markdown("### Team Results")
+        
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            st.metric(label="Annotators", value=team['annotators'])
+        
+        with col2:
+            st.metric(label="Pooled Annotations", value=team['annotations'], delta=f"{team['images']} images", delta_color="off")
+        
+        with col3:
+            st.metric(label="Pooled Agreement Rate", value=f"{team['agreement_rate']}%")
+        
+        with col4:
+            inter_annotator = "–" if team['annotator_agreement'] is None else f"{team['annotator_agreement']}%"
+            kappa = "" if team['fleiss_kappa'] is None else f"κ = {team['fleiss_kappa']}"
+            st.metric(
+                label="Inter-Annotator Agreement",
+                value=inter_annotator,
+                delta=kappa or None,
+                delta_color="off",
+                help="Share of annotator pairs giving the same image the same rating"
+            )
+
+    # Progress of the whole team through the shared work queue
+    queue = get_queue()
+    if queue is not None:
+        progress = queue.progress()
+        st.markdown("### Shared Work Queue")
+
+        col1, col2, col3, col4 = st.columns(4)
+
+        with col1:
+            st.metric(label="Images Done", value=f"{progress['complete']}/{progress['images']}",
+                      help=f"Images with {progress['target']} review(s)")
+
+        with col2:
+            st.metric(label="Reviews", value=progress['reviews'])
+
+        with col3:
+            st.metric(label="Annotators", value=progress['annotators'])
+
+        with col4:
+            st.metric(label="Images Leased Now", value=progress['leased'])
+
+    if log is not None and log.available():
+        st.markdown("### Drill-down")
+        drill_down(log)
+
     # Recommendations based on results
     st.markdown("### Recommendations")
     
@@ -395,6 +936,7 @@ if st.session_state.show_analysis and st.session_state.analysis_results:
 
 # Thank You Page
 elif st.session_state.show_thank_you:
+    page = 'thank_you'
     # Show balloons once when thank you page loads
     if 'balloons_shown' not in st.session_state:
         st.balloons()
@@ -436,13 +978,20 @@ elif st.session_state.show_thank_you:
         if st.button("🔄 Start New Evaluation", use_container_width=True):
             start_new_evaluation()
 
+# The shared queue had no image to lease to this annotator
+elif st.session_state.current_image_index is None:
+    page = 'queue_empty'
+    queue_empty()
+
 # Main Application - Single Image View
 else:
-    # Header
-    st.markdown('<h1 class="instructions-title">Hybrid Background Removal Evaluator App</h1>', unsafe_allow_html=True)
-    
-    # Instructions
-    st.markdown("""
+    page = 'annotate'
+    with span('instructions'):
+        # Header
+        st.markdown('<h1 class="instructions-title">Hybrid Background Removal Evaluator App</h1>', unsafe_allow_html=True)
+        
+        # Instructions
+        st.markdown("""
     <div class="instructions-box">
         <strong> The AI-generated ratings below are based on the evaluation rubric provided for assessing the quality of background removal outputs. Please use the same rubric when reviewing and validating the AI’s ratings for the background-removed images.</strong><br><br>
         <strong>💡 Tip:</strong> Click the 🔍 button next to each image to view it in full size for detailed inspection.<br><br>
@@ -452,21 +1001,26 @@ else:
         <strong>4 - Near Production Ready:</strong> Only minor adjustments needed, such as light cleanup or retouching.<br>
         <strong>5 - Production Ready:</strong> No further edits needed. Ready for immediate use.
     </div>
-    """, unsafe_allow_html=True)
+        """, unsafe_allow_html=True)
+    
+    if get_queue() is not None:
+        renew_lease()
     
     # Get current image data - DEFINE ALL VARIABLES FIRST
-    current_eval = st.session_state.evaluations[st.session_state.current_image_index]
+    store = st.session_state.store
+    current_eval = store[st.session_state.current_image_index]
     eval_id = current_eval['id']
-    total_images = len(st.session_state.evaluations)
+    total_images = len(store)
     current_position = st.session_state.current_image_index + 1
-    validated_count = len(st.session_state.human_feedback)
+    validated_count = store.feedback_count
     
      # Top navigation bar
     col1, col2, col3 = st.columns([1, 3, 1])
     with col1:
         st.markdown(f"<h4 style='text-align: center; margin: 0;'>Image {current_position} of {total_images}: {current_eval['description']}</h4>", unsafe_allow_html=True)
     with col2:
-        st.write("") 
+        st.toggle("Highlight edge artifacts", key='show_overlay',
+                  help="Mark semi-transparent fringes, background colour spill and dropped foreground on the processed image")
     
     with col3:
         if st.button("🔄 Reset", use_container_width=True):
@@ -475,16 +1029,16 @@ else:
     
     st.markdown("---")
     
-    # Single image evaluation interface
-    col1, col2, col3, col4, col5, col6 = st.columns([2, 2, 1.5, 2, 2, 2])
+    # Single image evaluation interface; the controls in col5 and the 🔍 buttons
+    # are fragments, so using them does not re-render the rest of the page
+    col1, col2, col3, col4, col5 = st.columns([2, 2, 1.5, 2, 4])
     
     with col1:
         st.markdown("**Original**")
-        if st.button(f"🔍", key=f"orig_{eval_id}", help="Click to magnify image"):
-            st.session_state[f'show_modal_{eval_id}_orig'] = True
+        magnifier_button(eval_id, 'original')
         
         try:
-            st.image(current_eval['original'], width=300)
+            show_thumbnail(current_eval, 'original')
         except:
             st.markdown(f"""
             <div style="width: 300px; height: 200px; background: #f3f4f6; border: 2px dashed #d1d5db; 
@@ -498,11 +1052,13 @@ else:
     
     with col2:
         st.markdown("**Processed**")
-        if st.button(f"🔍", key=f"proc_{eval_id}", help="Click to magnify image"):
-            st.session_state[f'show_modal_{eval_id}_proc'] = True
+        magnifier_button(eval_id, 'processed')
         
         try:
-            st.image(current_eval['processed'], width=300)
+            if st.session_state.get('show_overlay'):
+                show_overlay(current_eval)
+            else:
+                show_thumbnail(current_eval, 'processed')
         except:
             st.markdown(f"""
             <div style="width: 300px; height: 200px; background: #f3f4f6; border: 2px dashed #d1d5db; 
@@ -514,6 +1070,14 @@ else:
             </div>
             """, unsafe_allow_html=True)
     
+    # Warm the cache for the next pairs while the annotator reviews this one;
+    # shard thumbnails are already decoded and sampled order is not known ahead
+    if settings.PREFETCH_DEPTH > 0 and get_shards() is None and get_sampler() is None and get_queue() is None:
+        get_prefetcher().warm(
+            st.session_state.session_id,
+            upcoming_tasks(store.evaluations, st.session_state.current_image_index, settings.PREFETCH_DEPTH)
+        )
+    
     with col3:
         st.markdown("**AI Rating**")
         st.markdown(f"""
@@ -521,132 +1085,24 @@ else:
             <span style="font-size: 1.125rem; font-weight: 600;">{current_eval['rating']}/5</span>
         </div>
         """, unsafe_allow_html=True)
+        try:
+            with span('scorer'):
+                auto_score = score_evaluation(eval_id, current_eval['original'], current_eval['processed'])
+            signals = auto_score.get('signals')
+            st.caption(
+                f"{'Scoring service' if get_rater_client() is not None else 'Built-in scorer'}: {auto_score['rating']}/5",
+                help=(f"Coverage {signals['coverage']:.0%}, fringe {signals['fringe']}, halo {signals['halo']:.0%}, "
+                      f"leakage {signals['leakage']:.1%}, fragments {signals['fragments']}, holes {signals['holes']}")
+                if signals else None
+            )
+        except (OSError, RaterError):
+            pass
     
     with col4:
         st.markdown("**Quality Level**")
         st.markdown(f"<span style='font-weight: 500; color: #374151;'>{current_eval['quality']}</span>", unsafe_allow_html=True)
     
     with col5:
-        st.markdown('<span style="color: #3b82f6; font-weight: bold;">Annotator Feedback</span>', unsafe_allow_html=True)
-        col_up, col_down = st.columns(2)
-        
-        with col_up:
-            thumbs_up_pressed = st.session_state.human_feedback.get(eval_id) is True
-            if st.button("👍", key=f"up_{eval_id}", 
-                       type="primary" if thumbs_up_pressed else "secondary",
-                       help="Agree with AI rating"):
-                st.session_state.human_feedback[eval_id] = True
-                if eval_id in st.session_state.annotator_ratings:
-                    del st.session_state.annotator_ratings[eval_id]
-                st.rerun()
-        
-        with col_down:
-            thumbs_down_pressed = st.session_state.human_feedback.get(eval_id) is False
-            if st.button("👎", key=f"down_{eval_id}",
-                       type="primary" if thumbs_down_pressed else "secondary",
-                       help="Disagree with AI rating"):
-                st.session_state.human_feedback[eval_id] = False
-                st.rerun()
-    
-    with col6:
-        st.markdown('<span style="color: #3b82f6; font-weight: bold;">Annotator Rating</span>', unsafe_allow_html=True)
-        if st.session_state.human_feedback.get(eval_id) is False:
-            rating = st.selectbox(
-                "Rate*", 
-                options=[None, 1, 2, 3, 4, 5],
-                format_func=lambda x: "Rate*" if x is None else str(x),
-                key=f"rating_{eval_id}",
-                index=0 if eval_id not in st.session_state.annotator_ratings else st.session_state.annotator_ratings[eval_id]
-            )
-            if rating is not None:
-                st.session_state.annotator_ratings[eval_id] = rating
-        elif st.session_state.human_feedback.get(eval_id) is True:
-            st.markdown("<span style='color: #059669; font-weight: 500;'>Agreed</span>", unsafe_allow_html=True)
-        else:
-            st.markdown("<span style='color: #6b7280;'>-</span>", unsafe_allow_html=True)
-    
-    # Show modals if triggered
-    if st.session_state.get(f'show_modal_{eval_id}_orig', False):
-        with st.container():
-            st.markdown("### 🔍 Magnified View - Original Image")
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
-                try:
-                    st.image(current_eval['original'], use_container_width=True, caption=f"Original Image {eval_id}")
-                except:
-                    st.error(f"Could not load image: {current_eval['original']}")
-                
-                if st.button("Close", key=f"close_orig_{eval_id}"):
-                    st.session_state[f'show_modal_{eval_id}_orig'] = False
-                    st.rerun()
-    
-    if st.session_state.get(f'show_modal_{eval_id}_proc', False):
-        with st.container():
-            st.markdown("### 🔍 Magnified View - Processed Image")
-            col1, col2, col3 = st.columns([1, 2, 1])
-            with col2:
-                try:
-                    st.image(current_eval['processed'], use_container_width=True, caption=f"Processed Image {eval_id} - {current_eval['quality']}")
-                except:
-                    st.error(f"Could not load image: {current_eval['processed']}")
-                
-                if st.button("Close", key=f"close_proc_{eval_id}"):
-                    st.session_state[f'show_modal_{eval_id}_proc'] = False
-                    st.rerun()
-    
-    # Navigation section with all requirements
-    st.markdown("---")
-    
-    # Check if current image has feedback and required rating
-    current_has_feedback = eval_id in st.session_state.human_feedback
-    current_feedback_is_negative = st.session_state.human_feedback.get(eval_id) is False
-    current_has_rating = eval_id in st.session_state.annotator_ratings
-    
-    # Determine if user can proceed
-    can_proceed = (current_has_feedback and 
-                  (not current_feedback_is_negative or current_has_rating))
-    
-    # Create navigation without progress bar
-    col1, col2, col3 = st.columns([1, 3, 1])
-    
-    with col1:
-        st.write("")  # Empty space
-    
-    with col2:
-        st.write("")  # Empty space
-        
-    with col3:
-        if current_position < total_images:
-            # Disable Next button if no feedback provided OR thumbs down without rating
-            next_help = ""
-            if not current_has_feedback:
-                next_help = "Please provide feedback (👍 or 👎) before proceeding"
-            elif current_feedback_is_negative and not current_has_rating:
-                next_help = "Please provide your rating before proceeding"
-            else:
-                next_help = "Go to next image"
-            
-            if st.button("Next →", disabled=not can_proceed, help=next_help,type="primary", use_container_width=True):
-                next_image()
-        else:
-            # Submit button logic - check all images have required feedback/ratings
-            all_images_complete = True
-            for img_eval_id in [e['id'] for e in st.session_state.evaluations]:
-                if img_eval_id not in st.session_state.human_feedback:
-                    all_images_complete = False
-                    break
-                if (st.session_state.human_feedback[img_eval_id] is False and 
-                    img_eval_id not in st.session_state.annotator_ratings):
-                    all_images_complete = False
-                    break
-            
-            submit_help = "Complete all required ratings before submitting" if not all_images_complete else "Submit all responses"
-            
-            if st.button("✨Submit", type="primary", disabled=not all_images_complete, help=submit_help, use_container_width=True):
-                submit_responses()
-    
-    # Show appropriate feedback message
-    if not current_has_feedback:
-        st.info("👆 Please provide your feedback (👍 agree or 👎 disagree) to proceed to the next image.")
-    elif current_feedback_is_negative and not current_has_rating:
-        st.warning("👆 Since you disagreed with the AI rating, please provide your own rating before proceeding.")
+        annotation_controls(eval_id, current_position, total_images)
+
+get_metrics().end_rerun(page)
@@ -0,0 +1,175 @@
+"""Score Before/After pairs from the command line, without Streamlit.
+
+Pairs come either from a directory (``Before <name>.*`` next to
+``After <name>.png``) or from an evaluation manifest. They are scored across a
+process pool and streamed, in input order, to a CSV or JSONL manifest with the
+same schema the app reads (``id``, ``original``, ``processed``, ``rating``,
+``quality``, ``description``).
+
+    python batch_score.py --dir images/ --output scored.jsonl
+    python batch_score.py --manifest evaluations.csv --output scored.csv --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from manifest import open_manifest
+from rater import RaterError, make_client
+from scorer import score_pair, score_shard
+from shards import open_shards
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.bmp')
+OUTPUT_FIELDS = ['id', 'original', 'processed', 'rating', 'quality', 'description']
+SIGNAL_FIELDS = ['coverage', 'fringe', 'halo', 'leakage', 'fragments', 'holes']
+
+
+def pairs_from_directory(directory: str, original_prefix: str, processed_prefix: str) -> Iterator[Dict[str, Any]]:
+    """Rows for every ``<original_prefix><name>`` that has a ``<processed_prefix><name>`` partner."""
+    originals: Dict[str, str] = {}
+    processed: Dict[str, str] = {}
+    for entry in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(entry)
+        if extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+        if stem.startswith(original_prefix):
+            originals.setdefault(stem[len(original_prefix):], os.path.join(directory, entry))
+        elif stem.startswith(processed_prefix):
+            processed.setdefault(stem[len(processed_prefix):], os.path.join(directory, entry))
+    for eval_id, name in enumerate(sorted(originals.keys() & processed.keys()), start=1):
+        yield {
+            'id': eval_id,
+            'original': originals[name],
+            'processed': processed[name],
+            'description': name.strip(),
+        }
+
+
+def _score_row(row: Dict[str, Any], shard_dir: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[str]]:
+    try:
+        if shard_dir:
+            return row, score_shard(open_shards(shard_dir), row['id']), None
+        return row, score_pair(row['original'], row['processed']), None
+    except Exception as error:
+        return row, None, f"{type(error).__name__}: {error}"
+
+
+def score_rows(rows: Iterable[Dict[str, Any]], workers: int, window: int,
+               shard_dir: Optional[str] = None) -> Iterator[Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[str]]]:
+    """Score rows in a process pool, yielding in input order with at most ``window`` in flight."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for row in rows:
+            in_flight.append(executor.submit(_score_row, row, shard_dir))
+            if len(in_flight) >= window:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class ResultWriter:
+    def __init__(self, path: str, fields: List[str]):
+        self.fields = fields
+        self.jsonl = path.lower().endswith(('.jsonl', '.ndjson'))
+        self._file = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        if not self.jsonl:
+            self._csv = csv.DictWriter(self._file, fieldnames=fields, extrasaction='ignore')
+            self._csv.writeheader()
+
+    def write(self, row: Dict[str, Any]):
+        if self.jsonl:
+            self._file.write(json.dumps({field: row.get(field) for field in self.fields}) + '\n')
+        else:
+            self._csv.writerow(row)
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+def rate_rows(rows: Iterable[Dict[str, Any]], client, window: int) -> Iterator[Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[str]]]:
+    """Rate rows through a ``rater.RaterClient``, yielding in input order with at most ``window`` in flight."""
+    in_flight = deque()
+
+    def result(row, future):
+        try:
+            return row, future.result(), None
+        except (OSError, RaterError) as error:
+            return row, None, f"{type(error).__name__}: {error}"
+
+    for row in rows:
+        in_flight.append((row, client.submit(row['original'], row['processed'])))
+        if len(in_flight) >= window:
+            yield result(*in_flight.popleft())
+    while in_flight:
+        yield result(*in_flight.popleft())
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dir', help="directory of Before/After image pairs")
+    source.add_argument('--manifest', help="CSV/JSONL evaluation manifest to (re)score")
+    parser.add_argument('--output', required=True, help="output .csv or .jsonl manifest, or - for stdout (CSV)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="scoring processes (default: all cores)")
+    parser.add_argument('--original-prefix', default='Before ', help="file name prefix of originals in --dir")
+    parser.add_argument('--processed-prefix', default='After ', help="file name prefix of processed images in --dir")
+    parser.add_argument('--signals', action='store_true', help="also write the raw scorer signals")
+    parser.add_argument('--limit', type=int, help="score at most this many pairs")
+    parser.add_argument('--shards', help="read images from this shard directory (built by shards.py) instead of the paths")
+    parser.add_argument('--rater', help="rate through the cached rater client: 'local' for the built-in scorer, "
+                                        "or the URL of a scoring service")
+    args = parser.parse_args(argv)
+
+    if args.dir:
+        rows: Iterable[Dict[str, Any]] = pairs_from_directory(args.dir, args.original_prefix, args.processed_prefix)
+    else:
+        rows = iter(open_manifest(args.manifest))
+    if args.limit is not None:
+        rows = (row for _, row in zip(range(args.limit), rows))
+
+    fields = OUTPUT_FIELDS + (SIGNAL_FIELDS if args.signals else [])
+    writer = ResultWriter(args.output, fields)
+    scored = failed = 0
+    client = None
+    started = time.perf_counter()
+    try:
+        if args.rater:
+            client = make_client(args.rater, args.workers)
+            results = rate_rows(rows, client, window=client.batch_size * client.concurrency * 2)
+        else:
+            results = score_rows(rows, args.workers, window=args.workers * 8, shard_dir=args.shards)
+        for row, result, error in results:
+            if result is None:
+                failed += 1
+                print(f"skipped {row.get('id')}: {error}", file=sys.stderr)
+                continue
+            output = dict(row, rating=result['rating'], quality=result['quality'])
+            if args.signals:
+                output.update(result.get('signals', {}))
+            writer.write(output)
+            scored += 1
+    finally:
+        writer.close()
+        if client is not None:
+            client.rater.close()
+
+    elapsed = time.perf_counter() - started
+    rate = scored / elapsed if elapsed > 0 else 0.0
+    if client is not None:
+        stats = client.stats()
+        print(f"scored {scored} pairs ({failed} skipped) in {elapsed:.2f}s: {rate:.1f} pairs/sec, "
+              f"{stats['cache_hits']} from cache, {stats['rated']} rated in {stats['batches']} batches", file=sys.stderr)
+    else:
+        print(f"scored {scored} pairs ({failed} skipped) in {elapsed:.2f}s: {rate:.1f} pairs/sec "
+              f"with {args.workers} workers", file=sys.stderr)
+    return 1 if failed and not scored else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""Headless benchmarks of the evaluator app at different evaluation-set sizes.
+
+For every size a manifest is synthesized over a small pool of generated
+Before/After images, and ``app.py`` is driven through Streamlit's ``AppTest``:
+first load, thumbs-up, thumbs-down with a rating, Next, then Submit and the
+dashboard after the whole set has been marked as annotated. Each step records
+its latency, the process's peak memory and the image bytes the rerun sent.
+Sizes run in separate processes, since settings are read once at import and
+peak memory is per process.
+
+    python benchmark.py --sizes 10,1000,100000,1000000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+CATEGORIES = ('Product', 'Portrait', 'Pet', 'Vehicle', 'Furniture')
+DATA_URL = re.compile(r'data:image/[a-z]+;base64,([A-Za-z0-9+/=]+)')
+
+
+def make_images(directory: str, count: int, size: Tuple[int, int], seed: int = 0) -> List[Tuple[str, str]]:
+    """``count`` Before/After pairs: a gradient scene with a subject, and its soft-edged cutout."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    pairs = []
+    for index in range(count):
+        top, bottom = rng.integers(0, 256, size=(2, 3))
+        ramp = np.linspace(0, 1, height)[:, None, None]
+        scene = np.broadcast_to(top + (bottom - top) * ramp, (height, width, 3)).astype(np.uint8)
+        original = Image.fromarray(np.ascontiguousarray(scene))
+        mask = Image.new('L', size, 0)
+        box = (width * rng.uniform(0.15, 0.3), height * rng.uniform(0.1, 0.25),
+               width * rng.uniform(0.7, 0.85), height * rng.uniform(0.75, 0.9))
+        ImageDraw.Draw(mask).ellipse(box, fill=255)
+        ImageDraw.Draw(original).ellipse(box, fill=tuple(int(c) for c in rng.integers(0, 256, size=3)))
+        mask = mask.filter(ImageFilter.GaussianBlur(radius=rng.uniform(0.5, 4)))
+        processed = original.convert('RGBA')
+        processed.putalpha(mask)
+        original_path = os.path.join(directory, f"Before {index:03d}.jpg")
+        processed_path = os.path.join(directory, f"After {index:03d}.png")
+        original.save(original_path, quality=90)
+        processed.save(processed_path)
+        pairs.append((original_path, processed_path))
+    return pairs
+
+
+def write_manifest(path: str, rows: int, pairs: List[Tuple[str, str]], seed: int = 0):
+    from rubric import quality_label
+
+    rng = np.random.default_rng(seed)
+    ratings = rng.integers(1, 6, size=rows)
+    with open(path, 'w', encoding='utf-8') as f:
+        for position in range(rows):
+            original, processed = pairs[position % len(pairs)]
+            rating = int(ratings[position])
+            f.write(json.dumps({
+                'id': position + 1, 'original': original, 'processed': processed, 'rating': rating,
+                'quality': quality_label(rating),
+                'description': f"{CATEGORIES[position % len(CATEGORIES)]} - Item {position + 1}",
+            }) + '\n')
+
+
+class ServedBytes:
+    """Counts image bytes handed to Streamlit's media storage, which ``AppTest`` keeps in memory."""
+
+    def __init__(self):
+        from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+        self.total = 0
+        load = MemoryMediaFileStorage.load_and_get_id
+
+        def counting_load(storage, path_or_data, mimetype, kind, filename=None):
+            file_id = load(storage, path_or_data, mimetype, kind, filename)
+            if mimetype.startswith('image/'):
+                self.total += len(storage._files_by_id[file_id].content)
+            return file_id
+
+        MemoryMediaFileStorage.load_and_get_id = counting_load
+
+    def take(self, at) -> int:
+        """Bytes since the last call, plus images inlined as data URLs by the last rerun."""
+        total, self.total = self.total, 0
+        for element in at.markdown:
+            total += sum(len(payload) * 3 // 4 for payload in DATA_URL.findall(element.value))
+        return total
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _button(at, label_prefix: str):
+    return next(button for button in at.button if button.label.startswith(label_prefix))
+
+
+def run_worker(steps: int, timeout: float) -> Dict[str, Any]:
+    """Drive the app once; settings come from the environment set up by ``main``."""
+    from streamlit.testing.v1 import AppTest
+
+    records = []
+    served = ServedBytes()
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def step(name: str, action):
+        started = time.perf_counter()
+        action()
+        records.append({
+            'step': name,
+            'seconds': round(time.perf_counter() - started, 4),
+            'image_bytes': served.take(at),
+            'peak_rss_mb': _peak_rss_mb(),
+            'errors': [str(error.value) for error in at.exception],
+        })
+
+    step('load', at.run)
+    for index in range(steps):
+        store = at.session_state.store
+        eval_id = store[at.session_state.current_image_index]['id']
+        if index % 2 == 0:
+            step('thumbs_up', lambda: at.button(key=f"up_{eval_id}").click().run())
+        else:
+            step('thumbs_down', lambda: at.button(key=f"down_{eval_id}").click().run())
+            step('rate', lambda: at.selectbox(key=f"rating_{eval_id}").set_value(2).run())
+        step('next', lambda: _button(at, 'Next').click().run())
+
+    # Mark the rest of the set as annotated in one go, then submit from the last image
+    store = at.session_state.store
+    from evaluation_store import AGREE, DISAGREE, NO_FEEDBACK
+    unset = store.feedback == NO_FEEDBACK
+    positions = np.flatnonzero(unset)
+    ratings = np.fromiter((store[position]['rating'] for position in positions), dtype=np.int8, count=len(positions))
+    store.ai_ratings[positions] = ratings
+    store.feedback[positions] = np.where(positions % 5 == 0, DISAGREE, AGREE)
+    store.ratings[positions[positions % 5 == 0]] = 3
+    store.feedback_count = len(store)
+    store.agreement_count = int(np.count_nonzero(store.feedback == AGREE))
+    store.pending_rating_count = 0
+    at.session_state.current_image_index = len(store) - 1
+    step('last_image', at.run)
+    step('submit', lambda: _button(at, '✨Submit').click().run())
+    step('dashboard', lambda: _button(at, '📊 View Analysis').click().run())
+
+    from image_cache import get_image_cache
+    return {'steps': records, 'image_cache': get_image_cache().stats()}
+
+
+def summarize(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    summary: Dict[str, Dict[str, float]] = {}
+    for name in dict.fromkeys(record['step'] for record in records):
+        seconds = np.array([record['seconds'] for record in records if record['step'] == name])
+        image_bytes = [record['image_bytes'] for record in records if record['step'] == name]
+        summary[name] = {
+            'count': len(seconds),
+            'mean_ms': round(float(seconds.mean()) * 1000, 2),
+            'p50_ms': round(float(np.median(seconds)) * 1000, 2),
+            'max_ms': round(float(seconds.max()) * 1000, 2),
+            'mean_image_bytes': int(np.mean(image_bytes)),
+        }
+    return summary
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(APP_PATH)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark app reruns at different evaluation-set sizes.")
+    parser.add_argument('--sizes', default='10,1000,100000', help="comma-separated row counts (default: %(default)s)")
+    parser.add_argument('--steps', type=int, default=10, help="annotate/next rounds per size (default: %(default)s)")
+    parser.add_argument('--images', type=int, default=8, help="distinct image pairs the rows cycle through")
+    parser.add_argument('--image-size', default='1600x1200', help="WIDTHxHEIGHT of generated images")
+    parser.add_argument('--timeout', type=float, default=600, help="seconds allowed per rerun")
+    parser.add_argument('--workdir', help="keep generated data here instead of a temporary directory")
+    parser.add_argument('--output', default='-', help="JSON results file, or - for stdout")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        json.dump(run_worker(args.steps, args.timeout), sys.stdout)
+        return 0
+
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='evaluator-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    width, height = (int(value) for value in args.image_size.split('x'))
+    pairs = make_images(workdir, args.images, (width, height))
+
+    results = []
+    for rows in (int(size) for size in args.sizes.split(',')):
+        run_dir = os.path.join(workdir, f"rows-{rows}")
+        os.makedirs(run_dir, exist_ok=True)
+        manifest_path = os.path.join(run_dir, 'manifest.jsonl')
+        started = time.perf_counter()
+        write_manifest(manifest_path, rows, pairs)
+        generate_seconds = time.perf_counter() - started
+
+        env = dict(os.environ,
+                   EVALUATOR_MANIFEST=manifest_path,
+                   EVALUATOR_ANNOTATION_LOG=os.path.join(run_dir, 'annotations.db'),
+                   EVALUATOR_TILE_CACHE=os.path.join(run_dir, 'tiles'),
+                   EVALUATOR_RENDITION_CACHE=os.path.join(run_dir, 'renditions'))
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', '--steps', str(args.steps),
+             '--timeout', str(args.timeout)],
+            env=env, capture_output=True, text=True, cwd=run_dir
+        )
+        if completed.returncode != 0:
+            print(f"{rows} rows failed:\n{completed.stderr}", file=sys.stderr)
+            results.append({'rows': rows, 'error': completed.stderr.strip().splitlines()[-1:]})
+            continue
+        worker = json.loads(completed.stdout)
+        summary = summarize(worker['steps'])
+        results.append({
+            'rows': rows,
+            'generate_seconds': round(generate_seconds, 3),
+            'peak_rss_mb': max(record['peak_rss_mb'] for record in worker['steps']),
+            'summary': summary,
+            'image_cache': worker['image_cache'],
+            'steps': worker['steps'],
+        })
+        print(f"{rows:>9} rows: load {summary['load']['mean_ms']:.0f} ms, next {summary.get('next', {}).get('p50_ms', 0):.0f} ms, "
+              f"dashboard {summary['dashboard']['mean_ms']:.0f} ms, peak {results[-1]['peak_rss_mb']} MB", file=sys.stderr)
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'steps': args.steps, 'images': args.images, 'image_size': args.image_size},
+        'results': results,
+    }
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if all('error' not in result for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Plotly charts for the evaluation dashboard, drawn from pre-binned aggregates.
+
+Charts never see per-annotation rows. ``run_aggregates`` reduces a submitted run
+with NumPy to a handful of arrays, using only the session's arrays and the
+per-row category codes that ``sampling.category_codes`` keeps per manifest: the 5x5 confusion matrix, a 9-bin
+rating-delta histogram, agreement per category (at most ``MAX_CATEGORIES``
+bars) and a rolling agreement series sampled down to
+``analytics.TIMELINE_POINTS`` points. The figures built from them stay a few
+KB however many annotations the run has. The app caches them, keyed by the
+aggregates, so reruns only resend them.
+"""
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from analytics import PRODUCTION_THRESHOLD, RATING_LEVELS, rolling_agreement, store_columns
+from evaluation_store import AGREE
+from sampling import category_codes
+
+MAX_CATEGORIES = 20
+CHART_HEIGHT = 320
+AGREE_COLOR = '#16a34a'
+DISAGREE_COLOR = '#dc2626'
+NEUTRAL_COLOR = '#2563eb'
+
+
+def category_agreement(store) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """(categories, annotations, agreements) of a session, the largest categories first.
+
+    Beyond ``MAX_CATEGORIES`` the smallest categories are merged into "Other categories".
+    """
+    positions = store.annotated()
+    names, codes = category_codes(store.evaluations)
+    codes = codes[positions]
+    counts = np.bincount(codes, minlength=len(names))
+    agreed = np.bincount(codes, weights=store.feedback[positions] == AGREE, minlength=len(names)).astype(np.int64)
+    # Categories without annotations in this session are left out
+    order = np.argsort(-counts, kind='stable')
+    order = order[counts[order] > 0]
+    labels = [names[code] for code in order.tolist()]
+    counts, agreed = counts[order], agreed[order]
+    if len(labels) > MAX_CATEGORIES:
+        keep = MAX_CATEGORIES - 1
+        labels = labels[:keep] + ["Other categories"]
+        counts = np.append(counts[:keep], counts[keep:].sum())
+        agreed = np.append(agreed[:keep], agreed[keep:].sum())
+    return labels, counts, agreed
+
+
+def run_aggregates(store, timeline: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict[str, Any]:
+    """Everything the charts need from a run, besides what ``analytics.analyze`` already returns.
+
+    ``timeline`` is (timestamps, agrees) of the annotations, e.g. from the
+    annotation log. Without it the rolling agreement follows position order.
+    """
+    if timeline is not None and len(timeline[0]):
+        order, agrees = timeline
+        axis = 'time'
+    else:
+        _, _, agrees = store_columns(store)
+        order = store.annotated()
+        axis = 'review'
+    x, rates, window = rolling_agreement(order, agrees)
+    return {
+        'categories': category_agreement(store),
+        'timeline': (x, rates, window, axis),
+    }
+
+
+def _layout(figure: go.Figure, **kwargs) -> go.Figure:
+    figure.update_layout(height=CHART_HEIGHT, margin=dict(l=10, r=10, t=30, b=10), showlegend=False, **kwargs)
+    return figure
+
+
+def confusion_heatmap(confusion: np.ndarray) -> go.Figure:
+    levels = [str(level) for level in range(1, RATING_LEVELS + 1)]
+    figure = go.Figure(go.Heatmap(
+        z=confusion, x=levels, y=levels, text=confusion, texttemplate="%{text}", colorscale='Blues',
+        hovertemplate="AI %{y} / Human %{x}: %{z}<extra></extra>", showscale=False
+    ))
+    return _layout(figure, title="AI vs. Human Ratings", xaxis_title="Human rating", yaxis_title="AI rating")
+
+
+def delta_histogram(counts: np.ndarray) -> go.Figure:
+    deltas = np.arange(-(RATING_LEVELS - 1), RATING_LEVELS)
+    colors = [DISAGREE_COLOR if delta < 0 else AGREE_COLOR if delta == 0 else NEUTRAL_COLOR for delta in deltas]
+    figure = go.Figure(go.Bar(x=deltas, y=counts, marker_color=colors,
+                              hovertemplate="Human − AI = %{x}: %{y}<extra></extra>"))
+    return _layout(figure, title="Rating Delta (Human − AI)", xaxis=dict(tickmode='linear', dtick=1),
+                   yaxis_title="Annotations")
+
+
+def agreement_timeline(x: np.ndarray, rates: np.ndarray, window: int, axis: str) -> go.Figure:
+    if axis == 'time':
+        x = pd.to_datetime(x, unit='s')
+    figure = go.Figure(go.Scatter(x=x, y=rates, mode='lines', line=dict(color=NEUTRAL_COLOR),
+                                  hovertemplate="%{y:.1f}%<extra></extra>"))
+    figure.add_hline(y=PRODUCTION_THRESHOLD * 100, line_dash='dash', line_color='#6b7280')
+    return _layout(figure, title=f"Rolling Agreement (last {window} annotations)",
+                   xaxis_title="Time" if axis == 'time' else "Position in evaluation set",
+                   yaxis=dict(title="Agreement %", range=[0, 100]))
+
+
+def category_bars(labels: List[str], counts: np.ndarray, agreed: np.ndarray) -> go.Figure:
+    rates = np.round(agreed / np.maximum(counts, 1) * 100, 1)
+    colors = [AGREE_COLOR if rate >= PRODUCTION_THRESHOLD * 100 else DISAGREE_COLOR for rate in rates]
+    figure = go.Figure(go.Bar(
+        x=rates, y=labels, orientation='h', marker_color=colors, customdata=counts,
+        hovertemplate="%{y}: %{x:.1f}% of %{customdata}<extra></extra>"
+    ))
+    figure.add_vline(x=PRODUCTION_THRESHOLD * 100, line_dash='dash', line_color='#6b7280')
+    return _layout(figure, title="Agreement by Category", xaxis=dict(title="Agreement %", range=[0, 100]),
+                   yaxis=dict(autorange='reversed'))
@@ -0,0 +1,206 @@
+"""Per-session evaluation state with an id index and running counters.
+
+``EvaluationStore`` wraps the evaluation rows (the demo list or a lazily paged
+``Manifest``) together with the annotator's feedback and ratings. Annotations
+live in ``int8`` arrays indexed by row position, so a session costs a few
+bytes per evaluation however many it has annotated. Counters are updated on
+every write, so completeness and agreement checks never rescan the evaluation
+set.
+"""
+from typing import Dict, Any, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Values of the feedback array
+NO_FEEDBACK, DISAGREE, AGREE = -1, 0, 1
+# Rating arrays use 0 for "no rating"
+NO_RATING = 0
+
+
+class EvaluationStore:
+    def __init__(self, evaluations: Sequence[Dict[str, Any]], annotator: Optional[str] = None, log=None,
+                 duplicates=None):
+        self.evaluations = evaluations
+        self.annotator = annotator
+        # Optional AnnotationLog that receives every change
+        self.log = log
+        # Optional phash.DuplicateIndex; verdicts on a representative are copied to its cluster
+        self.duplicates = duplicates
+        self.propagated_count = 0
+        count = len(evaluations)
+        self.feedback = np.full(count, NO_FEEDBACK, dtype=np.int8)
+        self.ratings = np.full(count, NO_RATING, dtype=np.int8)
+        # AI rating of every annotated row, so analytics never re-read the evaluations
+        self.ai_ratings = np.full(count, NO_RATING, dtype=np.int8)
+        self.feedback_count = 0
+        self.agreement_count = 0
+        # Disagreements still waiting for the annotator's own rating
+        self.pending_rating_count = 0
+        if hasattr(evaluations, 'position_of'):
+            self._ids = self._id_positions = self._row_ids = None
+        else:
+            ids = np.fromiter((evaluation['id'] for evaluation in evaluations), dtype=np.int64, count=count)
+            self._row_ids = ids
+            order = np.argsort(ids, kind='stable')
+            self._ids = ids[order]
+            self._id_positions = order.astype(np.int32)
+
+    def __len__(self) -> int:
+        return len(self.evaluations)
+
+    def __getitem__(self, position: int) -> Dict[str, Any]:
+        return self.evaluations[position]
+
+    def position_of(self, eval_id: int) -> int:
+        if self._ids is None:
+            return self.evaluations.position_of(eval_id)
+        slot = int(np.searchsorted(self._ids, eval_id))
+        if slot == len(self._ids) or self._ids[slot] != eval_id:
+            raise KeyError(eval_id)
+        return int(self._id_positions[slot])
+
+    def ids(self, positions: np.ndarray) -> np.ndarray:
+        """Evaluation ids at ``positions``, without reading the rows."""
+        if self._row_ids is None:
+            return self.evaluations.ids()[positions]
+        return self._row_ids[positions]
+
+    def get(self, eval_id: int) -> Dict[str, Any]:
+        return self.evaluations[self.position_of(eval_id)]
+
+    def ai_rating(self, eval_id: int) -> int:
+        return self.get(eval_id)['rating']
+
+    def feedback_of(self, eval_id: int) -> Optional[bool]:
+        """True for 👍, False for 👎, None when not annotated yet."""
+        value = self.feedback[self.position_of(eval_id)]
+        return None if value == NO_FEEDBACK else bool(value)
+
+    def rating_of(self, eval_id: int) -> Optional[int]:
+        value = int(self.ratings[self.position_of(eval_id)])
+        return None if value == NO_RATING else value
+
+    @property
+    def disagreement_count(self) -> int:
+        return self.feedback_count - self.agreement_count
+
+    def _state(self, position: int) -> Tuple[int, bool]:
+        feedback = int(self.feedback[position])
+        return feedback, bool(feedback == DISAGREE and self.ratings[position] == NO_RATING)
+
+    def _apply(self, before: Tuple[int, bool], after: Tuple[int, bool]):
+        self.feedback_count += (after[0] != NO_FEEDBACK) - (before[0] != NO_FEEDBACK)
+        self.agreement_count += (after[0] == AGREE) - (before[0] == AGREE)
+        self.pending_rating_count += after[1] - before[1]
+
+    def set_feedback(self, eval_id: int, agrees: bool):
+        position = self.position_of(eval_id)
+        self._set_feedback(position, eval_id, agrees)
+        self._propagate(position)
+
+    def _set_feedback(self, position: int, eval_id: int, agrees: bool):
+        before = self._state(position)
+        evaluation = self.evaluations[position]
+        if self.ai_ratings[position] == NO_RATING:
+            self.ai_ratings[position] = evaluation['rating']
+        self.feedback[position] = AGREE if agrees else DISAGREE
+        if agrees:
+            self.ratings[position] = NO_RATING
+        self._apply(before, self._state(position))
+        if self.log is not None:
+            self._record_feedback(position, evaluation)
+
+    def _record_feedback(self, position: int, evaluation: Dict[str, Any]):
+        self.log.record_feedback(self.annotator, evaluation['id'], bool(self.feedback[position] == AGREE),
+                                 int(self.ai_ratings[position]), position,
+                                 evaluation.get('description'), evaluation.get('model_version'))
+
+    def set_rating(self, eval_id: int, rating: Optional[int]):
+        position = self.position_of(eval_id)
+        if self._set_rating(position, eval_id, rating):
+            self._propagate(position)
+
+    def _set_rating(self, position: int, eval_id: int, rating: Optional[int]) -> bool:
+        value = NO_RATING if rating is None else rating
+        if self.ratings[position] == value:
+            return False
+        before = self._state(position)
+        self.ratings[position] = value
+        self._apply(before, self._state(position))
+        if self.log is not None:
+            self.log.record_rating(self.annotator, eval_id, rating)
+        return True
+
+    def _propagate(self, position: int):
+        """Give every near duplicate of ``position`` the same human rating, once it is known."""
+        if self.duplicates is None:
+            return
+        feedback, needs_rating = self._state(position)
+        if feedback == NO_FEEDBACK or needs_rating:
+            return
+        human = int(self.ai_ratings[position] if feedback == AGREE else self.ratings[position])
+        for member in self.duplicates.members(position).tolist():
+            evaluation = self.evaluations[member]
+            # The duplicate may carry a different AI rating, so agreement is re-derived
+            agrees = evaluation['rating'] == human
+            self._set_feedback(member, evaluation['id'], agrees)
+            if not agrees:
+                self._set_rating(member, evaluation['id'], human)
+            self.propagated_count += 1
+
+    def restore(self) -> Optional[int]:
+        """Reload this annotator's saved state from the log.
+
+        Returns the position of the most advanced evaluation annotated so far,
+        or None when there is nothing to resume. That evaluation is already
+        done, so callers resume on the one after it.
+        """
+        if self.log is None:
+            return None
+        last_position = None
+        for eval_id, feedback, rating, ai_rating, _ in self.log.load_session(self.annotator):
+            if feedback is None:
+                continue
+            try:
+                position = self.position_of(eval_id)
+            except KeyError:
+                # Annotated under an earlier version of the evaluation set
+                continue
+            before = self._state(position)
+            self.feedback[position] = AGREE if feedback else DISAGREE
+            self.ai_ratings[position] = ai_rating or NO_RATING
+            self.ratings[position] = rating or NO_RATING
+            self._apply(before, self._state(position))
+            if last_position is None or position > last_position:
+                last_position = position
+        return last_position
+
+    def is_complete(self, eval_id: int) -> bool:
+        feedback, needs_rating = self._state(self.position_of(eval_id))
+        return feedback != NO_FEEDBACK and not needs_rating
+
+    @property
+    def all_complete(self) -> bool:
+        return self.feedback_count == len(self) and self.pending_rating_count == 0
+
+    def resend(self):
+        """Record the whole session in the log again, e.g. after it dropped some of the changes."""
+        if self.log is None:
+            return
+        for position in self.annotated().tolist():
+            evaluation = self.evaluations[position]
+            self._record_feedback(position, evaluation)
+            if self.ratings[position] != NO_RATING:
+                self.log.record_rating(self.annotator, evaluation['id'], int(self.ratings[position]))
+
+    def annotated(self) -> np.ndarray:
+        """Positions of every evaluation with feedback, in row order."""
+        return np.flatnonzero(self.feedback != NO_FEEDBACK)
+
+    def disagreements(self) -> Iterator[int]:
+        return (self.evaluations[position]['id'] for position in np.flatnonzero(self.feedback == DISAGREE).tolist())
+
+    def memory_bytes(self) -> int:
+        """Bytes held by this session's annotation arrays and id index."""
+        arrays = (self.feedback, self.ratings, self.ai_ratings, self._ids, self._id_positions)
+        return sum(array.nbytes for array in arrays if array is not None)
@@ -0,0 +1,273 @@
+"""Stream annotations, joined with their evaluations, to Parquet or gzipped CSV.
+
+Every current (annotator, evaluation) annotation in the log is written with the
+manifest columns, the annotator's verdict and rating, the resulting human
+rating and timestamps. Without a manifest, the app's built-in demo set is
+joined. Rows are read from SQLite and written in chunks, so memory stays
+bounded however large the log is. The output extension picks the format:
+``.parquet`` writes one Parquet row group per chunk (pyarrow needed), ``.csv``
+and ``.csv.gz`` write plain or gzipped CSV.
+
+With ``--watermark`` only annotations changed since the previous export are
+written. The watermark is the last event sequence number exported. Event
+numbers follow commit order, unlike timestamps, which are taken when a click is
+queued. Annotations withdrawn by a Reset since then come out as tombstones with
+an empty ``agrees``. Downstream tables keep the latest row per
+(annotator, eval_id).
+
+    python export.py --output annotations.parquet
+    python export.py --output delta.csv.gz --watermark export.watermark
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import settings
+from evaluation_store import AGREE
+from manifest import DEMO_RESULTS, open_manifest
+
+CHUNK_ROWS = 100_000
+
+# (name, pyarrow type name) in output order
+COLUMNS = [
+    ('eval_id', 'int64'),
+    ('annotator', 'string'),
+    ('original', 'string'),
+    ('processed', 'string'),
+    ('description', 'string'),
+    ('quality', 'string'),
+    ('ai_rating', 'int8'),
+    ('agrees', 'bool_'),
+    ('annotator_rating', 'int8'),
+    ('human_rating', 'int8'),
+    ('updated_at', 'float64'),
+    ('submitted_at', 'float64'),
+]
+
+FULL_QUERY = """
+SELECT annotator, eval_id, feedback, rating, ai_rating, updated
+FROM annotations
+ORDER BY annotator, eval_id
+"""
+
+INCREMENTAL_QUERY = """
+SELECT touched.annotator, touched.eval_id, a.feedback, a.rating, a.ai_rating, a.updated
+FROM (
+    SELECT annotator, eval_id FROM events
+    WHERE seq > :since AND seq <= :until AND eval_id IS NOT NULL
+    UNION
+    -- Everything an annotator had annotated before a Reset in the window
+    SELECT events.annotator, events.eval_id FROM events
+    JOIN (
+        SELECT annotator, MAX(seq) AS reset_seq FROM events
+        WHERE seq > :since AND seq <= :until AND kind = 'reset'
+        GROUP BY annotator
+    ) AS resets ON resets.annotator = events.annotator
+    WHERE events.seq < resets.reset_seq AND events.eval_id IS NOT NULL
+) AS touched
+LEFT JOIN annotations AS a ON a.annotator = touched.annotator AND a.eval_id = touched.eval_id
+ORDER BY touched.annotator, touched.eval_id
+"""
+
+
+def have_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def read_watermark(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return int(json.load(f)['seq'])
+
+
+def write_watermark(path: str, seq: int, rows: int, output: str):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump({'seq': seq, 'rows': rows, 'output': os.path.abspath(output), 'exported_at': time.time()}, f)
+    os.replace(temporary, path)
+
+
+def annotation_chunks(conn: sqlite3.Connection, since: Optional[int], until: int,
+                      chunk_rows: int = CHUNK_ROWS) -> Iterator[List[Tuple]]:
+    """Lists of (annotator, eval_id, feedback, rating, ai_rating, updated) rows."""
+    if since is None:
+        cursor = conn.execute(FULL_QUERY)
+    else:
+        cursor = conn.execute(INCREMENTAL_QUERY, {'since': since, 'until': until})
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield rows
+
+
+def submission_times(conn: sqlite3.Connection, until: int) -> Dict[str, float]:
+    """Latest submission per annotator; annotators are few, so this fits in memory."""
+    return dict(conn.execute(
+        "SELECT annotator, MAX(ts) FROM events WHERE kind = 'submit' AND seq <= ? GROUP BY annotator", (until,)
+    ).fetchall())
+
+
+def _evaluation(evaluations, eval_id: int) -> Optional[Dict[str, Any]]:
+    # A manifest, or the demo rows keyed by id
+    if evaluations is None:
+        return None
+    if isinstance(evaluations, dict):
+        return evaluations.get(eval_id)
+    try:
+        return evaluations[evaluations.position_of(eval_id)]
+    except KeyError:
+        return None
+
+
+def join_chunk(rows: List[Tuple], evaluations, submitted: Dict[str, float]) -> Dict[str, List[Any]]:
+    """Columns of one output chunk; manifest fields are empty for ids the manifest lacks."""
+    columns: Dict[str, List[Any]] = {name: [] for name, _ in COLUMNS}
+    for annotator, eval_id, feedback, rating, ai_rating, updated in rows:
+        evaluation = _evaluation(evaluations, eval_id)
+        agrees = None if feedback is None else feedback == AGREE
+        columns['eval_id'].append(eval_id)
+        columns['annotator'].append(annotator)
+        for field in ('original', 'processed', 'description', 'quality'):
+            columns[field].append(evaluation[field] if evaluation is not None else None)
+        columns['ai_rating'].append(ai_rating)
+        columns['agrees'].append(agrees)
+        columns['annotator_rating'].append(rating)
+        columns['human_rating'].append(ai_rating if agrees else rating)
+        columns['updated_at'].append(updated)
+        columns['submitted_at'].append(submitted.get(annotator))
+    return columns
+
+
+class ParquetSink:
+    format = 'parquet'
+
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self.schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in COLUMNS])
+        self._writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, columns: Dict[str, List[Any]]):
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class CsvSink:
+    format = 'csv'
+
+    def __init__(self, path: str):
+        if path.lower().endswith('.gz'):
+            self._file = gzip.open(path, 'wt', newline='', encoding='utf-8', compresslevel=6)
+        else:
+            self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._csv = csv.writer(self._file)
+        self._csv.writerow([name for name, _ in COLUMNS])
+
+    def write(self, columns: Dict[str, List[Any]]):
+        self._csv.writerows(zip(*(columns[name] for name, _ in COLUMNS)))
+
+    def close(self):
+        self._file.close()
+
+
+def output_format_of(path: str, output_format: str = 'auto') -> str:
+    """The requested format, or for 'auto' the one the extension names; Parquet if pyarrow is there otherwise."""
+    if output_format != 'auto':
+        return output_format
+    name = path.lower()
+    if name.endswith(('.csv', '.csv.gz', '.gz')):
+        return 'csv'
+    if name.endswith('.parquet'):
+        return 'parquet'
+    return 'parquet' if have_pyarrow() else 'csv'
+
+
+def open_sink(path: str, output_format: str):
+    if output_format_of(path, output_format) == 'parquet':
+        return ParquetSink(path)
+    return CsvSink(path)
+
+
+def export(log_path: str, output: str, manifest_path: Optional[str] = None, watermark_path: Optional[str] = None,
+           output_format: str = 'auto', chunk_rows: int = CHUNK_ROWS) -> Dict[str, Any]:
+    if manifest_path:
+        evaluations = open_manifest(manifest_path)
+    else:
+        # The app serves the demo set when no manifest is configured
+        evaluations = {row['id']: row for row in DEMO_RESULTS}
+    since = read_watermark(watermark_path) if watermark_path else None
+
+    conn = sqlite3.connect(log_path, timeout=30)
+    # One read transaction: the WAL snapshot keeps the export consistent while annotators keep writing
+    conn.execute("BEGIN")
+    try:
+        until = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+        submitted = submission_times(conn, until)
+        sink = open_sink(output, output_format)
+        rows = tombstones = 0
+        try:
+            for chunk in annotation_chunks(conn, since, until, chunk_rows):
+                columns = join_chunk(chunk, evaluations, submitted)
+                sink.write(columns)
+                rows += len(chunk)
+                tombstones += columns['agrees'].count(None)
+        finally:
+            sink.close()
+    finally:
+        conn.rollback()
+        conn.close()
+    if watermark_path:
+        write_watermark(watermark_path, until, rows, output)
+    return {'rows': rows, 'tombstones': tombstones, 'since': since, 'watermark': until,
+            'format': sink.format}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--log', default=settings.ANNOTATION_LOG_PATH, help="annotation log (default: %(default)s)")
+    parser.add_argument('--manifest', default=settings.EVALUATION_MANIFEST or None,
+                        help="manifest to join for paths and descriptions (default: EVALUATOR_MANIFEST)")
+    parser.add_argument('--output', required=True, help="output .parquet, .csv or .csv.gz file")
+    parser.add_argument('--format', choices=('auto', 'parquet', 'csv'), default='auto',
+                        help="auto follows the output extension, and writes Parquet for other extensions "
+                             "when pyarrow is installed")
+    parser.add_argument('--watermark', help="export only changes since the watermark in this file, then advance it")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="rows per chunk / row group")
+    args = parser.parse_args(argv)
+
+    if not args.log or not os.path.exists(args.log):
+        print(f"annotation log not found: {args.log}", file=sys.stderr)
+        return 2
+    if output_format_of(args.output, args.format) == 'parquet' and not have_pyarrow():
+        print(f"writing Parquet to {args.output} needs pyarrow; install it or write a .csv/.csv.gz file",
+              file=sys.stderr)
+        return 2
+
+    started = time.perf_counter()
+    result = export(args.log, args.output, args.manifest, args.watermark, args.format, args.chunk_rows)
+    elapsed = time.perf_counter() - started
+    rate = result['rows'] / elapsed if elapsed > 0 else 0.0
+    scope = "all annotations" if result['since'] is None else f"changes after event {result['since']}"
+    print(f"exported {result['rows']} rows ({result['tombstones']} withdrawn) as {result['format']}, {scope}, "
+          f"up to event {result['watermark']} in {elapsed:.2f}s: {rate:.0f} rows/sec", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Process-wide cache of decoded, display-sized images.
+
+Streamlit re-executes ``app.py`` on every click, but imported modules live for
+the whole server process, so a single ``ImageCache`` here is shared by every
+annotator session. Entries are RGBA ``uint8`` arrays keyed by path, mtime and
+target size and evicted least-recently-used once the byte budget is exceeded.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import settings
+from preflight import known_stat
+
+CacheKey = Tuple[str, int, str, int]
+
+
+def decode_image(path: str, width: Optional[int] = None, max_side: Optional[int] = None) -> np.ndarray:
+    """Decode ``path`` to an RGBA array scaled to ``width`` or bounded by ``max_side``."""
+    with Image.open(path) as img:
+        src_w, src_h = img.size
+        if width is not None:
+            scale = width / src_w
+        elif max_side is not None:
+            scale = min(1.0, max_side / max(src_w, src_h))
+        else:
+            scale = 1.0
+        target = (max(1, round(src_w * scale)), max(1, round(src_h * scale)))
+        if scale < 1.0:
+            # Lets the JPEG decoder skip straight to a reduced DCT scale
+            img.draft('RGB', target)
+        img = img.convert('RGBA')
+        if img.size != target:
+            img = img.resize(target, Image.LANCZOS)
+        pixels = np.asarray(img)
+    pixels.setflags(write=False)
+    return pixels
+
+
+class ImageCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[CacheKey, np.ndarray]" = OrderedDict()
+        self._inflight: Dict[CacheKey, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(path: str, width: Optional[int] = None, max_side: Optional[int] = None) -> CacheKey:
+        path = os.path.abspath(path)
+        # Raises FileNotFoundError for missing assets, which callers already handle
+        _, mtime = known_stat(path)
+        if width is not None:
+            return (path, mtime, 'w', width)
+        return (path, mtime, 'max', max_side or 0)
+
+    def get(self, path: str, width: Optional[int] = None, max_side: Optional[int] = None) -> np.ndarray:
+        key = self.make_key(path, width, max_side)
+        while True:
+            with self._lock:
+                pixels = self._entries.get(key)
+                if pixels is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return pixels
+                pending = self._inflight.get(key)
+                if pending is None:
+                    # This caller decodes; concurrent sessions wait for it
+                    pending = threading.Event()
+                    self._inflight[key] = pending
+                    self.misses += 1
+                    break
+            pending.wait()
+
+        try:
+            pixels = decode_image(path, width, max_side)
+            self._store(key, pixels)
+            return pixels
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            pending.set()
+
+    def contains(self, path: str, width: Optional[int] = None, max_side: Optional[int] = None) -> bool:
+        try:
+            key = self.make_key(path, width, max_side)
+        except OSError:
+            return False
+        with self._lock:
+            return key in self._entries
+
+    def _store(self, key: CacheKey, pixels: np.ndarray):
+        size = pixels.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = pixels
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+_cache: Optional[ImageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ImageCache(settings.IMAGE_CACHE_MAX_BYTES)
+    return _cache
+
+
+def load_thumbnail(path: str) -> np.ndarray:
+    return get_image_cache().get(path, width=settings.THUMBNAIL_WIDTH)
@@ -0,0 +1,231 @@
+"""Per-rerun timing spans, histograms and an optional profiler for the slowest reruns.
+
+``span(name)`` times a phase of ``app.py`` (CSS, image loading, widgets,
+submission, the executive summary) into a histogram shared by every session of
+the server process. A whole script run is bracketed by ``begin_rerun`` and
+``end_rerun``; fragment reruns, which skip the top of the script, use
+``rerun(page)`` instead. Histograms are written in Prometheus text format to
+``settings.METRICS_PATH``, ready for node_exporter's textfile collector.
+
+When ``settings.PROFILE_DIR`` is set, every rerun runs under cProfile and the
+``settings.PROFILE_KEEP`` slowest are kept there as ``.prof`` files, e.g. for
+``python -m pstats`` or snakeviz.
+"""
+import cProfile
+import heapq
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+import settings
+
+# Prometheus' default buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Metrics files are rewritten at most this often
+WRITE_INTERVAL = 5.0
+PROFILE_NAME = re.compile(r'rerun-(\d+)ms-.*\.prof$')
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += seconds
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def lines(self, metric: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{labels}}} {self.total:.6f}')
+        lines.append(f'{metric}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class SlowestProfiles:
+    """Keeps cProfile dumps of the ``keep`` slowest reruns in ``directory``."""
+
+    def __init__(self, directory: str, keep: int):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        # Min-heap of (milliseconds, path), so the fastest kept profile is evicted first
+        self._kept: List[Tuple[int, str]] = []
+        for name in os.listdir(directory):
+            match = PROFILE_NAME.match(name)
+            if match:
+                self._kept.append((int(match.group(1)), os.path.join(directory, name)))
+        heapq.heapify(self._kept)
+        self._lock = threading.Lock()
+
+    def qualifies(self, milliseconds: int) -> bool:
+        return len(self._kept) < self.keep or milliseconds > self._kept[0][0]
+
+    def offer(self, profiler: cProfile.Profile, seconds: float, page: str):
+        milliseconds = int(seconds * 1000)
+        with self._lock:
+            if not self.qualifies(milliseconds):
+                return
+            path = os.path.join(self.directory, f"rerun-{milliseconds:07d}ms-{page}-{time.strftime('%Y%m%dT%H%M%S')}"
+                                                f"-{threading.get_ident()}.prof")
+            profiler.dump_stats(path)
+            heapq.heappush(self._kept, (milliseconds, path))
+            while len(self._kept) > self.keep:
+                _, evicted = heapq.heappop(self._kept)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+
+
+class _Rerun:
+    def __init__(self, profiles: Optional[SlowestProfiles]):
+        self.started = time.perf_counter()
+        self.profiler = None
+        if profiles is not None:
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler is already active (one at a time on Python 3.12+)
+                self.profiler = None
+
+
+class Metrics:
+    def __init__(self, metrics_path: str = '', profile_dir: str = '', profile_keep: int = 5):
+        self.metrics_path = metrics_path
+        self.profiles = SlowestProfiles(profile_dir, profile_keep) if profile_dir else None
+        self.spans: Dict[str, Histogram] = {}
+        self.reruns: Dict[str, Histogram] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written = 0.0
+
+    def observe(self, family: Dict[str, Histogram], name: str, seconds: float):
+        with self._lock:
+            histogram = family.get(name)
+            if histogram is None:
+                histogram = family[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Also recorded when st.rerun() interrupts the phase
+            self.observe(self.spans, name, time.perf_counter() - started)
+
+    def begin_rerun(self):
+        """Start timing a script run on this thread, abandoning one that never finished."""
+        self._abandon()
+        self._local.rerun = _Rerun(self.profiles)
+
+    def end_rerun(self, page: str):
+        current = getattr(self._local, 'rerun', None)
+        if current is None:
+            return
+        self._local.rerun = None
+        seconds = time.perf_counter() - current.started
+        if current.profiler is not None:
+            current.profiler.disable()
+            self.profiles.offer(current.profiler, seconds, page)
+        self.observe(self.reruns, page, seconds)
+        self.maybe_write()
+
+    @contextmanager
+    def rerun(self, page: str):
+        """Time a fragment rerun; inside a full script run this is only a span."""
+        if getattr(self._local, 'rerun', None) is not None:
+            with self.span(page):
+                yield
+            return
+        self.begin_rerun()
+        try:
+            yield
+        finally:
+            self.end_rerun(page)
+
+    def _abandon(self):
+        # A run cut short by st.rerun() or an exception is neither counted nor profiled
+        current = getattr(self._local, 'rerun', None)
+        if current is not None and current.profiler is not None:
+            current.profiler.disable()
+        self._local.rerun = None
+
+    def render(self) -> str:
+        lines = []
+        families = (
+            ('evaluator_rerun_seconds', 'page', self.reruns, "Wall time of app reruns by page."),
+            ('evaluator_span_seconds', 'span', self.spans, "Wall time of instrumented phases within reruns."),
+        )
+        with self._lock:
+            for metric, label, family, description in families:
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} histogram")
+                for name in sorted(family):
+                    lines.extend(family[name].lines(metric, f'{label}="{name}"'))
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        """Atomically replace the metrics file, so scrapers never read half of it."""
+        directory = os.path.dirname(os.path.abspath(self.metrics_path))
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, prefix='.metrics-', suffix='.tmp')
+        with os.fdopen(handle, 'w') as f:
+            f.write(self.render())
+        os.replace(temporary, self.metrics_path)
+
+    def maybe_write(self):
+        if not self.metrics_path or time.monotonic() - self._written < WRITE_INTERVAL:
+            return
+        self._written = time.monotonic()
+        try:
+            self.write()
+        except OSError:
+            # Metrics must never break the app
+            pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Counts and mean milliseconds per rerun page and span."""
+        with self._lock:
+            return {
+                kind: {name: {'count': histogram.count, 'mean_ms': round(histogram.total / histogram.count * 1000, 2)}
+                       for name, histogram in family.items()}
+                for kind, family in (('reruns', self.reruns), ('spans', self.spans))
+            }
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics(settings.METRICS_PATH, settings.PROFILE_DIR, settings.PROFILE_KEEP)
+    return _metrics
+
+
+def span(name: str):
+    return get_metrics().span(name)
@@ -0,0 +1,404 @@
+"""Lazily read evaluation manifests (CSV or JSONL) with a persistent offset index.
+
+A manifest holds one evaluation per line using the same schema as
+``DEMO_RESULTS`` (``id``, ``original``, ``processed``, ``rating``, ``quality``,
+``description``). The first open scans the file once and writes the byte
+offset of every row to a ``.offsets.npy`` sidecar; later opens memory-map that
+sidecar, so random access to any row costs one seek plus parsing one page, and
+memory use does not grow with the manifest size.
+
+CSV fields may be quoted and contain newlines: a CSV file with any quote
+character is indexed with the ``csv`` parser, so offsets always fall on
+record boundaries.
+"""
+import csv
+import io
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+INDEX_VERSION = 2
+PAGE_SIZE = 256
+CACHED_PAGES = 8
+SCAN_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Built-in demo set, used when no manifest is configured; paths are relative to the app directory
+DEMO_RESULTS = [
+    {
+        'id': 1,
+        'original': 'Before 0.jpg',
+        'processed': 'After 0.png',
+        'rating': 4,
+        'quality': 'Near Production Ready',
+        'description': 'Professional Portrait'
+    },
+    {
+        'id': 2,
+        'original': 'Before 01.jpg',
+        'processed': 'After 01.png',
+        'rating': 3,
+        'quality': 'Moderately Functional',
+        'description': 'Business Attire'
+    },
+    {
+        'id': 3,
+        'original': 'Before 02.jpg',
+        'processed': 'After 02.png',
+        'rating': 4,
+        'quality': 'Near Production Ready',
+        'description': 'Product - Smartphone'
+    },
+    {
+        'id': 4,
+        'original': 'Before 03.jpg',
+        'processed': 'After 03.png',
+        'rating': 5,
+        'quality': 'Production Ready',
+        'description': 'Steak Dish'
+    },
+    {
+        'id': 5,
+        'original': 'Before 04.jpg',
+        'processed': 'After 04.png',
+        'rating': 2,
+        'quality': 'Partially Viable',
+        'description': 'Product - Coffee Cup'
+    }
+]
+
+INT_FIELDS = ('id', 'rating')
+PATH_FIELDS = ('original', 'processed')
+
+
+class Evaluation:
+    """One manifest row.
+
+    Reads like the row dict (``evaluation['original']``, ``get``, ``keys``) but
+    stores the schema fields in slots; any other columns go to ``extra``.
+    """
+    FIELDS = ('id', 'original', 'processed', 'rating', 'quality', 'description')
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, id: int, original: str, processed: str, rating: Optional[int] = None,
+                 quality: Optional[str] = None, description: str = '', extra: Optional[Dict[str, Any]] = None):
+        self.id = id
+        self.original = original
+        self.processed = processed
+        self.rating = rating
+        self.quality = quality
+        self.description = description
+        self.extra = extra or None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> 'Evaluation':
+        extra = {key: value for key, value in row.items() if key not in cls.FIELDS}
+        return cls(*(row.get(field) for field in cls.FIELDS), extra=extra)
+
+    def __getitem__(self, field: str) -> Any:
+        if field in self.FIELDS:
+            return getattr(self, field)
+        if self.extra is not None and field in self.extra:
+            return self.extra[field]
+        raise KeyError(field)
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.FIELDS or (self.extra is not None and field in self.extra)
+
+    def get(self, field: str, default: Any = None) -> Any:
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def keys(self) -> List[str]:
+        return list(self.FIELDS) + list(self.extra or ())
+
+    def __repr__(self) -> str:
+        return f"Evaluation({dict(self)!r})"
+
+
+def _line_offsets(path: str, skip_header: bool) -> np.ndarray:
+    """Byte offsets of every non-blank line, found with vectorized newline search."""
+    starts = []
+    position = 0
+    line_start = 0
+    last_byte = 0x0A
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(SCAN_CHUNK_BYTES)
+            if not chunk:
+                break
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            local = np.flatnonzero(data == 0x0A)
+            if len(local):
+                newlines = local + position
+                line_starts = np.concatenate(([line_start], newlines[:-1] + 1))
+                # Byte before each newline, to treat CRLF-only lines as blank
+                before = np.where(local > 0, data[np.maximum(local - 1, 0)], last_byte)
+                lengths = newlines - line_starts - (before == 0x0D)
+                starts.append(line_starts[lengths > 0])
+                line_start = int(newlines[-1]) + 1
+            last_byte = int(data[-1])
+            position += len(chunk)
+    if position > line_start and last_byte != 0x0D:
+        starts.append(np.array([line_start], dtype=np.int64))
+    offsets = np.concatenate(starts).astype(np.int64) if starts else np.zeros(0, dtype=np.int64)
+    if skip_header and len(offsets):
+        offsets = offsets[1:]
+    # Sentinel end offset so row i spans offsets[i]:offsets[i + 1]
+    return np.append(offsets, position)
+
+
+def _contains_byte(path: str, byte: bytes) -> bool:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(SCAN_CHUNK_BYTES)
+            if not chunk:
+                return False
+            if byte in chunk:
+                return True
+
+
+def _record_offsets(path: str, skip_header: bool) -> np.ndarray:
+    """Byte offsets of every non-blank CSV record, following the ``csv`` parser's quoting rules."""
+    line_offsets: List[int] = []
+    size = 0
+
+    def lines(f):
+        nonlocal size
+        for line in f:
+            line_offsets.append(size)
+            size += len(line)
+            yield line.decode('utf-8')
+
+    offsets = []
+    with open(path, 'rb') as f:
+        # Each record starts at the first line the reader consumed for it
+        consumed = 0
+        for record in csv.reader(lines(f)):
+            if record:
+                offsets.append(line_offsets[consumed])
+            consumed = len(line_offsets)
+    if skip_header:
+        offsets = offsets[1:]
+    return np.array(offsets + [size], dtype=np.int64)
+
+
+def _row_lines(text: str) -> List[str]:
+    # Same notion of a blank line as _line_offsets, so rows stay aligned with the index
+    return [line for line in text.split('\n') if line.rstrip('\r')]
+
+
+class Manifest(Sequence, ABC):
+    skip_header = False
+
+    def __init__(self, path: str, index_dir: Optional[str] = None):
+        self.path = os.path.abspath(path)
+        self.base_dir = os.path.dirname(self.path)
+        self.index_dir = index_dir or self.base_dir
+        self._pages: "OrderedDict[int, List[Evaluation]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'rb')
+        self.offsets = self._load_index()
+        self._id_index = None
+        self._row_ids = None
+        self._id_lock = threading.Lock()
+        self._codes: Dict[str, Tuple[List[str], np.ndarray]] = {}
+        self._codes_lock = threading.Lock()
+
+    def _sidecar(self, suffix: str) -> str:
+        return os.path.join(self.index_dir, os.path.basename(self.path) + suffix)
+
+    def _load_index(self) -> np.ndarray:
+        stat = os.stat(self.path)
+        meta_path = self._sidecar('.index.json')
+        offsets_path = self._sidecar('.offsets.npy')
+        expected = {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        try:
+            with open(meta_path) as f:
+                if json.load(f) == expected:
+                    return np.load(offsets_path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+
+        offsets = self.scan_offsets()
+        # The id index belongs to the previous version of the file
+        try:
+            os.remove(self._sidecar('.ids.npy'))
+        except OSError:
+            pass
+        self._write_index(offsets_path, meta_path, offsets, expected)
+        return np.load(offsets_path, mmap_mode='r')
+
+    def scan_offsets(self) -> np.ndarray:
+        return _line_offsets(self.path, self.skip_header)
+
+    def _save_array(self, path: str, array: np.ndarray):
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+
+    def _write_index(self, offsets_path: str, meta_path: str, offsets: np.ndarray, meta: Dict[str, Any]):
+        self._save_array(offsets_path, offsets)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _load_id_index(self) -> np.ndarray:
+        """Rows of (id, position) sorted by id, built on first use and kept as a sidecar."""
+        ids_path = self._sidecar('.ids.npy')
+        try:
+            return np.load(ids_path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+        index = np.empty((len(self), 2), dtype=np.int64)
+        index[:, 1] = np.arange(len(self))
+        for page_number in range(0, len(self), PAGE_SIZE):
+            page = self._page(page_number // PAGE_SIZE)
+            index[page_number:page_number + len(page), 0] = [row['id'] for row in page]
+        index = index[np.argsort(index[:, 0], kind='stable')]
+        self._save_array(ids_path, index)
+        return np.load(ids_path, mmap_mode='r')
+
+    def _sorted_ids(self) -> np.ndarray:
+        if self._id_index is None:
+            with self._id_lock:
+                if self._id_index is None:
+                    self._id_index = self._load_id_index()
+        return self._id_index
+
+    def ids(self) -> np.ndarray:
+        """Id of every row, in row order."""
+        if self._row_ids is None:
+            index = self._sorted_ids()
+            row_ids = np.empty(len(self), dtype=np.int64)
+            row_ids[index[:, 1]] = index[:, 0]
+            self._row_ids = row_ids
+        return self._row_ids
+
+    def codes(self, name: str, key: Callable[[Evaluation], str]) -> Tuple[List[str], np.ndarray]:
+        """Distinct ``key`` values and the code of every row's value, built on first use and kept as sidecars.
+
+        ``name`` identifies ``key``: sidecars are reused while the manifest is unchanged.
+        """
+        with self._codes_lock:
+            cached = self._codes.get(name)
+            if cached is None:
+                cached = self._codes[name] = self._load_codes(name, key)
+        return cached
+
+    def _load_codes(self, name: str, key: Callable[[Evaluation], str]) -> Tuple[List[str], np.ndarray]:
+        stat = os.stat(self.path)
+        meta_path = self._sidecar(f'.{name}.json')
+        codes_path = self._sidecar(f'.{name}.npy')
+        expected = {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if all(meta.get(field) == value for field, value in expected.items()):
+                return meta['names'], np.load(codes_path, mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            pass
+        values: Dict[str, int] = {}
+        codes = np.empty(len(self), dtype=np.int32)
+        for start in range(0, len(self), PAGE_SIZE):
+            page = self._page(start // PAGE_SIZE)
+            codes[start:start + len(page)] = [values.setdefault(key(row), len(values)) for row in page]
+        self._write_index(codes_path, meta_path, codes, dict(expected, names=list(values)))
+        return list(values), np.load(codes_path, mmap_mode='r')
+
+    def position_of(self, eval_id: int) -> int:
+        """Row position of ``eval_id``; raises KeyError when the id is absent."""
+        ids = self._sorted_ids()[:, 0]
+        slot = int(np.searchsorted(ids, eval_id))
+        if slot == len(ids) or ids[slot] != eval_id:
+            raise KeyError(eval_id)
+        return int(self._id_index[slot, 1])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        page = self._page(index // PAGE_SIZE)
+        return page[index % PAGE_SIZE]
+
+    def _page(self, page_number: int) -> List[Evaluation]:
+        with self._lock:
+            page = self._pages.get(page_number)
+            if page is not None:
+                self._pages.move_to_end(page_number)
+                return page
+            start = page_number * PAGE_SIZE
+            stop = min(start + PAGE_SIZE, len(self))
+            begin, end = int(self.offsets[start]), int(self.offsets[stop])
+            self._file.seek(begin)
+            data = self._file.read(end - begin)
+        page = [self._normalize(row) for row in self.parse_page(data.decode('utf-8'))]
+        with self._lock:
+            self._pages[page_number] = page
+            while len(self._pages) > CACHED_PAGES:
+                self._pages.popitem(last=False)
+        return page
+
+    def _normalize(self, row: Dict[str, Any]) -> Evaluation:
+        for field in INT_FIELDS:
+            value = row.get(field)
+            if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+                row[field] = int(value)
+        for field in PATH_FIELDS:
+            value = row.get(field)
+            if value and not os.path.isabs(value):
+                row[field] = os.path.join(self.base_dir, value)
+        return Evaluation.from_row(row)
+
+    @abstractmethod
+    def parse_page(self, text: str) -> List[Dict[str, Any]]:
+        """Rows of the raw text between two index offsets."""
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlManifest(Manifest):
+    def parse_page(self, text: str) -> List[Dict[str, Any]]:
+        return [json.loads(line) for line in _row_lines(text)]
+
+
+class CsvManifest(Manifest):
+    skip_header = True
+
+    def __init__(self, path: str, index_dir: Optional[str] = None):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            self.fieldnames = next(csv.reader(f))
+        super().__init__(path, index_dir)
+
+    def scan_offsets(self) -> np.ndarray:
+        # Only quoted fields can hold newlines; files without quotes keep the vectorized scan
+        if _contains_byte(self.path, b'"'):
+            return _record_offsets(self.path, self.skip_header)
+        return super().scan_offsets()
+
+    def parse_page(self, text: str) -> List[Dict[str, Any]]:
+        # DictReader skips blank lines, as the index does
+        return list(csv.DictReader(io.StringIO(text), fieldnames=self.fieldnames))
+
+
+def open_manifest(path: str, index_dir: Optional[str] = None) -> Manifest:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return JsonlManifest(path, index_dir)
+    if extension == '.csv':
+        return CsvManifest(path, index_dir)
+    raise ValueError(f"Unsupported manifest format: {path} (expected .csv or .jsonl)")
@@ -0,0 +1,241 @@
+"""Edge-artifact overlays that point reviewers at likely cutout problems.
+
+For a Before/After pair, the processed alpha and the original are reduced to
+three masks:
+
+- ``fringe``: semi-transparent pixels, the soft or smeared edges seen as halos.
+- ``spill``: kept pixels near the boundary that have the colour of the removed
+  background nearby.
+- ``dropped``: pixels near the subject that were removed although, in the
+  original, they look like the subject rather than the background.
+
+The masks are painted over the original, which is dimmed where the cutout
+removed it, so content the cutout lost stays visible even where the local
+colour test cannot tell it from the background. Every step is a whole-array
+NumPy operation at no more than ``OVERLAY_SIDE`` pixels per side.
+Neighbourhood means come from running sums, so their cost does not depend on
+the neighbourhood size. Overlays are stored as WebP in the rendition cache,
+keyed by the SHA-256 of both images, next to the renditions ``transcode.py``
+writes. ``python overlay.py --manifest evaluations.csv`` precomputes them; the
+app computes missing ones on first view.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import settings
+from image_cache import decode_image
+from scorer import OPAQUE, SEMI_LOW
+from transcode import WEBP_QUALITY, file_digest, rendition_path
+
+OVERLAY_SIDE = 1024
+# Radius, as a share of the longer side, of the neighbourhood whose subject and background colours are compared
+NEIGHBOURHOOD = 0.015
+# A pixel takes the other side's class when it is this much closer to that side's mean colour
+LIKENESS = 0.5
+# Nearby subject and background closer than this RGB distance are too alike to judge
+MIN_CONTRAST = 30.0
+HIGHLIGHT_OPACITY = 0.7
+REMOVED_DIM = 0.35
+# Painted in this order, so later classes win where masks overlap
+COLORS = {
+    'dropped': (239, 68, 68),
+    'fringe': (250, 204, 21),
+    'spill': (217, 70, 239),
+}
+LEGEND = {'dropped': "🟥 dropped foreground", 'fringe': "🟨 semi-transparent fringe", 'spill': "🟪 colour spill"}
+
+
+def load_pair(original_path: str, processed_path: str, max_side: int = OVERLAY_SIDE) -> Tuple[np.ndarray, np.ndarray]:
+    """Original RGB and processed RGBA at the same size, no larger than ``max_side``."""
+    processed = decode_image(processed_path, max_side=max_side)
+    height, width = processed.shape[:2]
+    with Image.open(original_path) as original:
+        original.draft('RGB', (width, height))
+        original = original.convert('RGB')
+        if original.size != (width, height):
+            original = original.resize((width, height), Image.BILINEAR)
+        return np.asarray(original), processed
+
+
+def box_sum(values: np.ndarray, radius: int) -> np.ndarray:
+    """Sum of integer ``values`` over the (2 * radius + 1)-square around every pixel, clipped at the borders.
+
+    One running sum per axis; differences of running sums give the window
+    sums, so the cost does not depend on ``radius``.
+    """
+    for axis in (0, 1):
+        length = values.shape[axis]
+        running = np.cumsum(values, axis=axis, dtype=np.int32)
+        running = np.concatenate([np.zeros_like(np.take(running, [0], axis=axis)), running], axis=axis)
+        upper = np.minimum(np.arange(length) + radius + 1, length)
+        lower = np.maximum(np.arange(length) - radius, 0)
+        values = np.take(running, upper, axis=axis) - np.take(running, lower, axis=axis)
+    return values
+
+
+def _local_mean(colors: np.ndarray, mask: np.ndarray, radius: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean colour of the ``mask`` pixels around every pixel, and how many there are."""
+    counts = box_sum(mask, radius)
+    sums = box_sum(np.where(mask[..., None], colors, 0), radius)
+    return sums / np.maximum(counts, 1).astype(np.float32)[..., None], counts
+
+
+def _distance(colors: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    return np.sqrt(((colors.astype(np.float32) - reference) ** 2).sum(axis=-1))
+
+
+def artifact_masks(original: np.ndarray, processed: np.ndarray) -> Dict[str, np.ndarray]:
+    """Fringe, spill and dropped masks, judged against the colours of the subject and background nearby."""
+    alpha = processed[..., 3]
+    opaque = alpha >= OPAQUE
+    clear = alpha <= SEMI_LOW
+    radius = max(2, round(max(alpha.shape) * NEIGHBOURHOOD))
+    subject, subject_count = _local_mean(original, opaque, radius)
+    removed, removed_count = _local_mean(original, clear, radius)
+    judged = (subject_count > 0) & (removed_count > 0) & (_distance(subject, removed) > MIN_CONTRAST)
+    to_subject = _distance(original, subject)
+    # Kept pixels coloured like the removed side, and removed pixels coloured like the kept side
+    spill = opaque & judged & (_distance(processed[..., :3], removed) < to_subject * LIKENESS)
+    dropped = clear & judged & (to_subject < _distance(original, removed) * LIKENESS)
+    return {
+        'dropped': dropped,
+        'fringe': ~opaque & ~clear,
+        'spill': spill,
+    }
+
+
+def render(original: np.ndarray, processed: np.ndarray, masks: Dict[str, np.ndarray]) -> np.ndarray:
+    """The original, dimmed where removed, with the masks painted over it."""
+    kept = processed[..., 3:].astype(np.float32) / 255.0
+    image = original.astype(np.float32) * (REMOVED_DIM + (1.0 - REMOVED_DIM) * kept)
+    for name, color in COLORS.items():
+        mask = masks[name]
+        image[mask] = image[mask] * (1.0 - HIGHLIGHT_OPACITY) + np.array(color, dtype=np.float32) * HIGHLIGHT_OPACITY
+    return np.round(image).astype(np.uint8)
+
+
+def summarize(masks: Dict[str, np.ndarray], processed: np.ndarray) -> Dict[str, Any]:
+    """Pixel count of every mask and its share of the kept subject."""
+    subject = max(1, int(np.count_nonzero(processed[..., 3] >= OPAQUE)))
+    summary = {}
+    for name, mask in masks.items():
+        pixels = int(np.count_nonzero(mask))
+        summary[name] = {'pixels': pixels, 'percent': round(pixels / subject * 100, 2)}
+    return summary
+
+
+def compute(original_path: str, processed_path: str, max_side: int = OVERLAY_SIDE) -> Tuple[Image.Image, Dict[str, Any]]:
+    original, processed = load_pair(original_path, processed_path, max_side)
+    masks = artifact_masks(original, processed)
+    return Image.fromarray(render(original, processed, masks), 'RGB'), summarize(masks, processed)
+
+
+def _digest(path: str) -> str:
+    from preflight import get_asset_index
+
+    index = get_asset_index()
+    digest = index.digest(path) if index is not None else None
+    return digest or file_digest(path)
+
+
+def overlay_path(cache_dir: str, original_path: str, processed_path: str) -> str:
+    # Next to the processed image's renditions, named after the original it is compared with
+    return rendition_path(cache_dir, _digest(processed_path), f"overlay-{_digest(original_path)[:16]}")
+
+
+def _write(path: str, image: Image.Image, summary: Dict[str, Any]):
+    buffer = io.BytesIO()
+    image.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for target, data in ((f"{path[:-len('.webp')]}.json", json.dumps(summary).encode('utf-8')),
+                         (path, buffer.getvalue())):
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+
+
+def load_overlay(original_path: str, processed_path: str,
+                 cache_dir: Optional[str] = None) -> Tuple[bytes, Dict[str, Any]]:
+    """WebP bytes and mask summary of the pair's overlay, computed and stored on first use."""
+    path = overlay_path(cache_dir or settings.RENDITION_CACHE_DIR, original_path, processed_path)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(f"{path[:-len('.webp')]}.json") as f:
+            return data, json.load(f)
+    except FileNotFoundError:
+        pass
+    image, summary = compute(original_path, processed_path)
+    _write(path, image, summary)
+    with open(path, 'rb') as f:
+        return f.read(), summary
+
+
+def _precompute(task: Tuple[str, str, str]) -> Dict[str, Any]:
+    original_path, processed_path, cache_dir = task
+    started = time.perf_counter()
+    path = overlay_path(cache_dir, original_path, processed_path)
+    if os.path.exists(path):
+        return {'computed': False, 'seconds': 0.0}
+    image, summary = compute(original_path, processed_path)
+    _write(path, image, summary)
+    return {'computed': True, 'seconds': time.perf_counter() - started}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Precompute edge-artifact overlays for every pair of a manifest.")
+    parser.add_argument('--manifest', default=settings.EVALUATION_MANIFEST or None, required=not settings.EVALUATION_MANIFEST,
+                        help="CSV/JSONL evaluation manifest (default: EVALUATOR_MANIFEST)")
+    parser.add_argument('--cache-dir', default=settings.RENDITION_CACHE_DIR, help="output directory (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="processes (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    from manifest import open_manifest
+
+    started = time.perf_counter()
+    pairs = computed = failed = 0
+    compute_seconds = 0.0
+
+    def record(task: Tuple[str, str, str], future):
+        nonlocal computed, failed, compute_seconds
+        try:
+            result = future.result()
+        except Exception as error:
+            failed += 1
+            print(f"skipped {task[1]}: {type(error).__name__}: {error}", file=sys.stderr)
+            return
+        computed += result['computed']
+        compute_seconds += result['seconds']
+
+    # At most a few pairs per worker in flight, so memory does not grow with the manifest
+    window = args.workers * 8
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        in_flight = deque()
+        for row in open_manifest(args.manifest):
+            task = (row['original'], row['processed'], args.cache_dir)
+            in_flight.append((task, executor.submit(_precompute, task)))
+            pairs += 1
+            if len(in_flight) >= window:
+                record(*in_flight.popleft())
+        while in_flight:
+            record(*in_flight.popleft())
+    elapsed = time.perf_counter() - started
+    mean_ms = compute_seconds / computed * 1000 if computed else 0.0
+    print(f"{computed} overlays computed ({mean_ms:.0f}ms each), {pairs - computed - failed} up to date, "
+          f"{failed} failed in {elapsed:.2f}s", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
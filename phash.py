@@ -0,0 +1,402 @@
+"""Perceptual-hash index that groups near-duplicate evaluation pairs.
+
+Both images of a pair get a 64-bit DCT perceptual hash (pHash), so a pair is a
+128-bit fingerprint, and two pairs are near duplicates when the Hamming
+distance between their fingerprints is at most ``threshold``. Candidates come
+from multi-index hashing: the fingerprint is cut into ``threshold + 1`` chunks,
+and by the pigeonhole principle near duplicates share at least one chunk
+exactly, so only pairs colliding in a chunk are compared. Matches are merged
+into clusters whose representative is the first evaluation in the manifest.
+
+Hashes are kept in SQLite by path, size and mtime, so rebuilding after new
+rows arrive only hashes the new images.
+
+    python phash.py --manifest evaluations.csv --index duplicates.db --workers 8
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+DEFAULT_THRESHOLD = 7
+# Larger chunk buckets are only compared within a sliding window of their sorted fingerprints
+MAX_BUCKET = 2048
+BUCKET_WINDOW = 64
+PAIR_BATCH = 4_000_000
+STAT_BATCH = 10_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    phash INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS clusters (
+    position INTEGER PRIMARY KEY,
+    eval_id INTEGER NOT NULL,
+    representative INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def phash(image: Image.Image) -> int:
+    """64-bit pHash: signs of the low-frequency DCT coefficients against their median."""
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        # Transparent areas hash as white rather than whatever colour they hide
+        rgba = image.convert('RGBA')
+        image = Image.alpha_composite(Image.new('RGBA', rgba.size, (255, 255, 255, 255)), rgba)
+    else:
+        image.draft('L', (DCT_SIZE * 4, DCT_SIZE * 4))
+    pixels = np.asarray(image.convert('L').resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    coefficients = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only reflects brightness
+    bits = coefficients > np.median(coefficients[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hash_file(path: str) -> int:
+    with Image.open(path) as image:
+        return phash(image)
+
+
+def _hash_entry(entry: Tuple[str, int, int]) -> Tuple[str, int, int, Optional[int]]:
+    path, size, mtime_ns = entry
+    try:
+        return path, size, mtime_ns, hash_file(path)
+    except Exception:
+        return path, size, mtime_ns, None
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _POPCOUNT[values.astype(np.uint64).view(np.uint8).reshape(-1, 8)].sum(axis=1, dtype=np.int64)
+
+
+def _chunk(high: np.ndarray, low: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """Bits ``start:stop`` of the 128-bit values ``high << 64 | low``."""
+    width = stop - start
+    mask = np.uint64((1 << width) - 1) if width < 64 else np.uint64(0xFFFFFFFFFFFFFFFF)
+    if stop <= 64:
+        return (low >> np.uint64(start)) & mask
+    if start >= 64:
+        return (high >> np.uint64(start - 64)) & mask
+    low_part = low >> np.uint64(start)
+    high_part = (high & np.uint64((1 << (stop - 64)) - 1)) << np.uint64(64 - start)
+    return low_part | high_part
+
+
+def _bucket_pairs(keys: np.ndarray, high: np.ndarray, low: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Index pairs sharing a key, in batches of at most ``PAIR_BATCH`` pairs."""
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+    starts = np.concatenate(([0], boundaries))
+    sizes = np.diff(np.concatenate((starts, [len(keys)])))
+    shared = sizes > 1
+    small = shared & (sizes <= MAX_BUCKET)
+
+    # All pairs within small buckets: element i pairs with the rest of its bucket after it
+    run_starts, run_sizes = starts[small], sizes[small]
+    pair_totals = np.cumsum(run_sizes * (run_sizes - 1) // 2)
+    cuts = np.searchsorted(pair_totals, np.arange(PAIR_BATCH, pair_totals[-1] if len(pair_totals) else 0, PAIR_BATCH))
+    for first, last in zip(np.concatenate(([0], cuts)), np.concatenate((cuts, [len(run_starts)]))):
+        batch_starts, batch_sizes = run_starts[first:last], run_sizes[first:last]
+        members = np.repeat(batch_starts, batch_sizes) + _ranges(batch_sizes)
+        later = np.repeat(batch_starts + batch_sizes, batch_sizes) - members - 1
+        left = np.repeat(members, later)
+        right = left + 1 + _ranges(later)
+        yield order[left], order[right]
+
+    # Oversized buckets (e.g. blank images): neighbours in full-fingerprint order only
+    for start, size in zip(starts[shared & ~small], sizes[shared & ~small]):
+        members = order[start:start + size]
+        members = members[np.lexsort((low[members], high[members]))]
+        for offset in range(1, min(BUCKET_WINDOW, size - 1) + 1):
+            yield members[:-offset], members[offset:]
+
+
+def _ranges(sizes: np.ndarray) -> np.ndarray:
+    """Concatenation of ``arange(size)`` for every size."""
+    total = int(sizes.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return np.arange(total, dtype=np.int64) - offsets
+
+
+def _components(count: int, left: List[np.ndarray], right: List[np.ndarray]) -> np.ndarray:
+    """Smallest member index of each element's connected component."""
+    labels = np.arange(count, dtype=np.int64)
+    if not left:
+        return labels
+    left, right = np.concatenate(left), np.concatenate(right)
+    while True:
+        smallest = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, smallest)
+        np.minimum.at(updated, right, smallest)
+        # Pointer jumping until every label points at a root
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def cluster(original_hashes: np.ndarray, processed_hashes: np.ndarray, threshold: int = DEFAULT_THRESHOLD) -> np.ndarray:
+    """Representative (first) index of each pair's near-duplicate cluster.
+
+    ``original_hashes`` and ``processed_hashes`` are aligned ``uint64`` arrays.
+    """
+    high = original_hashes.astype(np.uint64)
+    low = processed_hashes.astype(np.uint64)
+    # Exact duplicates collapse first, so large groups of identical pairs cost nothing
+    order = np.lexsort((low, high))
+    distinct = np.ones(len(order), dtype=bool)
+    distinct[1:] = (np.diff(high[order]) != 0) | (np.diff(low[order]) != 0)
+    group = np.cumsum(distinct) - 1
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = group
+    first_index = np.full(int(distinct.sum()), len(order), dtype=np.int64)
+    np.minimum.at(first_index, group, order)
+    unique_high, unique_low = high[order[distinct]], low[order[distinct]]
+
+    chunks = threshold + 1
+    bounds = [round(128 * j / chunks) for j in range(chunks + 1)]
+    left, right = [], []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        keys = _chunk(unique_high, unique_low, start, stop)
+        for a, b in _bucket_pairs(keys, unique_high, unique_low):
+            distance = popcount(unique_high[a] ^ unique_high[b]) + popcount(unique_low[a] ^ unique_low[b])
+            close = distance <= threshold
+            left.append(a[close])
+            right.append(b[close])
+    labels = _components(len(unique_high), left, right)
+
+    # Representative = smallest original index in the cluster
+    representative = np.full(len(unique_high), len(high), dtype=np.int64)
+    np.minimum.at(representative, labels, first_index)
+    return representative[labels[inverse]]
+
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def update_hashes(conn: sqlite3.Connection, paths: Iterable[str], executor: ProcessPoolExecutor) -> Tuple[Dict[str, int], int]:
+    """Hash every path not already in the index under its current size and mtime.
+
+    Returns the hash of every readable path and how many had to be computed.
+    """
+    hashes: Dict[str, int] = {}
+    computed = 0
+    batch: List[str] = []
+
+    def flush():
+        nonlocal computed
+        stats = {path: _stat(path) for path in batch}
+        known = {}
+        for first in range(0, len(batch), 500):
+            chunk = batch[first:first + 500]
+            rows = conn.execute(
+                f"SELECT path, size, mtime_ns, phash FROM hashes WHERE path IN ({','.join('?' * len(chunk))})", chunk
+            )
+            known.update((path, (size, mtime_ns, value)) for path, size, mtime_ns, value in rows)
+        missing = []
+        for path, stat in stats.items():
+            if stat is None:
+                continue
+            cached = known.get(path)
+            if cached is not None and cached[:2] == stat:
+                hashes[path] = cached[2] & 0xFFFFFFFFFFFFFFFF
+            else:
+                missing.append((path, *stat))
+        for path, size, mtime_ns, value in executor.map(_hash_entry, missing, chunksize=64):
+            if value is None:
+                continue
+            conn.execute("INSERT OR REPLACE INTO hashes (path, size, mtime_ns, phash) VALUES (?, ?, ?, ?)",
+                         (path, size, mtime_ns, _to_signed(value)))
+            hashes[path] = value
+            computed += 1
+        conn.commit()
+        batch.clear()
+
+    for path in paths:
+        if path not in hashes:
+            batch.append(path)
+        if len(batch) >= STAT_BATCH:
+            flush()
+    if batch:
+        flush()
+    return hashes, computed
+
+
+def build_index(manifest_path: str, index_path: str, workers: int, threshold: int = DEFAULT_THRESHOLD) -> Dict[str, Any]:
+    from manifest import open_manifest
+
+    manifest = open_manifest(manifest_path)
+    conn = sqlite3.connect(index_path)
+    conn.executescript(SCHEMA)
+    # Manifest paths are already absolute
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        hashes, computed = update_hashes(
+            conn, (row[field] for row in manifest for field in ('original', 'processed')), executor
+        )
+
+    count = len(manifest)
+    eval_ids = np.zeros(count, dtype=np.int64)
+    original = np.zeros(count, dtype=np.uint64)
+    processed = np.zeros(count, dtype=np.uint64)
+    hashed = np.zeros(count, dtype=bool)
+    for position, row in enumerate(manifest):
+        eval_ids[position] = row['id']
+        pair = hashes.get(row['original']), hashes.get(row['processed'])
+        if None not in pair:
+            original[position], processed[position] = pair
+            hashed[position] = True
+
+    representative = np.arange(count, dtype=np.int64)
+    positions = np.flatnonzero(hashed)
+    representative[positions] = positions[cluster(original[positions], processed[positions], threshold)]
+    duplicates = np.flatnonzero(representative != np.arange(count))
+    # Only clustered rows are stored; everything else represents itself
+    clustered = np.union1d(duplicates, representative[duplicates])
+    stat = os.stat(manifest.path)
+    with conn:
+        conn.execute("DELETE FROM clusters")
+        conn.executemany(
+            "INSERT INTO clusters (position, eval_id, representative) VALUES (?, ?, ?)",
+            zip(clustered.tolist(), eval_ids[clustered].tolist(), representative[clustered].tolist())
+        )
+        conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+            ('manifest', manifest.path), ('size', stat.st_size), ('mtime_ns', stat.st_mtime_ns),
+            ('rows', count), ('threshold', threshold),
+        ])
+    conn.close()
+    return {
+        'rows': count,
+        'hashed': int(hashed.sum()),
+        'computed': computed,
+        'clusters': int(len(np.unique(representative[clustered]))),
+        'duplicates': int(len(duplicates)),
+    }
+
+
+class DuplicateIndex:
+    """Near-duplicate clusters by manifest position, as written by ``build_index``."""
+
+    def __init__(self, representative: np.ndarray):
+        self.representative = representative
+        self.representatives = np.flatnonzero(representative == np.arange(len(representative)))
+        self._order = np.argsort(representative, kind='stable')
+        self._sorted = representative[self._order]
+
+    @property
+    def duplicate_count(self) -> int:
+        return len(self.representative) - len(self.representatives)
+
+    def is_representative(self, position: int) -> bool:
+        return self.representative[position] == position
+
+    def members(self, position: int) -> np.ndarray:
+        """Other positions represented by ``position``; empty for duplicates and singletons."""
+        start, stop = np.searchsorted(self._sorted, [position, position + 1])
+        members = self._order[start:stop]
+        return members[members != position]
+
+    def subset(self, positions: np.ndarray) -> 'DuplicateIndex':
+        """Clusters among ``positions`` only, renumbered from 0.
+
+        A cluster whose representative is not kept is represented by its first
+        kept member.
+        """
+        _, first, inverse = np.unique(self.representative[positions], return_index=True, return_inverse=True)
+        return DuplicateIndex(first[inverse])
+
+    def next_representative(self, start: int) -> Optional[int]:
+        """First representative at or after ``start``."""
+        slot = int(np.searchsorted(self.representatives, start))
+        return int(self.representatives[slot]) if slot < len(self.representatives) else None
+
+
+def load_duplicate_index(index_path: str, manifest) -> Optional[DuplicateIndex]:
+    """Index for ``manifest``, or None when the file is missing or was built for another version of it."""
+    if not os.path.exists(index_path) or not hasattr(manifest, 'path'):
+        return None
+    conn = sqlite3.connect(index_path)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        stat = os.stat(manifest.path)
+        if (meta.get('manifest'), meta.get('size'), meta.get('mtime_ns'), meta.get('rows')) != \
+                (manifest.path, stat.st_size, stat.st_mtime_ns, len(manifest)):
+            return None
+        rows = np.array(conn.execute("SELECT position, representative FROM clusters").fetchall(), dtype=np.int64)
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+    representative = np.arange(len(manifest), dtype=np.int64)
+    if len(rows):
+        representative[rows[:, 0]] = rows[:, 1]
+    return DuplicateIndex(representative)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import settings
+
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate evaluation pairs by perceptual hash.")
+    parser.add_argument('--manifest', required=True, help="CSV/JSONL evaluation manifest")
+    parser.add_argument('--index', default=settings.DUPLICATE_INDEX_PATH or 'duplicates.db',
+                        help="SQLite index to create or update (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threshold', type=int, default=DEFAULT_THRESHOLD,
+                        help="max Hamming distance between 128-bit pair hashes (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    result = build_index(args.manifest, args.index, args.workers, args.threshold)
+    elapsed = time.perf_counter() - started
+    print(f"{result['rows']} pairs ({result['hashed']} hashed, {result['computed']} new image hashes): "
+          f"{result['duplicates']} near duplicates in {result['clusters']} clusters, {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Background warming of the image cache for upcoming evaluations.
+
+A single thread pool is shared by every session. Each session keeps at most
+one window of outstanding loads: scheduling a new window cancels queued loads
+that fell out of it, and ``cancel`` drops everything for the session (Reset).
+A session is forgotten as soon as all its loads are done, so abandoned
+sessions do not accumulate.
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import settings
+from image_cache import ImageCache, get_image_cache
+from transcode import get_rendition_index
+
+# (path, width) pairs as passed to ImageCache.get
+PrefetchTask = Tuple[str, int]
+
+
+class Prefetcher:
+    def __init__(self, cache: ImageCache, max_workers: int):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-prefetch')
+        self._pending: Dict[str, Dict[PrefetchTask, Future]] = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.cancelled = 0
+
+    def _load(self, task: PrefetchTask):
+        path, width = task
+        try:
+            self.cache.get(path, width=width)
+        except OSError:
+            # Missing or unreadable assets are reported when actually displayed
+            pass
+
+    def _prune(self):
+        # Called with the lock held
+        for session_id in list(self._pending):
+            pending = self._pending[session_id]
+            for task in [task for task, future in pending.items() if future.done()]:
+                del pending[task]
+            if not pending:
+                del self._pending[session_id]
+
+    def warm(self, session_id: str, tasks: Iterable[PrefetchTask]):
+        """Make ``tasks`` the session's prefetch window, cancelling stale loads."""
+        wanted = [task for task in dict.fromkeys(tasks) if not self.cache.contains(task[0], width=task[1])]
+        with self._lock:
+            self._prune()
+            pending = self._pending.get(session_id, {})
+            for task in list(pending):
+                future = pending[task]
+                if task not in wanted:
+                    if future.cancel():
+                        self.cancelled += 1
+                    del pending[task]
+            for task in wanted:
+                if task not in pending:
+                    pending[task] = self._executor.submit(self._load, task)
+                    self.submitted += 1
+            if pending:
+                self._pending[session_id] = pending
+            else:
+                self._pending.pop(session_id, None)
+
+    def cancel(self, session_id: str):
+        with self._lock:
+            pending = self._pending.pop(session_id, {})
+            for future in pending.values():
+                if future.cancel():
+                    self.cancelled += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._prune()
+            outstanding = sum(len(pending) for pending in self._pending.values())
+            sessions = len(self._pending)
+        return {'submitted': self.submitted, 'cancelled': self.cancelled, 'outstanding': outstanding,
+                'sessions': sessions}
+
+
+def upcoming_tasks(evaluations, current_index: int, depth: int) -> List[PrefetchTask]:
+    """Thumbnail loads for the ``depth`` evaluations after ``current_index``.
+
+    Images with a pre-encoded WebP rendition are left out, since the view
+    sends the rendition and never decodes them.
+    """
+    renditions = get_rendition_index()
+    tasks = []
+    for evaluation in evaluations[current_index + 1:current_index + 1 + depth]:
+        for kind in ('original', 'processed'):
+            if renditions.lookup(evaluation[kind], 'view', composite=kind == 'processed') is None:
+                tasks.append((evaluation[kind], settings.THUMBNAIL_WIDTH))
+    return tasks
+
+
+_prefetcher: Optional[Prefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> Prefetcher:
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = Prefetcher(get_image_cache(), settings.PREFETCH_WORKERS)
+    return _prefetcher
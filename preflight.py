@@ -0,0 +1,326 @@
+"""Preflight check of every image an evaluation set references.
+
+``python preflight.py --manifest evaluations.csv`` stats every ``original`` and
+``processed`` path once, on a thread pool. It reads each image header
+(dimensions, mode, alpha) without decoding pixels, hashes the content, and
+records the results in a SQLite sidecar next to the manifest. Pairs with a
+missing or unreadable image are listed as excluded. Assets whose size and
+mtime are unchanged are not re-hashed on the next run, so re-running after the
+manifest grows is cheap.
+
+At startup the app loads the sidecar and drops excluded pairs from the
+evaluation set before the first rerun. While reviewing, the image cache,
+rendition lookups and content-hash caches take file sizes, mtimes and digests
+from the index. Each file is re-checked with one ``stat`` at most every
+``RECHECK_SECONDS``, and a file replaced since the preflight run is treated as
+absent from the index, so its content is hashed and decoded afresh.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import settings
+
+CHUNK_ROWS = 10_000
+# How long a file's recorded size and mtime are trusted before it is stat-ed again
+RECHECK_SECONDS = 60.0
+CHECKED_PATHS = 100_000
+ALPHA_MODES = ('RGBA', 'LA', 'PA', 'RGBa', 'La')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    width INTEGER,
+    height INTEGER,
+    mode TEXT,
+    format TEXT,
+    has_alpha INTEGER,
+    digest TEXT,
+    error TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS excluded (
+    position INTEGER PRIMARY KEY,
+    eval_id INTEGER,
+    reason TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID;
+"""
+
+# (path, size, mtime_ns, width, height, mode, format, has_alpha, digest, error)
+AssetRow = Tuple[str, Optional[int], Optional[int], Optional[int], Optional[int], Optional[str], Optional[str],
+                 Optional[int], Optional[str], Optional[str]]
+
+
+def preflight_path(manifest_path: str = '') -> str:
+    """Sidecar for ``manifest_path``, or for the built-in demo set when it is empty."""
+    if settings.PREFLIGHT_INDEX_PATH:
+        return settings.PREFLIGHT_INDEX_PATH
+    return f"{os.path.abspath(manifest_path)}.preflight.db" if manifest_path else '.preflight.db'
+
+
+def probe(path: str, previous: Optional[AssetRow] = None) -> AssetRow:
+    """Stat, header and hash of one image; reuses ``previous`` when size and mtime are unchanged."""
+    from transcode import file_digest
+
+    try:
+        stat = os.stat(path)
+    except OSError as error:
+        return (path, None, None, None, None, None, None, None, None, f"missing: {error.strerror}")
+    if previous is not None and previous[1:3] == (stat.st_size, stat.st_mtime_ns) and previous[9] is None:
+        return previous
+    try:
+        # Opening only parses the header; pixels are never decoded here
+        with Image.open(path) as image:
+            width, height = image.size
+            has_alpha = image.mode in ALPHA_MODES or 'transparency' in image.info
+            mode, image_format = image.mode, image.format
+        digest = file_digest(path)
+    except (OSError, SyntaxError, ValueError) as error:
+        return (path, stat.st_size, stat.st_mtime_ns, None, None, None, None, None, None, f"unreadable: {error}")
+    return (path, stat.st_size, stat.st_mtime_ns, width, height, mode, image_format, int(has_alpha), digest, None)
+
+
+def connect(index_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(index_path, timeout=30, check_same_thread=False)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _previous(conn: sqlite3.Connection, paths: List[str]) -> Dict[str, AssetRow]:
+    rows = {}
+    for start in range(0, len(paths), 500):
+        batch = paths[start:start + 500]
+        placeholders = ','.join('?' * len(batch))
+        for row in conn.execute(f"SELECT * FROM assets WHERE path IN ({placeholders})", batch):
+            rows[row[0]] = row
+    return rows
+
+
+def build_index(evaluations: Sequence, index_path: str, workers: int = 16,
+                fingerprint: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Probe every asset of ``evaluations`` and record the pairs to exclude, chunk by chunk."""
+    conn = connect(index_path)
+    probed = reused = excluded = 0
+    with conn:
+        conn.execute("DELETE FROM excluded")
+        conn.execute("DELETE FROM meta")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preflight') as executor:
+        for start in range(0, len(evaluations), CHUNK_ROWS):
+            rows = evaluations[start:start + CHUNK_ROWS]
+            pairs = [(os.path.abspath(row['original']), os.path.abspath(row['processed'])) for row in rows]
+            paths = list(dict.fromkeys(path for pair in pairs for path in pair))
+            previous = _previous(conn, paths)
+            assets = {row[0]: row for row in executor.map(lambda path: probe(path, previous.get(path)), paths)}
+            reused += sum(1 for path in paths if assets[path] is previous.get(path))
+            probed += len(paths)
+            exclusions = []
+            for offset, (row, pair) in enumerate(zip(rows, pairs)):
+                errors = [f"{kind} {assets[path][9]}" for kind, path in zip(('original', 'processed'), pair)
+                          if assets[path][9] is not None]
+                if errors:
+                    exclusions.append((start + offset, row['id'], '; '.join(errors)))
+            excluded += len(exclusions)
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [asset for path, asset in assets.items() if asset is not previous.get(path)])
+                conn.executemany("INSERT INTO excluded VALUES (?, ?, ?)", exclusions)
+    # Written last, so an interrupted build is never loaded as complete
+    with conn:
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         list(dict(fingerprint or {}, rows=len(evaluations), built=time.time()).items()))
+    conn.close()
+    return {'rows': len(evaluations), 'assets': probed, 'reused': reused, 'excluded': excluded}
+
+
+def manifest_fingerprint(manifest) -> Dict[str, Any]:
+    stat = os.stat(manifest.path)
+    return {'manifest': manifest.path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class AssetIndex:
+    """Read side of a preflight sidecar, shared by every session."""
+
+    def __init__(self, conn: sqlite3.Connection, rows: int):
+        self._conn = conn
+        self._lock = threading.Lock()
+        self.rows = rows
+        self.exclusions: List[Tuple[int, int, str]] = conn.execute(
+            "SELECT position, eval_id, reason FROM excluded ORDER BY position"
+        ).fetchall()
+        # path -> (file unchanged since the preflight run, when that was checked)
+        self._checked: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+
+    def kept_positions(self) -> np.ndarray:
+        positions = np.array([position for position, _, _ in self.exclusions], dtype=np.int64)
+        return np.delete(np.arange(self.rows, dtype=np.int64), positions)
+
+    def _unchanged(self, path: str, size: int, mtime_ns: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(path)
+            if checked is not None and now - checked[1] < RECHECK_SECONDS:
+                self._checked.move_to_end(path)
+                return checked[0]
+        try:
+            stat = os.stat(path)
+            unchanged = (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns)
+        except OSError:
+            unchanged = False
+        with self._lock:
+            self._checked[path] = (unchanged, now)
+            self._checked.move_to_end(path)
+            while len(self._checked) > CHECKED_PATHS:
+                self._checked.popitem(last=False)
+        return unchanged
+
+    def _asset(self, path: str, columns: str):
+        """The ``columns`` recorded for ``path``, or None when it was not checked or has changed since."""
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT size, mtime_ns, {columns} FROM assets WHERE path = ? AND error IS NULL", (path,)
+            ).fetchone()
+        if row is None or not self._unchanged(path, row[0], row[1]):
+            return None
+        return row[2:]
+
+    def stat(self, path: str) -> Optional[Tuple[int, int]]:
+        """(size, mtime_ns) recorded for ``path``, or None when it was not checked or has changed."""
+        return self._asset(path, 'size, mtime_ns')
+
+    def digest(self, path: str) -> Optional[str]:
+        row = self._asset(path, 'digest')
+        return row[0] if row else None
+
+    def header(self, path: str) -> Optional[Dict[str, Any]]:
+        row = self._asset(path, 'width, height, mode, format, has_alpha')
+        if row is None:
+            return None
+        return dict(zip(('width', 'height', 'mode', 'format', 'has_alpha'), row[:4] + (bool(row[4]),)))
+
+
+def load_asset_index(index_path: str, evaluations: Sequence,
+                     fingerprint: Optional[Dict[str, Any]] = None) -> Optional[AssetIndex]:
+    """Index for ``evaluations``, or None when missing, incomplete or built for another version of them."""
+    if not os.path.exists(index_path):
+        return None
+    conn = sqlite3.connect(index_path, check_same_thread=False)
+    try:
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        expected = dict(fingerprint or {}, rows=len(evaluations))
+        if any(meta.get(key) != value for key, value in expected.items()):
+            conn.close()
+            return None
+        return AssetIndex(conn, len(evaluations))
+    except sqlite3.Error:
+        conn.close()
+        return None
+
+
+class EvaluationSubset(Sequence):
+    """The evaluations at ``positions`` of a manifest, renumbered from 0."""
+
+    def __init__(self, evaluations: Sequence, positions: np.ndarray):
+        self.evaluations = evaluations
+        self.positions = positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.evaluations[position] for position in self.positions[index].tolist()]
+        return self.evaluations[int(self.positions[index])]
+
+    def position_of(self, eval_id: int) -> int:
+        position = self.evaluations.position_of(eval_id)
+        slot = int(np.searchsorted(self.positions, position))
+        if slot == len(self.positions) or self.positions[slot] != position:
+            raise KeyError(eval_id)
+        return slot
+
+    def ids(self) -> np.ndarray:
+        return self.evaluations.ids()[self.positions]
+
+    def codes(self, name: str, key) -> Tuple[List[str], np.ndarray]:
+        names, codes = self.evaluations.codes(name, key)
+        return names, codes[self.positions]
+
+
+def subset(evaluations: Sequence, positions: np.ndarray) -> Sequence:
+    if len(positions) == len(evaluations):
+        return evaluations
+    if hasattr(evaluations, 'position_of'):
+        return EvaluationSubset(evaluations, positions)
+    return [evaluations[position] for position in positions.tolist()]
+
+
+_index: Optional[AssetIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def install_asset_index(index: Optional[AssetIndex]):
+    """Make ``index`` the one image loading consults; the app calls this once at startup."""
+    global _index, _index_loaded
+    with _index_lock:
+        _index, _index_loaded = index, True
+
+
+def get_asset_index() -> Optional[AssetIndex]:
+    return _index if _index_loaded else None
+
+
+def known_stat(path: str) -> Tuple[int, int]:
+    """(size, mtime_ns) of ``path``, from the preflight index when it has the file."""
+    index = get_asset_index()
+    recorded = index.stat(path) if index is not None else None
+    if recorded is not None:
+        return recorded
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check every image of an evaluation manifest before serving it.")
+    parser.add_argument('--manifest', required=True, help="CSV/JSONL evaluation manifest")
+    parser.add_argument('--index', help="SQLite sidecar to write (default: EVALUATOR_PREFLIGHT_INDEX or <manifest>.preflight.db)")
+    parser.add_argument('--workers', type=int, default=16, help="probing threads (default: %(default)s)")
+    parser.add_argument('--show', type=int, default=20, help="excluded pairs to list (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    from manifest import open_manifest
+    from sampling import category_codes
+
+    manifest = open_manifest(args.manifest)
+    index_path = args.index or preflight_path(args.manifest)
+    started = time.perf_counter()
+    summary = build_index(manifest, index_path, args.workers, manifest_fingerprint(manifest))
+    # The id and category sidecars the app aggregates dashboards with, so its first Submit does not build them
+    manifest.ids()
+    category_codes(manifest)
+    elapsed = time.perf_counter() - started
+    index = load_asset_index(index_path, manifest, manifest_fingerprint(manifest))
+    for position, eval_id, reason in index.exclusions[:args.show]:
+        print(f"excluded {eval_id} (row {position}): {reason}", file=sys.stderr)
+    rate = summary['assets'] / elapsed if elapsed > 0 else 0.0
+    print(f"checked {summary['assets']} assets ({summary['reused']} unchanged) for {summary['rows']} pairs "
+          f"in {elapsed:.2f}s: {rate:.0f} assets/sec; {summary['excluded']} pairs excluded, index {index_path}",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
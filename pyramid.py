@@ -0,0 +1,167 @@
+"""Deep-zoom style image pyramids for the magnified view.
+
+Level 0 is the full-resolution image and every following level halves both
+sides, down to a single tile. Tiles are cut lazily the first time they are
+needed and written to a disk cache keyed by path, mtime and size, so a large
+product shot is decoded once per server rather than once per inspection. The
+viewer only asks for the tiles that cover its viewport at the current zoom.
+"""
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+import settings
+
+TILE_SIZE = 256
+
+
+class ImagePyramid:
+    def __init__(self, path: str, cache_dir: str):
+        self.path = os.path.abspath(path)
+        stat = os.stat(self.path)
+        with Image.open(self.path) as img:
+            self.width, self.height = img.size
+            self.has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        key = hashlib.sha1(f"{self.path}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+        self.tile_dir = os.path.join(cache_dir, key[:2], key)
+        self.levels = max(1, math.ceil(math.log2(max(self.width, self.height) / TILE_SIZE)) + 1)
+        self._tile_format = 'PNG' if self.has_alpha else 'JPEG'
+
+    def level_size(self, level: int) -> Tuple[int, int]:
+        scale = 2 ** level
+        return max(1, math.ceil(self.width / scale)), max(1, math.ceil(self.height / scale))
+
+    def tile_grid(self, level: int) -> Tuple[int, int]:
+        width, height = self.level_size(level)
+        return math.ceil(width / TILE_SIZE), math.ceil(height / TILE_SIZE)
+
+    def _tile_path(self, level: int, col: int, row: int) -> str:
+        extension = 'png' if self._tile_format == 'PNG' else 'jpg'
+        return os.path.join(self.tile_dir, str(level), f"{col}_{row}.{extension}")
+
+    def tile(self, level: int, col: int, row: int) -> np.ndarray:
+        """RGBA pixels of one tile, cut and cached on first use."""
+        tile_path = self._tile_path(level, col, row)
+        try:
+            with Image.open(tile_path) as cached:
+                return np.asarray(cached.convert('RGBA'))
+        except OSError:
+            pass
+
+        level_image = _level_image(self, level)
+        box = (col * TILE_SIZE, row * TILE_SIZE,
+               min((col + 1) * TILE_SIZE, level_image.width), min((row + 1) * TILE_SIZE, level_image.height))
+        tile = level_image.crop(box)
+        os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+        tmp_path = f"{tile_path}.{threading.get_ident()}.tmp"
+        if self._tile_format == 'PNG':
+            tile.save(tmp_path, format='PNG', compress_level=1)
+        else:
+            tile.convert('RGB').save(tmp_path, format='JPEG', quality=90)
+        os.replace(tmp_path, tile_path)
+        return np.asarray(tile.convert('RGBA'))
+
+    def level_for_zoom(self, zoom: float) -> int:
+        """Finest level that is still at least as detailed as ``zoom`` (1.0 = full resolution)."""
+        if zoom >= 1:
+            return 0
+        return min(self.levels - 1, int(math.floor(math.log2(1 / zoom))))
+
+    def viewport(self, zoom: float, center_x: float, center_y: float, width: int, height: int) -> np.ndarray:
+        """Render a ``width`` x ``height`` view at ``zoom`` centred on a fractional position.
+
+        Only the tiles overlapping the view are read. The view is clamped to
+        the image, so near the borders the centre shifts rather than showing
+        empty space.
+        """
+        level = self.level_for_zoom(zoom)
+        level_width, level_height = self.level_size(level)
+        # Size of the viewport measured in level pixels
+        scale = zoom * (2 ** level)
+        span_x = min(level_width, width / scale)
+        span_y = min(level_height, height / scale)
+        left = min(max(0.0, center_x * level_width - span_x / 2), level_width - span_x)
+        top = min(max(0.0, center_y * level_height - span_y / 2), level_height - span_y)
+        right, bottom = left + span_x, top + span_y
+
+        first_col, last_col = int(left // TILE_SIZE), int(math.ceil(right / TILE_SIZE)) - 1
+        first_row, last_row = int(top // TILE_SIZE), int(math.ceil(bottom / TILE_SIZE)) - 1
+        mosaic = np.zeros(((last_row - first_row + 1) * TILE_SIZE, (last_col - first_col + 1) * TILE_SIZE, 4), dtype=np.uint8)
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                pixels = self.tile(level, col, row)
+                y, x = (row - first_row) * TILE_SIZE, (col - first_col) * TILE_SIZE
+                mosaic[y:y + pixels.shape[0], x:x + pixels.shape[1]] = pixels
+
+        offset_x, offset_y = left - first_col * TILE_SIZE, top - first_row * TILE_SIZE
+        crop = Image.fromarray(mosaic).crop((
+            int(offset_x), int(offset_y),
+            int(math.ceil(offset_x + span_x)), int(math.ceil(offset_y + span_y))
+        ))
+        output_size = (max(1, round(crop.width * scale)), max(1, round(crop.height * scale)))
+        if crop.size != output_size:
+            resample = Image.NEAREST if scale >= 2 else Image.LANCZOS
+            crop = crop.resize(output_size, resample)
+        return np.asarray(crop)
+
+
+# Decoded pyramid levels kept in memory to cut missing tiles from
+_levels: "OrderedDict[Tuple[str, int], Image.Image]" = OrderedDict()
+_levels_bytes = 0
+_levels_lock = threading.Lock()
+
+
+def _image_bytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def _level_image(pyramid: ImagePyramid, level: int) -> Image.Image:
+    global _levels_bytes
+    key = (pyramid.tile_dir, level)
+    with _levels_lock:
+        image = _levels.get(key)
+        if image is not None:
+            _levels.move_to_end(key)
+            return image
+    if level == 0:
+        with Image.open(pyramid.path) as source:
+            image = source.convert('RGBA' if pyramid.has_alpha else 'RGB')
+    else:
+        # Halve the next finer level, which is usually still cached
+        finer = _level_image(pyramid, level - 1)
+        image = finer.resize(pyramid.level_size(level), Image.BOX)
+    with _levels_lock:
+        if key not in _levels:
+            _levels[key] = image
+            _levels_bytes += _image_bytes(image)
+        while _levels_bytes > settings.TILE_LEVEL_CACHE_BYTES and len(_levels) > 1:
+            _, evicted = _levels.popitem(last=False)
+            _levels_bytes -= _image_bytes(evicted)
+    return image
+
+
+# Least recently viewed last out; a pyramid is only its size and tile directory
+_pyramids: "OrderedDict[Tuple[str, int], ImagePyramid]" = OrderedDict()
+_pyramids_lock = threading.Lock()
+
+
+def get_pyramid(path: str) -> ImagePyramid:
+    path = os.path.abspath(path)
+    key = (path, os.stat(path).st_mtime_ns)
+    with _pyramids_lock:
+        pyramid = _pyramids.get(key)
+        if pyramid is not None:
+            _pyramids.move_to_end(key)
+            return pyramid
+    pyramid = ImagePyramid(path, settings.TILE_CACHE_DIR)
+    with _pyramids_lock:
+        _pyramids[key] = pyramid
+        while len(_pyramids) > settings.PYRAMID_CACHE_ENTRIES:
+            _pyramids.popitem(last=False)
+    return pyramid
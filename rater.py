@@ -0,0 +1,380 @@
+"""Pluggable AI raters behind an asyncio client with batching and a result cache.
+
+A ``Rater`` turns batches of Before/After pairs into rubric ratings.
+``LocalRater`` runs the built-in scorer in a process pool. ``HttpRater`` posts
+batches to a scoring service. ``RaterClient`` sits in front of either one:
+
+- single requests are grouped into batches of up to ``batch_size``, waiting at
+  most ``max_delay`` seconds for a batch to fill;
+- at most ``concurrency`` batches are in flight, each bounded by ``timeout``;
+- results are cached in SQLite by the SHA-256 of both images and the rater
+  name, so re-running an evaluation never re-scores unchanged pairs, and
+  identical requests in flight share one call.
+
+The app and the batch tools share one client per process through
+``get_rater_client()``. Its event loop runs on a background thread, and
+``submit``/``rate_sync`` are called from ordinary threads.
+
+``python rater.py --serve`` starts a stub scoring service on localhost that
+answers with the built-in scorer, so the HTTP path can be exercised offline:
+
+    python rater.py --serve --port 8765 --latency 0.2
+    EVALUATOR_RATER_URL=http://127.0.0.1:8765/rate streamlit run app.py
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import base64
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import settings
+from preflight import get_asset_index
+from rubric import QUALITY_LABELS, quality_label
+from scorer import score_pair
+from transcode import file_digest
+
+# (original path, processed path)
+Pair = Tuple[str, str]
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    key TEXT PRIMARY KEY,
+    rater TEXT NOT NULL,
+    result TEXT NOT NULL,
+    created REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class RaterError(Exception):
+    """A pair could not be rated: the service failed, timed out or rejected it."""
+
+
+class Rater(ABC):
+    """Rates batches of pairs; results are scorer-style dicts with ``rating`` and ``quality``."""
+    # Part of the cache key, so changing model or service re-scores everything
+    name = 'rater'
+
+    @abstractmethod
+    async def rate_batch(self, pairs: List[Pair]) -> List[Union[Dict[str, Any], Exception]]:
+        """One result per pair, in order; a failed pair is returned as its exception."""
+
+    def close(self):
+        pass
+
+
+class LocalRater(Rater):
+    name = 'local-scorer'
+
+    def __init__(self, workers: int = os.cpu_count() or 1):
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    async def rate_batch(self, pairs: List[Pair]) -> List[Union[Dict[str, Any], Exception]]:
+        loop = asyncio.get_running_loop()
+        calls = [loop.run_in_executor(self._executor, score_pair, original, processed) for original, processed in pairs]
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+class HttpRater(Rater):
+    """Posts ``{"pairs": [{"original": <base64>, "processed": <base64>}, ...]}`` to ``url``.
+
+    The service answers ``{"results": [...]}`` in the same order, each either
+    a rating dict or ``{"error": "..."}``.
+    """
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url
+        self.name = f"http:{url}"
+        self.timeout = timeout
+
+    @staticmethod
+    def _encode(path: str) -> str:
+        with open(path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('ascii')
+
+    def _post(self, pairs: List[Pair]) -> List[Union[Dict[str, Any], Exception]]:
+        body = json.dumps({'pairs': [
+            {'original': self._encode(original), 'processed': self._encode(processed)} for original, processed in pairs
+        ]}).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            results = json.load(response)['results']
+        if len(results) != len(pairs):
+            raise RaterError(f"expected {len(pairs)} results, got {len(results)}")
+        return [RaterError(result['error']) if 'error' in result else result for result in results]
+
+    async def rate_batch(self, pairs: List[Pair]) -> List[Union[Dict[str, Any], Exception]]:
+        # urllib blocks, so requests run on the default thread pool
+        return await asyncio.to_thread(self._post, pairs)
+
+
+class RatingCache:
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(CACHE_SCHEMA)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM ratings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, rater: str, results: List[Tuple[str, Dict[str, Any]]]):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ratings (key, rater, result, created) VALUES (?, ?, ?, ?)",
+                [(key, rater, json.dumps(result), now) for key, result in results]
+            )
+
+
+def validate_result(result: Any) -> Dict[str, Any]:
+    """``result`` if it is a rating dict with a rubric rating; raises RaterError otherwise."""
+    if isinstance(result, Exception):
+        raise result if isinstance(result, RaterError) else RaterError(f"{type(result).__name__}: {result}")
+    if not isinstance(result, dict):
+        raise RaterError(f"malformed result: {result!r:.200}")
+    rating = result.get('rating')
+    if isinstance(rating, bool) or not isinstance(rating, int) or rating not in QUALITY_LABELS:
+        raise RaterError(f"malformed rating in result: {rating!r:.200}")
+    return result
+
+
+class RaterClient:
+    def __init__(self, rater: Rater, cache: Optional[RatingCache] = None, batch_size: int = 16,
+                 max_delay: float = 0.05, concurrency: int = 4, timeout: float = 30.0):
+        self.rater = rater
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache_hits = 0
+        self.batches = 0
+        self.rated = 0
+        self.failures = 0
+        self._pending: List[Tuple[str, Pair, asyncio.Future]] = []
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        # (path, size, mtime_ns) -> digest, so unchanged files are hashed once per process
+        self._digests: Dict[Tuple[str, int, int], str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    def _digest(self, path: str) -> str:
+        path = os.path.abspath(path)
+        index = get_asset_index()
+        digest = index.digest(path) if index is not None else None
+        if digest is not None:
+            return digest
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self._digests[key] = file_digest(path)
+        return digest
+
+    def cache_key(self, original: str, processed: str) -> str:
+        parts = (self.rater.name, self._digest(original), self._digest(processed))
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    async def rate(self, original: str, processed: str) -> Dict[str, Any]:
+        key = await asyncio.to_thread(self.cache_key, original, processed)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.get_running_loop().create_future()
+            self._pending.append((key, (original, processed), future))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        # Shielded so one cancelled caller does not cancel the result for the others
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, Pair, asyncio.Future]]):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            self.batches += 1
+            try:
+                results = await asyncio.wait_for(self.rater.rate_batch([pair for _, pair, _ in batch]), self.timeout)
+            except asyncio.TimeoutError:
+                results = [RaterError(f"timed out after {self.timeout}s")] * len(batch)
+            except Exception as error:
+                results = [RaterError(f"{type(error).__name__}: {error}")] * len(batch)
+        rated = []
+        try:
+            for (key, _, future), result in zip(batch, results):
+                self._inflight.pop(key, None)
+                try:
+                    result = validate_result(result)
+                except RaterError as error:
+                    self.failures += 1
+                    future.set_exception(error)
+                    continue
+                result = dict(result, quality=result.get('quality') or quality_label(result['rating']),
+                              rater=self.rater.name)
+                rated.append((key, result))
+                future.set_result(result)
+        finally:
+            # Whatever happened above, no caller is left waiting on this batch
+            for key, _, future in batch:
+                self._inflight.pop(key, None)
+                if not future.done():
+                    self.failures += 1
+                    future.set_exception(RaterError("the rater returned no result for this pair"))
+        self.rated += len(rated)
+        if self.cache is not None and rated:
+            await asyncio.to_thread(self.cache.put_many, self.rater.name, rated)
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._loop_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name='rater-client', daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, original: str, processed: str) -> Future:
+        """Rate from a thread without an event loop; the client's loop runs in the background."""
+        return asyncio.run_coroutine_threadsafe(self.rate(original, processed), self._background_loop())
+
+    def rate_sync(self, original: str, processed: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Rate from a thread, giving up with RaterError after ``timeout`` seconds.
+
+        The default allows the batch to wait for one full batch ahead of it
+        before its own call starts.
+        """
+        if timeout is None:
+            timeout = 2 * self.timeout + self.max_delay
+        future = self.submit(original, processed)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise RaterError(f"no rating within {timeout:g}s") from None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'cache_hits': self.cache_hits, 'rated': self.rated, 'batches': self.batches,
+                'failures': self.failures}
+
+
+def make_rater(target: str, timeout: float = 30.0, workers: Optional[int] = None) -> Rater:
+    """``local`` for the built-in scorer, otherwise the URL of a scoring service."""
+    if target == 'local':
+        return LocalRater(workers or os.cpu_count() or 1)
+    return HttpRater(target, timeout)
+
+
+def make_client(target: str, workers: Optional[int] = None) -> RaterClient:
+    cache = RatingCache(settings.RATER_CACHE_PATH) if settings.RATER_CACHE_PATH else None
+    return RaterClient(make_rater(target, settings.RATER_TIMEOUT, workers), cache, batch_size=settings.RATER_BATCH_SIZE,
+                       concurrency=settings.RATER_CONCURRENCY, timeout=settings.RATER_TIMEOUT)
+
+
+_client: Optional[RaterClient] = None
+_client_lock = threading.Lock()
+
+
+def get_rater_client() -> Optional[RaterClient]:
+    """Process-wide client for ``EVALUATOR_RATER_URL``, or None when no service is configured."""
+    global _client
+    if not settings.RATER_URL:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = make_client(settings.RATER_URL)
+    return _client
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Scores posted pairs with the built-in scorer, after an optional simulated latency."""
+    latency = 0.0
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            pairs = request['pairs']
+        except (ValueError, KeyError) as error:
+            self.send_error(400, f"bad request: {error}")
+            return
+        time.sleep(self.latency)
+        results = []
+        for pair in pairs:
+            try:
+                original = io.BytesIO(base64.b64decode(pair['original']))
+                processed = io.BytesIO(base64.b64decode(pair['processed']))
+                results.append(score_pair(original, processed))
+            except Exception as error:
+                results.append({'error': f"{type(error).__name__}: {error}"})
+        body = json.dumps({'results': results}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str, port: int, latency: float) -> ThreadingHTTPServer:
+    handler = type('Handler', (StubHandler,), {'latency': latency})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the stub scoring service used to test HTTP raters offline.")
+    parser.add_argument('--serve', action='store_true', required=True, help="start the stub service")
+    parser.add_argument('--host', default='127.0.0.1', help="address to bind (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=8765, help="port to bind (default: %(default)s)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every batch, to mimic a model")
+    args = parser.parse_args(argv)
+
+    server = serve(args.host, args.port, args.latency)
+    print(f"stub rater listening on http://{args.host}:{server.server_port}/rate", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
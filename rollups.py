@@ -0,0 +1,252 @@
+"""Materialized rollups of annotations by category, AI rating, model version and day.
+
+Every current annotation is counted in exactly one ``rollups`` row, keyed by
+the evaluation's category (the part of its description before `` - ``, or the
+whole description), its AI rating, the removal model version (the optional
+``model_version`` manifest column) and the UTC day the annotation last changed. A row holds counts,
+agreements and sums of the human-minus-AI rating delta. The annotation log
+writer keeps them current with ``apply_transition``, in the same transaction
+as the annotation change, the way ``aggregation`` keeps its totals. When the
+category rule changes, ``backfill_categories`` re-derives the categories of
+annotated evaluations and rebuilds the rollups once.
+
+Drill-down queries group and filter the rollups, whose size depends on the
+number of categories, versions and days rather than on the number of
+annotations, so they return in milliseconds over millions of annotations.
+
+    python rollups.py --by category ai_rating --where model_version=v2
+    python rollups.py --manifest evaluations.csv --rebuild
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+import settings
+from aggregation import NO_CONTRIBUTION, Contribution, contribution
+from sampling import CATEGORY_RULE, category_of
+
+UNKNOWN_MODEL = 'unknown'
+DIMENSIONS = ('category', 'ai_rating', 'model_version', 'day')
+MEASURES = ('annotations', 'agreements', 'rated', 'delta_sum', 'abs_delta_sum')
+
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dimensions (
+    eval_id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    model_version TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rollups (
+    category TEXT NOT NULL,
+    ai_rating INTEGER NOT NULL,
+    model_version TEXT NOT NULL,
+    day TEXT NOT NULL,
+    annotations INTEGER NOT NULL DEFAULT 0,
+    agreements INTEGER NOT NULL DEFAULT 0,
+    -- Annotations with a human rating, and the sums of their rating minus the AI rating
+    rated INTEGER NOT NULL DEFAULT 0,
+    delta_sum INTEGER NOT NULL DEFAULT 0,
+    abs_delta_sum INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (category, ai_rating, model_version, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rollups_by_day ON rollups (day);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID;
+"""
+
+
+def ensure_schema(conn: sqlite3.Connection) -> bool:
+    """Create the rollup tables; returns True when they did not exist yet."""
+    existed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollups'"
+    ).fetchone() is not None
+    conn.executescript(ROLLUP_SCHEMA)
+    if not existed:
+        mark_categories_current(conn)
+    return not existed
+
+
+def categories_current(conn: sqlite3.Connection) -> bool:
+    """Whether the stored categories were derived with the current ``category_of``."""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'category_rule'").fetchone()
+    return row is not None and row[0] == CATEGORY_RULE
+
+
+def mark_categories_current(conn: sqlite3.Connection):
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('category_rule', ?)", (CATEGORY_RULE,))
+
+
+def dimensions_of(description: Optional[str], model_version: Optional[str]) -> Tuple[str, str]:
+    return category_of(description), str(model_version or UNKNOWN_MODEL)
+
+
+def day_of(timestamp: float) -> str:
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+def record_dimensions(conn: sqlite3.Connection, eval_id: int, description: Optional[str],
+                      model_version: Optional[str]):
+    # The first dimensions seen for an evaluation stick; --rebuild picks up manifest changes
+    conn.execute("INSERT OR IGNORE INTO dimensions VALUES (?, ?, ?)",
+                 (eval_id, *dimensions_of(description, model_version)))
+
+
+def _add(conn: sqlite3.Connection, key: Tuple, ai_rating: Optional[int], change: Contribution, sign: int):
+    rated = bool(change[2] and ai_rating)
+    delta = change[2] - ai_rating if rated else 0
+    measures = (change[0], change[1], int(rated), delta, abs(delta))
+    conn.execute(
+        f"""INSERT INTO rollups ({', '.join(DIMENSIONS)}, {', '.join(MEASURES)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT ({', '.join(DIMENSIONS)}) DO UPDATE SET
+            {', '.join(f'{measure} = {measure} + excluded.{measure}' for measure in MEASURES)}""",
+        (*key, *(sign * measure for measure in measures))
+    )
+    if sign < 0:
+        conn.execute(f"DELETE FROM rollups WHERE {' AND '.join(f'{column} = ?' for column in DIMENSIONS)} "
+                     "AND annotations = 0", key)
+
+
+def apply_transition(conn: sqlite3.Connection, eval_id: int, ai_rating: Optional[int],
+                     before: Contribution, before_updated: Optional[float],
+                     after: Contribution, after_updated: Optional[float]):
+    """Move one annotation from the row of its old state to the row of its new one."""
+    if before == after and before_updated == after_updated:
+        return
+    category, model_version = conn.execute(
+        "SELECT category, model_version FROM dimensions WHERE eval_id = ?", (eval_id,)
+    ).fetchone() or dimensions_of(None, None)
+    for change, updated, sign in ((before, before_updated, -1), (after, after_updated, 1)):
+        if change[0]:
+            _add(conn, (category, ai_rating or 0, model_version, day_of(updated)), ai_rating, change, sign)
+
+
+def rebuild(conn: sqlite3.Connection):
+    """Recompute every rollup from the current annotations table."""
+    conn.execute("DELETE FROM rollups")
+    rows = conn.execute("SELECT eval_id, feedback, rating, ai_rating, updated FROM annotations").fetchall()
+    for eval_id, feedback, rating, ai_rating, updated in rows:
+        apply_transition(conn, eval_id, ai_rating, NO_CONTRIBUTION, None,
+                         contribution(feedback, rating, ai_rating), updated)
+
+
+def refresh_dimensions(conn: sqlite3.Connection, evaluations) -> int:
+    """Take the dimensions of every annotated evaluation from ``evaluations``; returns how many were found."""
+    if hasattr(evaluations, 'position_of'):
+        lookup = lambda eval_id: evaluations[evaluations.position_of(eval_id)]
+    else:
+        # The demo rows are few, so they are keyed by id here
+        lookup = {evaluation['id']: evaluation for evaluation in evaluations}.__getitem__
+    found = []
+    for (eval_id,) in conn.execute("SELECT DISTINCT eval_id FROM annotations").fetchall():
+        try:
+            evaluation = lookup(eval_id)
+        except KeyError:
+            continue
+        found.append((eval_id, *dimensions_of(evaluation.get('description'), evaluation.get('model_version'))))
+    conn.executemany("INSERT OR REPLACE INTO dimensions VALUES (?, ?, ?)", found)
+    return len(found)
+
+
+def backfill_categories(conn: sqlite3.Connection, evaluations) -> Optional[int]:
+    """Re-derive dimensions from ``evaluations`` and rebuild, if the categories predate ``CATEGORY_RULE``.
+
+    Returns how many evaluations were refreshed, or None when nothing was stale.
+    Evaluations missing from ``evaluations`` keep their old category.
+    """
+    if categories_current(conn):
+        return None
+    refreshed = refresh_dimensions(conn, evaluations)
+    rebuild(conn)
+    mark_categories_current(conn)
+    return refreshed
+
+
+def _summary(row: Sequence) -> Dict[str, Any]:
+    annotations, agreements, rated, delta_sum, abs_delta_sum = row
+    return {
+        'annotations': annotations,
+        'agreement_rate': round(agreements / annotations * 100, 1) if annotations else 0.0,
+        'rated': rated,
+        'mean_delta': round(delta_sum / rated, 2) if rated else None,
+        'mean_abs_delta': round(abs_delta_sum / rated, 2) if rated else None,
+    }
+
+
+def query(conn: sqlite3.Connection, by: Iterable[str] = ('category',), where: Optional[Dict[str, Any]] = None,
+          since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Rollups grouped by the ``by`` dimensions, filtered by ``where`` and an inclusive day range."""
+    by = list(by)
+    where = dict(where or {})
+    unknown = [column for column in by + list(where) if column not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"unknown dimension(s): {', '.join(unknown)}")
+    clauses = [f"{column} = ?" for column in where]
+    params = list(where.values())
+    if since:
+        clauses.append("day >= ?")
+        params.append(since)
+    if until:
+        clauses.append("day <= ?")
+        params.append(until)
+    group = f"GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}" if by else ""
+    rows = conn.execute(
+        f"""SELECT {''.join(f'{column}, ' for column in by)}{', '.join(f'SUM({measure})' for measure in MEASURES)}
+            FROM rollups {'WHERE ' + ' AND '.join(clauses) if clauses else ''} {group}""",
+        params
+    ).fetchall()
+    return [dict(zip(by, row[:len(by)]), **_summary(row[len(by):])) for row in rows if row[len(by)]]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Drill into the annotation rollups kept next to the annotation log.")
+    parser.add_argument('--log', default=settings.ANNOTATION_LOG_PATH, help="annotation log (default: %(default)s)")
+    parser.add_argument('--by', nargs='*', default=['category'], choices=DIMENSIONS, help="dimensions to group by")
+    parser.add_argument('--where', nargs='*', default=[], metavar='DIMENSION=VALUE', help="filters, e.g. model_version=v2")
+    parser.add_argument('--since', help="first UTC day, YYYY-MM-DD")
+    parser.add_argument('--until', help="last UTC day, YYYY-MM-DD")
+    parser.add_argument('--manifest', default=settings.EVALUATION_MANIFEST or None,
+                        help="with --rebuild, manifest to take categories and model versions from")
+    parser.add_argument('--rebuild', action='store_true', help="recompute the rollups from the annotations first")
+    args = parser.parse_args(argv)
+
+    if not args.log or not os.path.exists(args.log):
+        print(f"annotation log not found: {args.log}", file=sys.stderr)
+        return 2
+    where = {}
+    for condition in args.where:
+        column, _, value = condition.partition('=')
+        where[column] = int(value) if column == 'ai_rating' else value
+
+    conn = sqlite3.connect(args.log, timeout=30)
+    if args.rebuild:
+        started = time.perf_counter()
+        with conn:
+            ensure_schema(conn)
+            refreshed = 0
+            if args.manifest:
+                from manifest import open_manifest
+                refreshed = refresh_dimensions(conn, open_manifest(args.manifest))
+                mark_categories_current(conn)
+            rebuild(conn)
+        print(f"rebuilt rollups ({refreshed} evaluations' dimensions refreshed) in "
+              f"{time.perf_counter() - started:.2f}s", file=sys.stderr)
+
+    started = time.perf_counter()
+    try:
+        rows = query(conn, args.by, where, args.since, args.until)
+    except (ValueError, sqlite3.Error) as error:
+        print(f"query failed: {error}", file=sys.stderr)
+        return 2
+    elapsed = time.perf_counter() - started
+    columns = args.by + ['annotations', 'agreement_rate', 'rated', 'mean_delta', 'mean_abs_delta']
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if row[column] is None else str(row[column]) for column in columns))
+    print(f"{len(rows)} rows in {elapsed * 1000:.1f}ms", file=sys.stderr)
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
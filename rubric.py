@@ -0,0 +1,13 @@
+"""The 1-5 quality rubric shared by the app, the scorer and the batch tools."""
+
+QUALITY_LABELS = {
+    1: 'Unusable',
+    2: 'Partially Viable',
+    3: 'Moderately Functional',
+    4: 'Near Production Ready',
+    5: 'Production Ready',
+}
+
+
+def quality_label(rating: int) -> str:
+    return QUALITY_LABELS.get(rating, 'Unrated')
@@ -0,0 +1,149 @@
+"""Adaptive stratified sampling with a sequential test against the agreement threshold.
+
+Evaluations are stratified by AI rating and category (the part of the
+description before `` - ``, e.g. ``Product``, or the whole description when it
+has no `` - ``). The next evaluation to review is
+taken from the stratum where one more label shrinks the variance of the
+stratified agreement estimate the most. Repeated over many picks this gives a
+Neyman allocation: big strata and strata where annotators often disagree get
+more reviews.
+
+After every label the stratified estimate gets a confidence interval. Its
+level is tightened with the number of looks (alpha spending,
+``alpha * 6 / (pi^2 k^2)`` at look ``k``), so checking after every submission
+stays valid. Once the interval lies entirely above or below the threshold, the
+go/no-go decision is settled and the remaining evaluations need not be reviewed.
+"""
+import math
+from statistics import NormalDist
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from analytics import PRODUCTION_THRESHOLD
+from evaluation_store import AGREE, NO_FEEDBACK
+
+CATEGORY_SEPARATOR = ' - '
+# Labels every stratum needs before its agreement rate is trusted
+MIN_PER_STRATUM = 2
+ALPHA = 0.05
+# Bumped whenever category_of changes, so categories derived before are recomputed
+CATEGORY_RULE = 2
+
+
+def category_of(description: Optional[str]) -> str:
+    # Whitespace is collapsed so "Steak  Dish" and "Steak Dish " share a category
+    description = ' '.join((description or '').split())
+    return description.split(CATEGORY_SEPARATOR, 1)[0].strip() or 'Other'
+
+
+def _row_category(evaluation) -> str:
+    return category_of(evaluation['description'])
+
+
+def category_codes(evaluations: Sequence[Dict[str, Any]]) -> Tuple[List[str], np.ndarray]:
+    """Category names and the category code of every evaluation.
+
+    Manifests compute the codes once and keep them in a sidecar, so callers
+    can aggregate by category with ``np.bincount`` alone.
+    """
+    if hasattr(evaluations, 'codes'):
+        return evaluations.codes(f'categories.v{CATEGORY_RULE}', _row_category)
+    names: Dict[str, int] = {}
+    codes = np.fromiter((names.setdefault(_row_category(evaluation), len(names)) for evaluation in evaluations),
+                        dtype=np.int32, count=len(evaluations))
+    return list(names), codes
+
+
+class StratifiedSampler:
+    def __init__(self, evaluations: Sequence[Dict[str, Any]], seed: int = 0):
+        ratings = np.fromiter((evaluation['rating'] or 0 for evaluation in evaluations), dtype=np.int64,
+                              count=len(evaluations))
+        # The same categories the rollups and the dashboard charts use
+        names, codes = category_codes(evaluations)
+        keys, self.strata = np.unique(ratings * len(names) + codes, return_inverse=True)
+        self.labels: List[Tuple[int, str]] = [(int(key // len(names)), names[key % len(names)]) for key in keys]
+        self.sizes = np.bincount(self.strata, minlength=len(keys))
+        self.weights = self.sizes / max(1, len(evaluations))
+        # Positions grouped by stratum, shuffled within each stratum
+        rng = np.random.default_rng(seed)
+        self.order = np.lexsort((rng.random(len(evaluations)), self.strata))
+        self.starts = np.searchsorted(self.strata[self.order], np.arange(len(keys) + 1))
+
+    def counts(self, store) -> Tuple[np.ndarray, np.ndarray]:
+        """Labels and agreements per stratum for a session's store."""
+        positions = store.annotated()
+        strata = self.strata[positions]
+        labelled = np.bincount(strata, minlength=len(self.sizes))
+        agreed = np.bincount(strata, weights=store.feedback[positions] == AGREE, minlength=len(self.sizes))
+        return labelled, agreed
+
+    @staticmethod
+    def _spread(labelled: np.ndarray, agreed: np.ndarray) -> np.ndarray:
+        # Laplace-smoothed Bernoulli variance, so unseen or unanimous strata are not treated as certain
+        rate = (agreed + 1) / (labelled + 2)
+        return rate * (1 - rate)
+
+    def _unreviewed(self, store) -> np.ndarray:
+        """Positions that can still be shown for review.
+
+        With a duplicate index on the store, only cluster representatives are
+        shown; their verdicts label the rest of the cluster.
+        """
+        unreviewed = store.feedback == NO_FEEDBACK
+        if store.duplicates is not None:
+            eligible = np.zeros(len(unreviewed), dtype=bool)
+            eligible[store.duplicates.representatives] = True
+            unreviewed &= eligible
+        return unreviewed
+
+    def next_position(self, store) -> Optional[int]:
+        """Unreviewed position whose label most reduces the variance of the estimate."""
+        labelled, agreed = self.counts(store)
+        unreviewed = self._unreviewed(store)
+        open_strata = np.bincount(self.strata[unreviewed], minlength=len(self.sizes)) > 0
+        if not open_strata.any():
+            return None
+        reduction = np.where(
+            labelled > 0,
+            self.weights ** 2 * self._spread(labelled, agreed) / np.maximum(labelled * (labelled + 1), 1),
+            np.inf
+        )
+        # Unsampled strata first, largest first; never pick an exhausted stratum
+        priority = np.where(open_strata, reduction, -1.0)
+        tie_break = np.where(np.isinf(priority), self.weights, 0.0)
+        stratum = int(np.lexsort((-tie_break, -priority))[0])
+        members = self.order[self.starts[stratum]:self.starts[stratum + 1]]
+        return int(members[unreviewed[members]][0])
+
+    def test(self, store, threshold: float = PRODUCTION_THRESHOLD, alpha: float = ALPHA) -> Dict[str, Any]:
+        """Stratified agreement estimate, its anytime-valid interval and the decision, if settled."""
+        labelled, agreed = self.counts(store)
+        looks = int(labelled.sum())
+        sampled = labelled > 0
+        rates = np.divide(agreed, labelled, out=np.zeros(len(labelled)), where=sampled)
+        covered = float(self.weights[sampled].sum())
+        estimate = float((self.weights * rates)[sampled].sum() / covered) if covered else 0.0
+        fpc = 1 - labelled / self.sizes
+        variance = float((self.weights ** 2 * fpc * self._spread(labelled, agreed) / np.maximum(labelled, 1)).sum())
+
+        level = alpha * 6 / (math.pi ** 2 * max(1, looks) ** 2)
+        z = NormalDist().inv_cdf(1 - level / 2)
+        low, high = max(0.0, estimate - z * math.sqrt(variance)), min(1.0, estimate + z * math.sqrt(variance))
+        # Strata made only of duplicates are labelled through their representatives elsewhere
+        reachable = np.bincount(self.strata[self._unreviewed(store)], minlength=len(self.sizes)) > 0
+        ready = bool(np.all((labelled >= np.minimum(self.sizes, MIN_PER_STRATUM)) | ~reachable))
+        decision = None
+        if ready and low >= threshold:
+            decision = 'above'
+        elif ready and high < threshold:
+            decision = 'below'
+        return {
+            'estimate': round(estimate * 100, 1),
+            'ci': (round(low * 100, 1), round(high * 100, 1)),
+            'labels': looks,
+            'population': int(self.sizes.sum()),
+            'strata': len(self.sizes),
+            'decision': decision,
+            'threshold': threshold,
+        }
@@ -0,0 +1,235 @@
+"""Automated background-removal quality scorer.
+
+Scores a Before/After pair (original RGB, processed RGBA) from measurable
+signals and maps them onto the 1-5 rubric:
+
+- ``coverage``: share of opaque pixels; nearly empty or untouched cutouts are unusable.
+- ``fringe``: semi-transparent pixels per boundary pixel, high for soft, smeared edges.
+- ``halo``: how much the edge pixels still look like the removed background.
+- ``leakage``: share of the outer frame still opaque and background-coloured.
+- ``fragments`` / ``holes``: stray foreground islands and gaps punched into the subject.
+
+Full-resolution work is tiled: every tile is classified as fully opaque,
+fully clear or mixed with block reductions, and only mixed tiles and their
+neighbours are examined pixel by pixel, in one vectorized pass over the stacked
+tiles. Colour distances are computed for edge and frame pixels only.
+"""
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from PIL import Image
+
+from rubric import quality_label
+
+# Side of the square tiles classified as fully opaque, fully clear or mixed
+BLOCK = 64
+OPAQUE = 128
+SEMI_LOW, SEMI_HIGH = 8, 247
+# RGB distance under which a pixel counts as background-coloured
+BACKGROUND_DISTANCE = 40.0
+# Outer share of each side inspected for leftover background
+FRAME_FRACTION = 0.03
+COMPONENT_GRID = 256
+MIN_COMPONENT_FRACTION = 0.0005
+BACKGROUND_SAMPLES = 20000
+
+# (good, bad, weight): penalty ramps linearly from 0 at ``good`` to ``weight`` at ``bad``
+PENALTIES = {
+    'fringe': (1.5, 4.0, 1.0),
+    'halo': (0.15, 0.5, 1.5),
+    'leakage': (0.01, 0.15, 1.5),
+    'fragments': (0, 6, 1.0),
+    'holes': (0, 4, 0.5),
+}
+MIN_COVERAGE, MAX_COVERAGE = 0.01, 0.99
+
+
+def load_pair(original_path: str, processed_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Original as RGB and processed as RGBA arrays of the same size."""
+    with Image.open(processed_path) as processed:
+        processed = processed.convert('RGBA')
+    with Image.open(original_path) as original:
+        original = original.convert('RGB')
+        if original.size != processed.size:
+            original = original.resize(processed.size, Image.BILINEAR)
+    return np.asarray(original), np.asarray(processed)
+
+
+def estimate_background(original: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """Median colour of the removed region, falling back to the image border."""
+    stride = max(1, int(np.sqrt(alpha.size / BACKGROUND_SAMPLES)))
+    removed = alpha[::stride, ::stride] == 0
+    samples = original[::stride, ::stride][removed]
+    if len(samples) < 16:
+        samples = np.concatenate([original[0], original[-1], original[:, 0], original[:, -1]])
+    return np.median(samples, axis=0).astype(np.float32)
+
+
+def _background_similarity(pixels: np.ndarray, background: np.ndarray) -> np.ndarray:
+    distance = np.sqrt(((pixels.astype(np.float32) - background) ** 2).sum(axis=-1))
+    return np.clip(1.0 - distance / BACKGROUND_DISTANCE, 0.0, 1.0)
+
+
+def _edge_stats(processed: np.ndarray, background: np.ndarray) -> Dict[str, float]:
+    height, width = processed.shape[:2]
+    block_rows, block_cols = -(-height // BLOCK), -(-width // BLOCK)
+    # Alpha padded to whole blocks plus a one-pixel rim; replicating the edge
+    # values means the padding never reads as a boundary
+    alpha = np.empty((block_rows * BLOCK + 2, block_cols * BLOCK + 2), dtype=np.uint8)
+    alpha[1:height + 1, 1:width + 1] = processed[..., 3]
+    alpha[0, 1:width + 1] = alpha[1, 1:width + 1]
+    alpha[height + 1:, 1:width + 1] = alpha[height, 1:width + 1]
+    alpha[:, 0] = alpha[:, 1]
+    alpha[:, width + 1:] = alpha[:, width:width + 1]
+
+    row_stride, col_stride = alpha.strides
+    blocks = as_strided(alpha[1:, 1:], shape=(block_rows, block_cols, BLOCK, BLOCK),
+                        strides=(BLOCK * row_stride, BLOCK * col_stride, row_stride, col_stride))
+    solid = blocks.min(axis=(2, 3)) >= SEMI_HIGH
+    clear = blocks.max(axis=(2, 3)) <= SEMI_LOW
+    # 0 = fully transparent, 1 = fully opaque, 2 = mixed
+    kind = np.where(solid, 1, np.where(clear, 0, 2))
+    padded_kind = np.pad(kind, 1, mode='edge')
+    differs = np.zeros(kind.shape, dtype=bool)
+    for dy, dx in ((0, 1), (2, 1), (1, 0), (1, 2)):
+        differs |= padded_kind[dy:dy + block_rows, dx:dx + block_cols] != kind
+    # Uniform blocks whose neighbours share their kind hold no edge pixels at all
+    candidate = (kind == 2) | differs
+
+    block_heights = np.minimum(BLOCK, height - np.arange(block_rows) * BLOCK)
+    block_widths = np.minimum(BLOCK, width - np.arange(block_cols) * BLOCK)
+    areas = block_heights[:, None] * block_widths[None, :]
+    opaque = int(areas[solid & ~candidate].sum())
+
+    cand_rows, cand_cols = np.nonzero(candidate)
+    windows = as_strided(alpha, shape=(block_rows, block_cols, BLOCK + 2, BLOCK + 2),
+                         strides=(BLOCK * row_stride, BLOCK * col_stride, row_stride, col_stride))
+    windows = windows[cand_rows, cand_cols]
+    mask = windows >= OPAQUE
+    core = mask[:, 1:-1, 1:-1]
+    interior = core & mask[:, :-2, 1:-1] & mask[:, 2:, 1:-1] & mask[:, 1:-1, :-2] & mask[:, 1:-1, 2:]
+    offsets = np.arange(BLOCK)
+    valid = (((cand_rows[:, None] * BLOCK + offsets) < height)[:, :, None]
+             & ((cand_cols[:, None] * BLOCK + offsets) < width)[:, None, :])
+    boundary = core & ~interior & valid
+    # Single unsigned compare for SEMI_LOW < alpha < SEMI_HIGH (values below wrap around)
+    semi = ((windows[:, 1:-1, 1:-1] - np.uint8(SEMI_LOW + 1)) < np.uint8(SEMI_HIGH - SEMI_LOW - 1)) & valid
+
+    block, edge_rows, edge_cols = np.nonzero(boundary | semi)
+    edge_pixels = processed[cand_rows[block] * BLOCK + edge_rows, cand_cols[block] * BLOCK + edge_cols]
+    similarity = _background_similarity(edge_pixels[:, :3], background)
+    return {
+        'opaque': opaque + int(np.count_nonzero(core & valid)),
+        'semi': int(np.count_nonzero(semi)),
+        'boundary': int(np.count_nonzero(boundary)),
+        'edge': len(edge_pixels),
+        'halo': float((similarity * (edge_pixels[:, 3] / 255.0)).sum()),
+    }
+
+
+def _frame_leakage(original: np.ndarray, alpha: np.ndarray, background: np.ndarray) -> float:
+    height, width = alpha.shape
+    band = max(1, int(min(height, width) * FRAME_FRACTION))
+    strips = [
+        (slice(0, band), slice(None)),
+        (slice(height - band, height), slice(None)),
+        (slice(band, height - band), slice(0, band)),
+        (slice(band, height - band), slice(width - band, width)),
+    ]
+    leaked = total = 0
+    for rows, cols in strips:
+        opaque = alpha[rows, cols] >= OPAQUE
+        similarity = _background_similarity(original[rows, cols][opaque], background)
+        leaked += int(np.count_nonzero(similarity > 0))
+        total += opaque.size
+    return leaked / total if total else 0.0
+
+
+def _components(mask: np.ndarray) -> List[Tuple[int, bool]]:
+    """(size, touches_border) of each 4-connected component, via run-length union-find."""
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    changes = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(changes == 1)
+    _, run_ends = np.nonzero(changes == -1)
+    parent = list(range(len(run_starts)))
+
+    def find(run):
+        while parent[run] != run:
+            parent[run] = parent[parent[run]]
+            run = parent[run]
+        return run
+
+    row_first = np.searchsorted(run_rows, np.arange(height + 1))
+    for row in range(1, height):
+        prev, prev_stop = row_first[row - 1], row_first[row]
+        current, current_stop = row_first[row], row_first[row + 1]
+        while prev < prev_stop and current < current_stop:
+            if run_starts[current] < run_ends[prev] and run_ends[current] > run_starts[prev]:
+                root_a, root_b = find(prev), find(current)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+            if run_ends[prev] < run_ends[current]:
+                prev += 1
+            else:
+                current += 1
+
+    sizes: Dict[int, int] = {}
+    border: Dict[int, bool] = {}
+    for run in range(len(run_starts)):
+        root = find(run)
+        sizes[root] = sizes.get(root, 0) + int(run_ends[run] - run_starts[run])
+        touches = run_rows[run] in (0, height - 1) or run_starts[run] == 0 or run_ends[run] == width
+        border[root] = border.get(root, False) or bool(touches)
+    return [(sizes[root], border[root]) for root in sizes]
+
+
+def _topology(alpha: np.ndarray) -> Tuple[int, int]:
+    """Counts of foreground fragments and enclosed holes on a coarse grid."""
+    step = max(1, int(np.ceil(max(alpha.shape) / COMPONENT_GRID)))
+    mask = alpha[::step, ::step] >= OPAQUE
+    min_area = max(1, int(mask.size * MIN_COMPONENT_FRACTION))
+    fragments = [size for size, _ in _components(mask) if size >= min_area]
+    holes = [size for size, on_border in _components(~mask) if size >= min_area and not on_border]
+    return len(fragments), len(holes)
+
+
+def _ramp(value: float, good: float, bad: float) -> float:
+    return float(np.clip((value - good) / (bad - good), 0.0, 1.0))
+
+
+def rate(signals: Dict[str, float]) -> int:
+    if not MIN_COVERAGE <= signals['coverage'] <= MAX_COVERAGE:
+        return 1
+    values = dict(signals, fragments=max(0, signals['fragments'] - 1))
+    penalty = sum(weight * _ramp(values[name], good, bad) for name, (good, bad, weight) in PENALTIES.items())
+    return int(np.clip(round(5 - penalty), 1, 5))
+
+
+def score_arrays(original: np.ndarray, processed: np.ndarray) -> Dict[str, Any]:
+    """Score an RGB original against an RGBA cutout of the same size."""
+    alpha = processed[..., 3]
+    background = estimate_background(original, alpha)
+    edges = _edge_stats(processed, background)
+    fragments, holes = _topology(alpha)
+    signals = {
+        'coverage': round(edges['opaque'] / alpha.size, 4),
+        'fringe': round(edges['semi'] / edges['boundary'], 3) if edges['boundary'] else 0.0,
+        'halo': round(edges['halo'] / edges['edge'], 4) if edges['edge'] else 0.0,
+        'leakage': round(_frame_leakage(original, alpha, background), 4),
+        'fragments': fragments,
+        'holes': holes,
+    }
+    rating = rate(signals)
+    return {'rating': rating, 'quality': quality_label(rating), 'signals': signals}
+
+
+def score_pair(original_path: str, processed_path: str) -> Dict[str, Any]:
+    return score_arrays(*load_pair(original_path, processed_path))
+
+
+def score_shard(shards, eval_id: int) -> Dict[str, Any]:
+    """Score an evaluation packed in a ``shards.ShardSet``."""
+    return score_arrays(*shards.pair_arrays(eval_id))
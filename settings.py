@@ -0,0 +1,72 @@
+"""Runtime configuration for the evaluator, read from environment variables.
+
+Everything here must stay importable without Streamlit so the batch tools can
+share it.
+"""
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+# Optional CSV/JSONL manifest of evaluations; the built-in demo set is used when unset
+EVALUATION_MANIFEST = os.environ.get("EVALUATOR_MANIFEST", "")
+
+# Decoded image cache shared by every session in the server process
+IMAGE_CACHE_MAX_BYTES = _env_int("EVALUATOR_IMAGE_CACHE_MB", 256) * 1024 * 1024
+
+# Display width of the images in the single-image view
+THUMBNAIL_WIDTH = 300
+
+# Disk cache of zoom tiles, plus the memory budget for decoded levels they are cut from
+TILE_CACHE_DIR = os.environ.get("EVALUATOR_TILE_CACHE", ".tile_cache")
+TILE_LEVEL_CACHE_BYTES = _env_int("EVALUATOR_TILE_LEVEL_CACHE_MB", 256) * 1024 * 1024
+PYRAMID_CACHE_ENTRIES = _env_int("EVALUATOR_PYRAMID_CACHE_ENTRIES", 1024)
+
+# Content-addressed WebP renditions written by transcode.py; served when present
+RENDITION_CACHE_DIR = os.environ.get("EVALUATOR_RENDITION_CACHE", ".renditions")
+
+# Packed image shards written by shards.py; when set, images are read from them
+SHARD_DIR = os.environ.get("EVALUATOR_SHARDS", "")
+
+# "sequential" reviews every evaluation in order; "adaptive" samples strata and stops once the go/no-go is settled
+SAMPLING_MODE = os.environ.get("EVALUATOR_SAMPLING", "sequential")
+
+# Near-duplicate clusters written by phash.py; only one pair per cluster is shown for review
+DUPLICATE_INDEX_PATH = os.environ.get("EVALUATOR_DUPLICATE_INDEX", "")
+
+# Scoring service the AI ratings come from (see rater.py); the built-in scorer runs in-process when unset
+RATER_URL = os.environ.get("EVALUATOR_RATER_URL", "")
+# Ratings cached by image content, so unchanged pairs are never re-scored
+RATER_CACHE_PATH = os.environ.get("EVALUATOR_RATER_CACHE", "ratings.db")
+RATER_BATCH_SIZE = _env_int("EVALUATOR_RATER_BATCH", 16)
+RATER_CONCURRENCY = _env_int("EVALUATOR_RATER_CONCURRENCY", 4)
+RATER_TIMEOUT = _env_int("EVALUATOR_RATER_TIMEOUT", 30)
+
+# Prometheus text file of rerun and phase timing histograms; an empty value disables it
+METRICS_PATH = os.environ.get("EVALUATOR_METRICS_FILE", "")
+
+# When set, reruns are profiled and the slowest few kept here as .prof files
+PROFILE_DIR = os.environ.get("EVALUATOR_PROFILE_DIR", "")
+PROFILE_KEEP = _env_int("EVALUATOR_PROFILE_KEEP", 5)
+
+# SQLite sidecar written by preflight.py; defaults to <manifest>.preflight.db (.preflight.db for the demo set)
+PREFLIGHT_INDEX_PATH = os.environ.get("EVALUATOR_PREFLIGHT_INDEX", "")
+
+# Shared SQLite work queue; when set, annotators are handed distinct images under expiring leases
+WORK_QUEUE_PATH = os.environ.get("EVALUATOR_WORK_QUEUE", "")
+REVIEWS_PER_IMAGE = _env_int("EVALUATOR_REVIEWS_PER_IMAGE", 1)
+LEASE_SECONDS = _env_int("EVALUATOR_LEASE_SECONDS", 600)
+
+# Background prefetch of the next evaluations into the image cache
+PREFETCH_DEPTH = _env_int("EVALUATOR_PREFETCH_DEPTH", 3)
+PREFETCH_WORKERS = _env_int("EVALUATOR_PREFETCH_WORKERS", 2)
+
+# SQLite file receiving every annotator action; an empty value disables persistence
+ANNOTATION_LOG_PATH = os.environ.get("EVALUATOR_ANNOTATION_LOG", "annotations.db")
+# Seconds to wait for the log to open or commit before reporting it unavailable
+ANNOTATION_LOG_TIMEOUT = _env_int("EVALUATOR_ANNOTATION_LOG_TIMEOUT", 30)
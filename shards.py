@@ -0,0 +1,257 @@
+"""Packed image shards that are memory-mapped instead of opening files per image.
+
+A shard directory holds ``shard-NNNNN.bin`` files, each containing the source
+bytes of both images of a few thousand evaluations, plus one ``index.npy``
+giving the shard, offset and size of every blob. Alongside the encoded bytes a
+shard can carry pre-decoded ``uint8`` planes: ``view`` planes are the RGBA
+thumbnails the single-image view shows, ``full`` planes are the full-resolution
+arrays the scorer reads. Planes are returned as read-only NumPy views of the
+mapping, so nothing is copied until a caller needs to.
+
+    python shards.py --manifest evaluations.csv --output shards/ --workers 8
+"""
+import argparse
+import io
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import settings
+from image_cache import decode_image
+
+SHARD_VERSION = 1
+ROWS_PER_SHARD = 4096
+ALIGNMENT = 64
+
+KINDS = ('original', 'processed')
+VARIANTS = ('encoded', 'full', 'view')
+
+INDEX_DTYPE = np.dtype([
+    ('key', np.int64),
+    ('shard', np.int32),
+    ('offset', np.int64),
+    ('size', np.int64),
+    ('height', np.int32),
+    ('width', np.int32),
+    ('channels', np.int8),
+])
+
+
+def entry_key(eval_id: int, kind: str, variant: str) -> int:
+    return int(eval_id) * 8 + KINDS.index(kind) * len(VARIANTS) + VARIANTS.index(variant)
+
+
+def shard_path(directory: str, shard: int) -> str:
+    return os.path.join(directory, f"shard-{shard:05d}.bin")
+
+
+def _decode_full(path: str, kind: str) -> np.ndarray:
+    with Image.open(path) as img:
+        return np.asarray(img.convert('RGB' if kind == 'original' else 'RGBA'))
+
+
+def _build_shard(directory: str, shard: int, rows: List[Dict[str, Any]], full_planes: bool) -> Tuple[np.ndarray, List[Tuple[Any, str]]]:
+    """Write one shard file; returns its index entries and the rows that were skipped."""
+    entries = []
+    skipped = []
+    final_path = shard_path(directory, shard)
+    tmp_path = f"{final_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as out:
+        for row in rows:
+            try:
+                blobs = []
+                for kind in KINDS:
+                    with open(row[kind], 'rb') as f:
+                        blobs.append((kind, 'encoded', f.read(), (0, 0, 0)))
+                    view = decode_image(row[kind], width=settings.THUMBNAIL_WIDTH)
+                    blobs.append((kind, 'view', view.tobytes(), view.shape))
+                    if full_planes:
+                        full = _decode_full(row[kind], kind)
+                        blobs.append((kind, 'full', full.tobytes(), full.shape))
+            except Exception as error:
+                skipped.append((row.get('id'), f"{type(error).__name__}: {error}"))
+                continue
+            for kind, variant, data, shape in blobs:
+                offset = out.tell()
+                out.write(data)
+                out.write(b'\0' * (-len(data) % ALIGNMENT))
+                entries.append((entry_key(row['id'], kind, variant), shard, offset, len(data), *shape))
+    os.replace(tmp_path, final_path)
+    return np.array(entries, dtype=INDEX_DTYPE), skipped
+
+
+def _chunks(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(dict(row))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def build_shards(rows: Iterable[Dict[str, Any]], directory: str, workers: int, full_planes: bool = False,
+                 rows_per_shard: int = ROWS_PER_SHARD) -> Dict[str, Any]:
+    """Pack the images of ``rows`` into shards under ``directory``, one shard per worker task."""
+    os.makedirs(directory, exist_ok=True)
+    indexes = []
+    skipped = []
+    shards = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for shard, chunk in enumerate(_chunks(rows, rows_per_shard)):
+            in_flight.append(executor.submit(_build_shard, directory, shard, chunk, full_planes))
+            shards += 1
+            if len(in_flight) >= workers * 2:
+                entries, failed = in_flight.popleft().result()
+                indexes.append(entries)
+                skipped.extend(failed)
+        while in_flight:
+            entries, failed = in_flight.popleft().result()
+            indexes.append(entries)
+            skipped.extend(failed)
+
+    index = np.concatenate(indexes) if indexes else np.zeros(0, dtype=INDEX_DTYPE)
+    index = index[np.argsort(index['key'], kind='stable')]
+    tmp_path = os.path.join(directory, 'index.tmp.npy')
+    np.save(tmp_path, index)
+    os.replace(tmp_path, os.path.join(directory, 'index.npy'))
+    meta = {'version': SHARD_VERSION, 'shards': shards, 'full_planes': full_planes,
+            'entries': len(index), 'bytes': int(index['size'].sum())}
+    with open(os.path.join(directory, 'shards.json.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(directory, 'shards.json.tmp'), os.path.join(directory, 'shards.json'))
+    return dict(meta, skipped=skipped)
+
+
+class ShardSet:
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'shards.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != SHARD_VERSION:
+            raise ValueError(f"Unsupported shard version in {directory}: {self.meta.get('version')}")
+        self.index = np.load(os.path.join(directory, 'index.npy'), mmap_mode='r')
+        self._keys = self.index['key']
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, eval_id: int, kind: str, variant: str) -> Optional[np.void]:
+        key = entry_key(eval_id, kind, variant)
+        position = int(np.searchsorted(self._keys, key))
+        if position < len(self._keys) and self._keys[position] == key:
+            return self.index[position]
+        return None
+
+    def _map(self, shard: int) -> mmap.mmap:
+        mapping = self._maps.get(shard)
+        if mapping is None:
+            with self._lock:
+                mapping = self._maps.get(shard)
+                if mapping is None:
+                    with open(shard_path(self.directory, shard), 'rb') as f:
+                        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._maps[shard] = mapping
+        return mapping
+
+    def contains(self, eval_id: int, kind: str, variant: str = 'encoded') -> bool:
+        return self._entry(eval_id, kind, variant) is not None
+
+    def encoded(self, eval_id: int, kind: str) -> Optional[memoryview]:
+        """Source file bytes as a view of the mapping."""
+        entry = self._entry(eval_id, kind, 'encoded')
+        if entry is None:
+            return None
+        offset, size = int(entry['offset']), int(entry['size'])
+        return memoryview(self._map(int(entry['shard'])))[offset:offset + size]
+
+    def plane(self, eval_id: int, kind: str, variant: str = 'view') -> Optional[np.ndarray]:
+        """Pre-decoded pixels as a read-only array backed by the mapping."""
+        entry = self._entry(eval_id, kind, variant)
+        if entry is None:
+            return None
+        shape = (int(entry['height']), int(entry['width']), int(entry['channels']))
+        return np.frombuffer(self._map(int(entry['shard'])), dtype=np.uint8,
+                             count=int(entry['size']), offset=int(entry['offset'])).reshape(shape)
+
+    def pair_arrays(self, eval_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Original as RGB and processed as RGBA of the same size, like ``scorer.load_pair``."""
+        arrays = []
+        for kind, mode in zip(KINDS, ('RGB', 'RGBA')):
+            pixels = self.plane(eval_id, kind, 'full')
+            if pixels is None:
+                data = self.encoded(eval_id, kind)
+                if data is None:
+                    raise KeyError(f"Evaluation {eval_id} has no {kind} image in {self.directory}")
+                with Image.open(io.BytesIO(data)) as img:
+                    pixels = np.asarray(img.convert(mode))
+            arrays.append(pixels)
+        original, processed = arrays
+        if original.shape[:2] != processed.shape[:2]:
+            resized = Image.fromarray(original).resize((processed.shape[1], processed.shape[0]), Image.BILINEAR)
+            original = np.asarray(resized)
+        return original, processed
+
+    def close(self):
+        with self._lock:
+            for mapping in self._maps.values():
+                mapping.close()
+            self._maps.clear()
+
+
+_shards: Dict[str, ShardSet] = {}
+_shards_lock = threading.Lock()
+
+
+def open_shards(directory: str) -> ShardSet:
+    """Shared reader per directory, so every session and worker thread reuses one set of mappings."""
+    directory = os.path.abspath(directory)
+    with _shards_lock:
+        shards = _shards.get(directory)
+        if shards is None:
+            shards = _shards[directory] = ShardSet(directory)
+    return shards
+
+
+def get_shards() -> Optional[ShardSet]:
+    """Process-wide shard set, or None when ``EVALUATOR_SHARDS`` is unset."""
+    if not settings.SHARD_DIR:
+        return None
+    return open_shards(settings.SHARD_DIR)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from manifest import open_manifest
+
+    parser = argparse.ArgumentParser(description="Pack the images of a manifest into memory-mappable shards.")
+    parser.add_argument('--manifest', required=True, help="CSV/JSONL evaluation manifest")
+    parser.add_argument('--output', required=True, help="shard directory to write")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--rows-per-shard', type=int, default=ROWS_PER_SHARD)
+    parser.add_argument('--full-planes', action='store_true',
+                        help="also store full-resolution decoded planes for the scorer (large)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    result = build_shards(iter(open_manifest(args.manifest)), args.output, args.workers,
+                          args.full_planes, args.rows_per_shard)
+    elapsed = time.perf_counter() - started
+    for eval_id, error in result['skipped']:
+        print(f"skipped {eval_id}: {error}", file=sys.stderr)
+    print(f"wrote {result['shards']} shards, {result['entries']} entries, {result['bytes']:,} bytes "
+          f"in {elapsed:.2f}s ({len(result['skipped'])} rows skipped)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
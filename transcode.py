@@ -0,0 +1,269 @@
+"""Offline transcoding of evaluation images into display-ready WebP renditions.
+
+For every row of an evaluation set this writes, per source image, WebP files at
+the sizes the viewer uses (``thumb``, ``view`` and ``zoom``), plus a copy of the
+processed image composited over a checkerboard so transparent regions read
+clearly whatever the page background. Outputs are content-addressed by the
+SHA-256 of the source bytes, and ``index.db`` maps each source path (with size
+and mtime) to its digest so the app finds renditions without hashing.
+
+    python transcode.py --manifest evaluations.csv
+    python transcode.py --dir images/ --workers 8
+"""
+import argparse
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import settings
+
+# Rendition name -> (size, whether it bounds the width or the longest side)
+RENDITIONS = {
+    'thumb': (160, 'width'),
+    'view': (settings.THUMBNAIL_WIDTH, 'width'),
+    'zoom': (1600, 'max_side'),
+}
+WEBP_QUALITY = 82
+CHECKER_SQUARE = 8
+CHECKER_COLORS = ((255, 255, 255), (229, 231, 235))
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def rendition_path(cache_dir: str, digest: str, rendition: str, composite: bool = False) -> str:
+    suffix = '-composite' if composite else ''
+    return os.path.join(cache_dir, digest[:2], digest, f"{rendition}{suffix}.webp")
+
+
+def checkerboard(width: int, height: int) -> np.ndarray:
+    rows = (np.arange(height) // CHECKER_SQUARE)[:, None]
+    cols = (np.arange(width) // CHECKER_SQUARE)[None, :]
+    light, dark = (np.array(color, dtype=np.float32) for color in CHECKER_COLORS)
+    return np.where(((rows + cols) % 2 == 0)[..., None], light, dark)
+
+
+def composite_over_checkerboard(image: Image.Image) -> Image.Image:
+    rgba = np.asarray(image.convert('RGBA'), dtype=np.float32)
+    alpha = rgba[..., 3:] / 255.0
+    background = checkerboard(image.width, image.height)
+    blended = rgba[..., :3] * alpha + background * (1.0 - alpha)
+    return Image.fromarray(np.round(blended).astype(np.uint8), 'RGB')
+
+
+def _resize(image: Image.Image, size: int, bound: str) -> Image.Image:
+    if bound == 'width':
+        scale = size / image.width
+    else:
+        scale = min(1.0, size / max(image.size))
+    target = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image if target == image.size else image.resize(target, Image.LANCZOS)
+
+
+def _write_webp(image: Image.Image, path: str) -> int:
+    buffer = io.BytesIO()
+    image.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    data = buffer.getvalue()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def transcode_image(path: str, cache_dir: str, composite: bool) -> Dict[str, Any]:
+    """Write every rendition of one source image; existing outputs are reused."""
+    stat = os.stat(path)
+    digest = file_digest(path)
+    result = {
+        'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+        'digest': digest, 'encoded': 0, 'output_bytes': {}, 'seconds': 0.0,
+    }
+    wanted = [(name, False) for name in RENDITIONS] + ([(name, True) for name in RENDITIONS] if composite else [])
+    missing = [(name, flag) for name, flag in wanted if not os.path.exists(rendition_path(cache_dir, digest, name, flag))]
+    for name, flag in wanted:
+        if (name, flag) not in missing:
+            result['output_bytes'][(name, flag)] = os.path.getsize(rendition_path(cache_dir, digest, name, flag))
+    if not missing:
+        return result
+
+    started = time.perf_counter()
+    with Image.open(path) as source:
+        source.load()
+        has_alpha = source.mode in ('RGBA', 'LA', 'PA') or 'transparency' in source.info
+        source = source.convert('RGBA' if has_alpha else 'RGB')
+    for name, flag in missing:
+        size, bound = RENDITIONS[name]
+        resized = _resize(source, size, bound)
+        if flag:
+            resized = composite_over_checkerboard(resized)
+        result['output_bytes'][(name, flag)] = _write_webp(resized, rendition_path(cache_dir, digest, name, flag))
+        result['encoded'] += 1
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class RenditionIndex:
+    """Looks up pre-encoded renditions for source paths, as written by this tool."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if self._conn is None:
+            index_path = os.path.join(self.cache_dir, 'index.db')
+            if not os.path.exists(index_path):
+                return None
+            self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        return self._conn
+
+    def lookup(self, path: str, rendition: str, composite: bool = False) -> Optional[str]:
+        """Path of the rendition for ``path``, or None if it is missing or stale."""
+        path = os.path.abspath(path)
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return None
+            row = conn.execute("SELECT size, mtime_ns, digest FROM sources WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        from preflight import known_stat
+        if known_stat(path) != (row[0], row[1]):
+            return None
+        return rendition_path(self.cache_dir, row[2], rendition, composite)
+
+    def read(self, path: str, rendition: str, composite: bool = False) -> Optional[bytes]:
+        output = self.lookup(path, rendition, composite)
+        if output is None:
+            return None
+        try:
+            with open(output, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+_index: Optional[RenditionIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_rendition_index() -> RenditionIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = RenditionIndex(settings.RENDITION_CACHE_DIR)
+    return _index
+
+
+def _sources(rows: Iterable[Dict[str, Any]]) -> Iterable[Tuple[str, bool]]:
+    """(path, composite) for every distinct image referenced by the rows."""
+    seen = set()
+    for row in rows:
+        for field, composite in (('original', False), ('processed', True)):
+            path = os.path.abspath(row[field])
+            if path not in seen:
+                seen.add(path)
+                yield path, composite
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from batch_score import pairs_from_directory
+    from manifest import open_manifest
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dir', help="directory of Before/After image pairs")
+    source.add_argument('--manifest', help="CSV/JSONL evaluation manifest")
+    parser.add_argument('--cache-dir', default=settings.RENDITION_CACHE_DIR, help="output directory (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--original-prefix', default='Before ')
+    parser.add_argument('--processed-prefix', default='After ')
+    args = parser.parse_args(argv)
+
+    rows = pairs_from_directory(args.dir, args.original_prefix, args.processed_prefix) if args.dir else iter(open_manifest(args.manifest))
+    os.makedirs(args.cache_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(args.cache_dir, 'index.db'))
+    conn.executescript(INDEX_SCHEMA)
+
+    images = encoded = failed = 0
+    source_bytes = 0
+    view_bytes = 0
+    encode_seconds = 0.0
+    started = time.perf_counter()
+
+    def record(path: str, future):
+        nonlocal images, encoded, failed, source_bytes, view_bytes, encode_seconds
+        try:
+            result = future.result()
+        except Exception as error:
+            failed += 1
+            print(f"skipped {path}: {type(error).__name__}: {error}", file=sys.stderr)
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO sources (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+            (result['path'], result['size'], result['mtime_ns'], result['digest'])
+        )
+        images += 1
+        encoded += result['encoded']
+        encode_seconds += result['seconds']
+        source_bytes += result['size']
+        # What the single-image view now sends instead of the source file
+        shown = ('view', True) if ('view', True) in result['output_bytes'] else ('view', False)
+        view_bytes += result['output_bytes'][shown]
+
+    # At most a few images per worker in flight, so memory does not grow with the manifest
+    window = args.workers * 8
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        in_flight = deque()
+        for path, composite in _sources(rows):
+            in_flight.append((path, executor.submit(transcode_image, path, args.cache_dir, composite)))
+            if len(in_flight) >= window:
+                record(*in_flight.popleft())
+        while in_flight:
+            record(*in_flight.popleft())
+    conn.commit()
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    saved = source_bytes - view_bytes
+    print(f"{images} images ({failed} skipped), {encoded} renditions encoded in {elapsed:.2f}s", file=sys.stderr)
+    if encode_seconds > 0:
+        print(f"encode throughput: {encoded / encode_seconds:.1f} renditions/sec per worker, "
+              f"{images / elapsed:.1f} images/sec overall", file=sys.stderr)
+    if source_bytes:
+        print(f"view bytes: {view_bytes:,} vs {source_bytes:,} source bytes "
+              f"({saved:,} saved, {saved / source_bytes:.0%})", file=sys.stderr)
+    return 1 if failed and not images else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
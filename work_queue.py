@@ -0,0 +1,205 @@
+"""Lease-based distribution of evaluations across annotators and server processes.
+
+Every evaluation is an ``items`` row counting its finished reviews and active
+leases. ``claim`` hands an annotator the first evaluation, in set order, that
+still needs reviews and that the annotator has not reviewed. The evaluation is
+leased to them for ``lease_seconds``. ``complete`` turns the lease into a
+review. Leases that expire are reclaimed by the next ``claim`` from any
+process, so an abandoned tab only holds its image until the lease runs out.
+
+All state lives in one SQLite file in WAL mode. Claims run in ``BEGIN
+IMMEDIATE`` transactions, so any number of server processes on the host can
+share it. A partial index over evaluations that still need reviews keeps a
+claim to a few index lookups whatever the size of the set. Annotators
+therefore get distinct images, and reviewed images per hour grow with the
+number of annotators.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    eval_id INTEGER PRIMARY KEY,
+    position INTEGER,
+    reviews INTEGER NOT NULL DEFAULT 0,
+    leased INTEGER NOT NULL DEFAULT 0,
+    -- Target reviews minus finished reviews and active leases
+    remaining INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS open_items ON items (position) WHERE remaining > 0 AND position IS NOT NULL;
+CREATE TABLE IF NOT EXISTS leases (
+    annotator TEXT NOT NULL,
+    eval_id INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (annotator, eval_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lease_expiry ON leases (expires);
+CREATE TABLE IF NOT EXISTS reviews (
+    annotator TEXT NOT NULL,
+    eval_id INTEGER NOT NULL,
+    completed REAL NOT NULL,
+    PRIMARY KEY (annotator, eval_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID;
+"""
+
+CLAIM_QUERY = """
+SELECT eval_id, position FROM items
+WHERE remaining > 0 AND position IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM reviews WHERE reviews.annotator = :annotator AND reviews.eval_id = items.eval_id)
+ORDER BY position
+LIMIT 1
+"""
+
+SYNC_CHUNK = 10_000
+
+# (eval_id, position, lease expiry)
+Lease = Tuple[int, int, float]
+
+
+class WorkQueue:
+    def __init__(self, path: str, target_reviews: int = 1, lease_seconds: float = 600.0):
+        self.path = path
+        self.target_reviews = target_reviews
+        self.lease_seconds = lease_seconds
+        # Autocommit mode, so transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _transaction(self, work):
+        """Run ``work(conn)`` holding the database write lock, shared with other processes."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def sync(self, items: Iterable[Tuple[int, int]], source: str):
+        """Make the queue hold exactly ``items`` as (eval_id, position) for ``source``.
+
+        Review counts of evaluations already known are kept. Evaluations that
+        left the set get no position and are never handed out again. Nothing
+        happens when ``source`` and the target are unchanged, so every server
+        process can call this on startup.
+        """
+        def work(conn):
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if meta.get('target') is not None and meta['target'] != self.target_reviews:
+                conn.execute("UPDATE items SET remaining = remaining + ?", (self.target_reviews - meta['target'],))
+            if meta.get('source') != source:
+                conn.execute("UPDATE items SET position = NULL")
+                batch = []
+                for item in items:
+                    batch.append((item[0], item[1], self.target_reviews))
+                    if len(batch) >= SYNC_CHUNK:
+                        self._upsert(conn, batch)
+                        batch = []
+                self._upsert(conn, batch)
+            conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                             [('source', source), ('target', self.target_reviews)])
+
+        self._transaction(work)
+
+    @staticmethod
+    def _upsert(conn: sqlite3.Connection, batch):
+        conn.executemany(
+            """INSERT INTO items (eval_id, position, remaining) VALUES (?, ?, ?)
+               ON CONFLICT (eval_id) DO UPDATE SET position = excluded.position""",
+            batch
+        )
+
+    @staticmethod
+    def _reclaim(conn: sqlite3.Connection, now: float) -> int:
+        expired = conn.execute("SELECT eval_id FROM leases WHERE expires < ?", (now,)).fetchall()
+        if expired:
+            conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            conn.executemany("UPDATE items SET leased = leased - 1, remaining = remaining + 1 WHERE eval_id = ?", expired)
+        return len(expired)
+
+    def claim(self, annotator: str) -> Optional[Lease]:
+        """The annotator's current lease, renewed, or a new one; None when nothing needs them."""
+        def work(conn):
+            now = time.time()
+            expires = now + self.lease_seconds
+            self._reclaim(conn, now)
+            held = conn.execute(
+                """SELECT leases.eval_id, items.position FROM leases JOIN items USING (eval_id)
+                   WHERE leases.annotator = ? AND items.position IS NOT NULL
+                   ORDER BY items.position LIMIT 1""",
+                (annotator,)
+            ).fetchone()
+            if held is not None:
+                conn.execute("UPDATE leases SET expires = ? WHERE annotator = ? AND eval_id = ?",
+                             (expires, annotator, held[0]))
+                return held[0], held[1], expires
+            row = conn.execute(CLAIM_QUERY, {'annotator': annotator}).fetchone()
+            if row is None:
+                return None
+            conn.execute("INSERT INTO leases (annotator, eval_id, expires) VALUES (?, ?, ?)", (annotator, row[0], expires))
+            conn.execute("UPDATE items SET leased = leased + 1, remaining = remaining - 1 WHERE eval_id = ?", (row[0],))
+            return row[0], row[1], expires
+
+        return self._transaction(work)
+
+    def complete(self, annotator: str, eval_id: int):
+        """Record the annotator's review of ``eval_id``, releasing their lease on it."""
+        def work(conn):
+            now = time.time()
+            if conn.execute("SELECT 1 FROM reviews WHERE annotator = ? AND eval_id = ?", (annotator, eval_id)).fetchone():
+                return
+            conn.execute("INSERT INTO reviews (annotator, eval_id, completed) VALUES (?, ?, ?)", (annotator, eval_id, now))
+            held = conn.execute("DELETE FROM leases WHERE annotator = ? AND eval_id = ?", (annotator, eval_id)).rowcount
+            # With the lease still held it becomes the review; otherwise the review takes a fresh slot
+            conn.execute("UPDATE items SET reviews = reviews + 1, leased = leased - ?, remaining = remaining - ? "
+                         "WHERE eval_id = ?", (held, 1 - held, eval_id))
+
+        self._transaction(work)
+
+    def release(self, annotator: str):
+        """Give back every lease the annotator holds, e.g. when they reset their session."""
+        def work(conn):
+            held = conn.execute("SELECT eval_id FROM leases WHERE annotator = ?", (annotator,)).fetchall()
+            conn.execute("DELETE FROM leases WHERE annotator = ?", (annotator,))
+            conn.executemany("UPDATE items SET leased = leased - 1, remaining = remaining + 1 WHERE eval_id = ?", held)
+
+        self._transaction(work)
+
+    def progress(self) -> Dict[str, Any]:
+        with self._lock:
+            items, done, reviews, leased = self._conn.execute(
+                """SELECT COUNT(*), COALESCE(SUM(reviews >= ?), 0), COALESCE(SUM(reviews), 0), COALESCE(SUM(leased), 0)
+                   FROM items WHERE position IS NOT NULL""",
+                (self.target_reviews,)
+            ).fetchone()
+            annotators = self._conn.execute("SELECT COUNT(DISTINCT annotator) FROM reviews").fetchone()[0]
+        return {'images': items, 'complete': done, 'reviews': reviews, 'leased': leased,
+                'annotators': annotators, 'target': self.target_reviews}
+
+
+_queue: Optional[WorkQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_work_queue() -> Optional[WorkQueue]:
+    """Process-wide queue, or None when ``EVALUATOR_WORK_QUEUE`` is empty."""
+    global _queue
+    if not settings.WORK_QUEUE_PATH:
+        return None
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = WorkQueue(os.path.abspath(settings.WORK_QUEUE_PATH), settings.REVIEWS_PER_IMAGE,
+                                   settings.LEASE_SECONDS)
+    return _queue